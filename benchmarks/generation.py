@@ -0,0 +1,417 @@
+"""
+Point generation benchmark for popLing
+
+Builds synthetic density rasters and polygon layers of controlled size and
+vertex complexity (squares, regular polygons, jagged stars and fractal
+coastlines; 1 to 100k polygons), runs the generator over a matrix of raster
+points per sample width and density range configurations, and prints one
+JSON object per case (NDJSON) with cells/sec, points/sec and peak memory.
+Each case runs in a fresh interpreter so its peak memory is its own.
+
+    python benchmarks/generation.py [--matrix quick|full] [--engines core]
+        [--shapes square,coastline] [--polygons 1,100] [--widths 1,2]
+        [--ranges classic,many] [--output results.ndjson]
+        [--compare baseline.ndjson --tolerance 0.2]
+
+``cells`` is the number of sample cells covering the polygons (their area
+over the squared cell size), the same for every engine and version, so
+rates can be compared across runs. With ``--compare`` the run fails if any
+case's points/sec dropped by more than ``--tolerance`` against the matching
+case of an earlier run.
+
+The ``core`` engine (popLing_core.generate_points) needs only NumPy; the
+vectorized, parallel and classic engines need an interpreter where ``qgis``
+and GDAL are importable (e.g. the one shipped with QGIS).
+"""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SEED = 20240601
+ENGINES = ("core", "vectorized", "parallel", "classic")
+SHAPES = ("square", "regular", "star", "coastline")
+
+# Density range configurations. "linear" is the continuous model over the
+# classic ranges; "total" places an exact number of points per polygon
+RANGE_CONFIGS = {
+    "single": [{"min": 0.0, "max": 1e12, "points_per_cell": 1.0}],
+    "classic": [
+        {"min": 10.0, "max": 200.0, "points_per_cell": 0.3},
+        {"min": 200.0, "max": 4000.0, "points_per_cell": 1.0},
+        {"min": 4000.0, "max": 25000.0, "points_per_cell": 5.0},
+    ],
+    "many": [
+        {"min": 10.0 ** (i / 8.0), "max": 10.0 ** ((i + 1) / 8.0), "points_per_cell": 0.05 * (i + 1)}
+        for i in range(48)
+    ],
+}
+RANGE_CONFIGS["linear"] = RANGE_CONFIGS["classic"]
+RANGE_CONFIGS["total"] = RANGE_CONFIGS["classic"]
+TOTAL_PER_POLYGON = 1000
+
+MATRICES = {
+    "quick": {
+        "shapes": ["square", "coastline"],
+        "polygons": [1, 100],
+        "widths": [1.0, 2.0],
+        "ranges": ["classic"],
+    },
+    "full": {
+        "shapes": list(SHAPES),
+        "polygons": [1, 100, 10000, 100000],
+        "widths": [1.0, 2.0, 5.0],
+        "ranges": list(RANGE_CONFIGS),
+    },
+}
+
+
+def density_raster(size, seed=SEED, blobs=40):
+    """Synthetic population-like density raster, (size, size) float64.
+
+    Gaussian settlement blobs with log-normal amplitudes over a low
+    background, multiplied by per-pixel log-normal noise; pixels below 8
+    are set to 0, which the generator treats as no value. Pixels are 1 unit
+    wide with the top-left corner at (0, size).
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    centers = np.arange(size, dtype=np.float64) + 0.5
+    field = np.full((size, size), 20.0)
+    for _ in range(blobs):
+        cx, cy = rng.uniform(0, size, 2)
+        radius = rng.uniform(0.02, 0.15) * size
+        amplitude = rng.lognormal(7.0, 1.0)
+        across = np.exp(-((centers - cx) / radius) ** 2 / 2)
+        down = np.exp(-((centers - cy) / radius) ** 2 / 2)
+        field += amplitude * np.outer(down, across)
+    field *= rng.lognormal(0.0, 0.5, field.shape)
+    field[field < 8] = 0.0
+    return field
+
+
+def polygon_ring(shape, vertices, cx, cy, radius, rng):
+    """One ring (N, 2) of ``shape`` within ``radius`` of (cx, cy).
+
+    The first vertex is not repeated. Every shape is star-shaped around its
+    center, so rings never self-intersect. ``vertices`` is ignored for
+    squares.
+    """
+    import numpy as np
+
+    if shape == "square":
+        half = radius / math.sqrt(2)
+        return np.array([[cx - half, cy - half], [cx + half, cy - half],
+                         [cx + half, cy + half], [cx - half, cy + half]])
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    if shape == "regular":
+        radii = np.full(vertices, radius)
+    elif shape == "star":
+        radii = np.where(np.arange(vertices) % 2, 0.45, 1.0) * radius
+    elif shape == "coastline":
+        # Fractal radial profile: octaves of random-phase waves whose
+        # amplitude falls off as frequency^-0.7, up to the vertex count
+        profile = np.zeros(vertices)
+        frequency = 1
+        while frequency < vertices / 2:
+            phase = rng.uniform(0, 2 * np.pi)
+            profile += frequency ** -0.7 * rng.normal() * np.sin(frequency * angles + phase)
+            frequency *= 2
+        profile /= max(np.abs(profile).max(), 1e-12)
+        radii = radius * (0.65 + 0.35 * profile)
+    else:
+        raise ValueError(f"Unknown shape: {shape}")
+    return np.column_stack([cx + radii * np.cos(angles), cy + radii * np.sin(angles)])
+
+
+def polygon_layout(count, shape, vertices, extent, seed=SEED):
+    """``count`` polygons laid out on a square grid across [0, extent]².
+
+    Returns a list of (key, [ring]) pairs with keys 1..count, the feature
+    ids a memory layer assigns.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed + 1)
+    per_row = math.ceil(math.sqrt(count))
+    spacing = extent / per_row
+    polygons = []
+    for index in range(count):
+        row, col = divmod(index, per_row)
+        ring = polygon_ring(shape, vertices, (col + 0.5) * spacing, extent - (row + 0.5) * spacing,
+                            0.45 * spacing, rng)
+        polygons.append((index + 1, [ring]))
+    return polygons
+
+
+def ring_area(ring):
+    """Shoelace area of an (N, 2) ring"""
+    import numpy as np
+
+    x = ring[:, 0]
+    y = ring[:, 1]
+    return abs(float((x * (np.roll(y, -1) - np.roll(y, 1))).sum())) / 2
+
+
+def run_core(case, raster, polygons):
+    """Time popLing_core.generate_points; returns (seconds, points)"""
+    import popLing_core as core
+
+    values = core.ArrayRaster(raster, 0.0, raster.shape[0], 1.0, 1.0)
+    points = [0]
+
+    def count(key, xs, ys):
+        points[0] += xs.size
+
+    start = time.perf_counter()
+    core.generate_points(
+        polygons, values.values_at, RANGE_CONFIGS[case["ranges"]], case["sample_width"],
+        seed=SEED, on_chunk=count,
+        density_model="linear" if case["ranges"] == "linear" else "ranges",
+        totals=TOTAL_PER_POLYGON if case["ranges"] == "total" else None)
+    return time.perf_counter() - start, points[0]
+
+
+def run_qgis(case, raster, polygons, folder):
+    """Time a PointGenerator engine on a GeoTIFF and a memory layer; returns (seconds, points)"""
+    from osgeo import gdal
+    from qgis.core import (
+        QgsApplication, QgsCoordinateReferenceSystem, QgsFeature, QgsGeometry, QgsPointXY,
+        QgsRasterLayer, QgsVectorLayer,
+    )
+    from popLing_engine import PointGenerator
+
+    app = QgsApplication([], False)
+    app.initQgis()
+    crs = QgsCoordinateReferenceSystem("EPSG:3857")
+    path = os.path.join(folder, "density.tif")
+    dataset = gdal.GetDriverByName("GTiff").Create(
+        path, raster.shape[1], raster.shape[0], 1, gdal.GDT_Float32, ["TILED=YES"])
+    dataset.SetGeoTransform((0.0, 1.0, 0.0, float(raster.shape[0]), 0.0, -1.0))
+    dataset.SetProjection(crs.toWkt())
+    dataset.GetRasterBand(1).WriteArray(raster)
+    dataset = None
+    raster_layer = QgsRasterLayer(path, "density", "gdal")
+
+    layer = QgsVectorLayer("Polygon?crs=EPSG:3857", "polygons", "memory")
+    features = []
+    for _, rings in polygons:
+        feature = QgsFeature()
+        feature.setGeometry(QgsGeometry.fromPolygonXY(
+            [[QgsPointXY(x, y) for x, y in ring.tolist()] for ring in rings]))
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+
+    generator = PointGenerator()
+    generate = {
+        "vectorized": generator.generate_points_vectorized,
+        "parallel": generator.generate_points_parallel,
+        "classic": generator.generate_points_in_polygon,
+    }[case["engine"]]
+    points = [0]
+
+    def count(xs, ys):
+        points[0] += len(xs)
+
+    start = time.perf_counter()
+    generate(
+        layer, raster_layer.dataProvider(), RANGE_CONFIGS[case["ranges"]],
+        raster_points_per_sample_width=case["sample_width"], on_chunk=count, seed=SEED,
+        density_model="linear" if case["ranges"] == "linear" else "ranges",
+        total_points=TOTAL_PER_POLYGON if case["ranges"] == "total" else None)
+    seconds = time.perf_counter() - start
+    app.exitQgis()
+    return seconds, points[0]
+
+
+def max_rss_mb():
+    """Peak resident memory of this process in MB, or None where unavailable"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def run_case(case):
+    """Child process: build the inputs, run one case and print its JSON result"""
+    import tempfile
+
+    sys.path.insert(0, PLUGIN_DIR)
+    raster = density_raster(case["raster_size"])
+    polygons = polygon_layout(case["polygons"], case["shape"], case["vertices"], case["raster_size"])
+    setup_rss = max_rss_mb()
+    if case["engine"] == "core":
+        seconds, points = run_core(case, raster, polygons)
+    else:
+        with tempfile.TemporaryDirectory() as folder:
+            seconds, points = run_qgis(case, raster, polygons, folder)
+    cells = sum(ring_area(rings[0]) for _, rings in polygons) / case["sample_width"] ** 2
+    print(json.dumps({
+        "seconds": seconds,
+        "cells": int(round(cells)),
+        "points": points,
+        "setup_rss_mb": setup_rss,
+        "max_rss_mb": max_rss_mb(),
+    }))
+
+
+def environment():
+    """Plugin version, git commit and interpreter details recorded with every result"""
+    version = None
+    try:
+        with open(os.path.join(PLUGIN_DIR, "metadata.txt"), encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("version="):
+                    version = line.split("=", 1)[1].strip()
+    except OSError:
+        pass
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PLUGIN_DIR,
+            capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {
+        "version": version,
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": numpy_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def case_key(record):
+    """Fields identifying a case, for matching results across runs"""
+    return tuple(record.get(field) for field in (
+        "engine", "shape", "vertices", "polygons", "raster_size", "sample_width", "ranges"))
+
+
+def load_baseline(path):
+    """Results of an earlier run, by case"""
+    baseline = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                baseline[case_key(record)] = record
+    return baseline
+
+
+def csv_list(kind):
+    """argparse type for comma-separated lists"""
+    def parse(text):
+        return [kind(item) for item in text.split(",") if item.strip()]
+    return parse
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--matrix", choices=sorted(MATRICES), default="quick",
+                        help="preset case matrix; the options below override its axes")
+    parser.add_argument("--engines", type=csv_list(str), default=["core"], help=f"any of {', '.join(ENGINES)}")
+    parser.add_argument("--shapes", type=csv_list(str), help=f"any of {', '.join(SHAPES)}")
+    parser.add_argument("--polygons", type=csv_list(int), help="polygon counts, e.g. 1,100,100000")
+    parser.add_argument("--vertices", type=int, default=1000, help="vertices per polygon (not squares)")
+    parser.add_argument("--widths", type=csv_list(float), help="raster points per sample width")
+    parser.add_argument("--ranges", type=csv_list(str), help=f"any of {', '.join(RANGE_CONFIGS)}")
+    parser.add_argument("--raster-size", type=int, default=2000, help="raster width and height in pixels")
+    parser.add_argument("--repeat", type=int, default=3, help="fresh interpreters per case (median time)")
+    parser.add_argument("--output", help="append results to this NDJSON file as well")
+    parser.add_argument("--compare", help="NDJSON results of an earlier run to check against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative drop in points/sec with --compare")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_case(json.loads(args.child))
+        return 0
+
+    matrix = dict(MATRICES[args.matrix])
+    for axis in ("shapes", "polygons", "widths", "ranges"):
+        if getattr(args, axis):
+            matrix[axis] = getattr(args, axis)
+    unknown = (sorted(set(args.engines) - set(ENGINES)) + sorted(set(matrix["shapes"]) - set(SHAPES)) +
+               sorted(set(matrix["ranges"]) - set(RANGE_CONFIGS)))
+    if unknown:
+        parser.error(f"unknown engine, shape or range configuration: {', '.join(unknown)}")
+
+    baseline = load_baseline(args.compare) if args.compare else {}
+    env = environment()
+    output = open(args.output, "a", encoding="utf-8") if args.output else None
+    failures = []
+    try:
+        for engine, shape, polygons, width, ranges in itertools.product(
+                args.engines, matrix["shapes"], matrix["polygons"], matrix["widths"], matrix["ranges"]):
+            case = {
+                "engine": engine, "shape": shape,
+                "vertices": 4 if shape == "square" else args.vertices,
+                "polygons": polygons, "raster_size": args.raster_size,
+                "sample_width": width, "ranges": ranges,
+            }
+            runs = []
+            for _ in range(max(1, args.repeat)):
+                result = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--child", json.dumps(case)],
+                    capture_output=True, text=True)
+                if result.returncode != 0:
+                    print(result.stderr, file=sys.stderr)
+                    failures.append(f"{case_key(case)}: the run raised an error")
+                    break
+                runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+            if not runs:
+                continue
+            seconds = statistics.median(run["seconds"] for run in runs)
+            record = dict(case, benchmark="generation", **env)
+            record.update({
+                "seconds": seconds,
+                "cells": runs[0]["cells"],
+                "points": runs[0]["points"],
+                "cells_per_sec": runs[0]["cells"] / seconds if seconds > 0 else None,
+                "points_per_sec": runs[0]["points"] / seconds if seconds > 0 else None,
+                "setup_rss_mb": max(run["setup_rss_mb"] or 0 for run in runs) or None,
+                "max_rss_mb": max(run["max_rss_mb"] or 0 for run in runs) or None,
+                "repeat": len(runs),
+            })
+            line = json.dumps(record)
+            print(line, flush=True)
+            if output is not None:
+                output.write(line + "\n")
+                output.flush()
+            previous = baseline.get(case_key(record))
+            if previous and previous.get("points_per_sec") and record["points_per_sec"] is not None:
+                change = record["points_per_sec"] / previous["points_per_sec"] - 1
+                if change < -args.tolerance:
+                    failures.append(
+                        f"{case_key(record)}: points/sec {record['points_per_sec']:.0f} "
+                        f"is {-change:.0%} below {previous['points_per_sec']:.0f}")
+    finally:
+        if output is not None:
+            output.close()
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
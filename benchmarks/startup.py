@@ -0,0 +1,111 @@
+"""
+Startup benchmark for the popLing plugin
+
+Measures what QGIS pays for popLing on every launch: importing the plugin
+package and creating the plugin object through classFactory(), with QGIS
+and PyQt already imported as they are inside QGIS. Each repeat runs in a
+fresh interpreter. Fails if the median exceeds the budget, if loading
+imports NumPy, the engines, the dialog, the Processing provider, the
+output or statistics helpers or the logging module, or if it writes any
+file in the plugin directory.
+
+    python benchmarks/startup.py [--budget-ms 50] [--repeat 5]
+
+Needs an interpreter where ``qgis`` is importable (e.g. the one shipped
+with QGIS; set QT_QPA_PLATFORM=offscreen on a headless machine).
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be imported once the plugin is used, not by classFactory()
+DEFERRED_MODULES = (
+    "numpy",
+    "popLing.popLing_cache",
+    "popLing.popLing_core",
+    "popLing.popLing_dialog",
+    "popLing.popLing_engine",
+    "popLing.popLing_log",
+    "popLing.popLing_output",
+    "popLing.popLing_parallel",
+    "popLing.popLing_processing",
+    "popLing.popLing_raster",
+    "popLing.popLing_stats",
+    "popLing.popLing_task",
+)
+
+CHILD = r"""
+import importlib.util, json, sys, time
+import qgis.core, qgis.PyQt.QtCore, qgis.PyQt.QtGui, qgis.PyQt.QtWidgets
+before = set(sys.modules)
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location(
+    "popLing", sys.argv[1] + "/__init__.py", submodule_search_locations=[sys.argv[1]])
+package = importlib.util.module_from_spec(spec)
+sys.modules["popLing"] = package
+spec.loader.exec_module(package)
+package.classFactory(None)
+elapsed = time.perf_counter() - start
+print(json.dumps({"ms": elapsed * 1000.0, "imported": sorted(set(sys.modules) - before)}))
+"""
+
+
+def snapshot(path):
+    """(path, size, mtime) of every file under the plugin directory except bytecode caches"""
+    files = set()
+    for root, dirs, names in os.walk(path):
+        dirs[:] = [d for d in dirs if d not in ("__pycache__", ".git")]
+        for name in names:
+            full = os.path.join(root, name)
+            stat = os.stat(full)
+            files.add((full, stat.st_size, stat.st_mtime_ns))
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=50.0, help="median load time budget")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters to time")
+    args = parser.parse_args()
+
+    files_before = snapshot(PLUGIN_DIR)
+    timings = []
+    imported = set()
+    for _ in range(args.repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", CHILD, PLUGIN_DIR], capture_output=True, text=True)
+        if result.returncode != 0:
+            print(result.stderr, file=sys.stderr)
+            print("FAIL: loading the plugin raised an error")
+            return 1
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        timings.append(report["ms"])
+        imported.update(report["imported"])
+    files_after = snapshot(PLUGIN_DIR)
+
+    median = statistics.median(timings)
+    print(f"plugin load: median {median:.1f} ms, min {min(timings):.1f} ms, "
+          f"max {max(timings):.1f} ms over {len(timings)} runs (budget {args.budget_ms:.0f} ms)")
+    failures = []
+    if median > args.budget_ms:
+        failures.append(f"median load time {median:.1f} ms exceeds the {args.budget_ms:.0f} ms budget")
+    eager = sorted(m for m in DEFERRED_MODULES if m in imported)
+    if eager:
+        failures.append(f"imported at load time: {', '.join(eager)}")
+    written = sorted({path for path, _, _ in files_after ^ files_before})
+    if written:
+        failures.append(f"files written at load time: {', '.join(written)}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
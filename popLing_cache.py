@@ -0,0 +1,117 @@
+"""
+Sample grid cache for popLing
+
+The sample grid of a run - every polygon's sample cells, their boundary
+decomposition and the raster values at their centers (core.CellGrid) -
+depends on the polygon layer, the raster layer and how the raster is
+sampled, but not on the density ranges, density model or seed, which are
+what one iterates on. Complete grids are cached per combination of layers
+and sampling settings, so such a re-run redraws its points without fetching
+a feature or reading the raster. Editing either layer or rewriting its file
+invalidates its entries, and the least recently used grids are evicted
+beyond MAX_CACHE_BYTES.
+"""
+
+import threading
+from collections import OrderedDict
+
+try:
+    from . import popLing_core as core
+    from .popLing_stats import source_stamp
+except ImportError:
+    import popLing_core as core
+    from popLing_stats import source_stamp
+
+
+# Memory budget of all cached grids together; a grid that would not fit on
+# its own stops filling and is not cached
+MAX_CACHE_BYTES = core.CELL_GRID_BYTES
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+# Layer id -> number of times its data changed, part of every key so a grid
+# filled while its layer was edited is never stored
+_generation = {}
+_watched = set()
+
+
+def _layer_state(layer):
+    return (
+        layer.id(), _generation.get(layer.id(), 0), layer.providerType(), layer.source(),
+        layer.subsetString() if hasattr(layer, "subsetString") else "",
+        source_stamp(layer), layer.crs().toWkt())
+
+
+def grid_key(polygon_layer, raster_layer, raster_points_per_sample_width, crs_mode="transform",
+             resample="nearest"):
+    """Cache key of the sample grid of a run over these layers with these settings"""
+    return (
+        _layer_state(polygon_layer), _layer_state(raster_layer),
+        (float(raster_points_per_sample_width), crs_mode, resample))
+
+
+def _invalidate(layer_id):
+    """Forget the grids of a layer whose data changed or that was removed"""
+    with _cache_lock:
+        _generation[layer_id] = _generation.get(layer_id, 0) + 1
+        for key in [key for key in _cache if layer_id in (key[0][0], key[1][0])]:
+            del _cache[key]
+
+
+def _forget_layer(layer_id):
+    _invalidate(layer_id)
+    _watched.discard(layer_id)
+
+
+def _watch(layer):
+    """Invalidate a layer's grids whenever its data changes (edits, provider reloads)"""
+    layer_id = layer.id()
+    if layer_id in _watched:
+        return
+    _watched.add(layer_id)
+    layer.dataChanged.connect(lambda: _invalidate(layer_id))
+    layer.willBeDeleted.connect(lambda: _forget_layer(layer_id))
+
+
+def cell_grid(key, polygon_layer, raster_layer):
+    """The cached complete grid for ``key``, or a new core.CellGrid for the run to fill.
+
+    Hand a filled grid to remember() once the run has finished.
+    """
+    _watch(polygon_layer)
+    _watch(raster_layer)
+    with _cache_lock:
+        grid = _cache.get(key)
+        if grid is not None and grid.complete:
+            _cache.move_to_end(key)
+            return grid
+    return core.CellGrid(MAX_CACHE_BYTES)
+
+
+def remember(key, grid):
+    """Cache a grid a run has completed; returns whether it was stored.
+
+    Grids whose layers changed since ``key`` was made are dropped, as are
+    older grids of the same layers and settings (e.g. from before the
+    raster file was rewritten).
+    """
+    if not grid.complete:
+        return False
+    with _cache_lock:
+        if any(_generation.get(state[0], 0) != state[1] for state in key[:2]):
+            return False
+        for other in [other for other in _cache
+                      if other[0][0] == key[0][0] and other[1][0] == key[1][0] and other[2] == key[2]]:
+            del _cache[other]
+        _cache[key] = grid
+        total = sum(cached.nbytes for cached in _cache.values())
+        while total > MAX_CACHE_BYTES and len(_cache) > 1:
+            _, evicted = _cache.popitem(last=False)
+            total -= evicted.nbytes
+    return True
+
+
+def clear_cache():
+    """Forget all cached grids"""
+    with _cache_lock:
+        _cache.clear()
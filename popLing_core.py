@@ -0,0 +1,1484 @@
+"""
+NumPy sampling routines for popLing
+
+Everything in this module works on plain arrays and imports nothing from
+QGIS, so it loads in milliseconds under plain Python. The QGIS engines in
+popLing_engine and the worker processes in popLing_parallel are thin adapters
+around it; generate_points() runs the whole pipeline on polygon rings and
+a raster array without QGIS at all.
+"""
+
+import contextlib
+import math
+from collections import namedtuple
+
+import numpy as np
+
+
+# Same per-cell cap as the per-cell loop of the classic engine (popLing_engine)
+MAX_POINTS_PER_CELL = 10000
+
+# Edge length, in sample cells, of the tiles polygon grids are processed in.
+# Tiles are also the unit of random streams, so this is fixed: changing it
+# changes the output for a given seed.
+TILE_CELLS = 512
+
+
+# How raster values are read for a sample cell: the full-resolution pixel
+# under the cell center, the closest raster overview no coarser than the
+# cell, or the mean / sum of the full-resolution pixels in the cell
+RESAMPLE_MODES = ("nearest", "overview", "mean", "sum")
+
+# How raster values map to points per cell: the step function of the
+# density ranges, or an expected count that varies continuously with the
+# value (interpolated between the ranges linearly or in log space, or along
+# a user-supplied lookup curve) with counts drawn from a Poisson distribution
+DENSITY_MODELS = ("ranges", "linear", "log", "lookup")
+
+# Exact-total allocation: spawn-key row of the stream that splits a
+# polygon's total between its tiles (tile rows never get this large) and the
+# most points jittered and handed on at once
+ALLOCATION_STREAM = 2 ** 32
+MAX_CHUNK_POINTS = 4000000
+
+# Rows per PointBuffer chunk: 16 MB of coordinates
+POINT_BUFFER_CHUNK = 1 << 20
+
+# Default memory budget of a CellGrid (about 10 million sample cells)
+CELL_GRID_BYTES = 512 * 1024 * 1024
+
+# A 2D point as little-endian WKB: byte order (1), geometry type (1 = Point),
+# x, y; unaligned, so records pack back to back at 21 bytes each
+WKB_POINT = np.dtype([("order", "u1"), ("type", "<u4"), ("x", "<f8"), ("y", "<f8")])
+
+
+def new_seed():
+    """A fresh random seed, small enough to type back into the dialog"""
+    return int(np.random.SeedSequence().entropy % (2 ** 31 - 1)) + 1
+
+
+def profile_stage(profile, name):
+    """Context manager timing stage ``name`` on ``profile``, a no-op when it is None.
+
+    ``profile`` is anything with a ``stage(name)`` context manager, normally
+    a popLing_profile.RunProfile; this module does not import it.
+    """
+    if profile is None:
+        return contextlib.nullcontext()
+    return profile.stage(name)
+
+
+def tile_rng(seed, polygon_key, tile_row=0, tile_col=0, surface=0):
+    """Independent counter-based (Philox) random stream for one polygon tile.
+
+    Streams depend only on the seed, the polygon's feature id and the tile
+    position, so results do not depend on processing order, worker count or
+    how results are chunked. In multi-surface runs (sample_grid_surfaces)
+    each further ``surface`` gets a stream of its own; surface 0 uses the
+    single-surface stream.
+    """
+    spawn_key = (int(polygon_key) % 2 ** 64, int(tile_row), int(tile_col))
+    if surface:
+        spawn_key += (int(surface),)
+    sequence = np.random.SeedSequence(int(seed), spawn_key=spawn_key)
+    return np.random.Generator(np.random.Philox(sequence))
+
+
+def overview_factor(factors, sample_width):
+    """Largest overview decimation factor that is not coarser than a sample cell.
+
+    ``factors`` are the raster's overview factors (2, 4, 8, ...) and
+    ``sample_width`` the sample cell width in raster pixels. Returns 1 (full
+    resolution) when no overview fits.
+    """
+    usable = [f for f in factors if 1 < f <= sample_width * (1 + 1e-9)]
+    return max(usable) if usable else 1
+
+
+def cell_half_size(sample_width, x_res, y_res):
+    """Half the height and width of a sample cell, in pixels of size ``x_res`` x ``y_res``.
+
+    Sample cells are square, ``sample_width`` times the finer pixel side.
+    """
+    cell_size = sample_width * min(x_res, y_res)
+    return cell_size / y_res / 2, cell_size / x_res / 2
+
+
+def _area_table(array):
+    """Summed-area table with a leading zero row and column"""
+    table = np.zeros((array.shape[0] + 1, array.shape[1] + 1))
+    table[1:, 1:] = array.cumsum(axis=0).cumsum(axis=1)
+    return table
+
+
+def _area_integral(table, rows, cols):
+    """Integral of the pixels from the window origin to continuous (rows, cols).
+
+    Within a pixel the integral of a piecewise constant image is bilinear,
+    so interpolating the summed-area table is exact.
+    """
+    i = np.minimum(np.floor(rows).astype(np.int64), table.shape[0] - 2)
+    j = np.minimum(np.floor(cols).astype(np.int64), table.shape[1] - 2)
+    fr = rows - i
+    fc = cols - j
+    return (
+        table[i, j] * (1 - fr) * (1 - fc) + table[i + 1, j] * fr * (1 - fc)
+        + table[i, j + 1] * (1 - fr) * fc + table[i + 1, j + 1] * fr * fc)
+
+
+def cell_aggregates(array, rows, cols, half_height, half_width, how="mean"):
+    """Mean or sum of the pixels of ``array`` under sample cells, ignoring NaN.
+
+    Cells are centered on (``rows``, ``cols``), continuous pixel coordinates
+    in ``array`` (pixel (i, j) covers [i, i + 1) x [j, j + 1)), and reach
+    ``half_height`` and ``half_width`` pixels either side. A pixel cut by a
+    cell edge counts with the part of its area inside the cell, so cells
+    that tile the raster share out every pixel and sums are conserved.
+    Parts outside ``array`` and NaN pixels are left out; cells with no
+    valid pixel area are NaN. ``how`` is "mean" or "sum".
+    """
+    rows = np.asarray(rows, dtype=np.float64)
+    cols = np.asarray(cols, dtype=np.float64)
+    height, width = array.shape
+    if not height or not width:
+        return np.full(rows.shape, np.nan)
+    valid = np.isfinite(array)
+    r0 = np.clip(rows - half_height, 0, height)
+    r1 = np.clip(rows + half_height, 0, height)
+    c0 = np.clip(cols - half_width, 0, width)
+    c1 = np.clip(cols + half_width, 0, width)
+
+    def rectangles(table):
+        return (
+            _area_integral(table, r1, c1) - _area_integral(table, r0, c1)
+            - _area_integral(table, r1, c0) + _area_integral(table, r0, c0))
+
+    totals = rectangles(_area_table(np.where(valid, array, 0.0)))
+    areas = rectangles(_area_table(valid.astype(np.float64)))
+    # Table differences leave rounding noise where no valid pixel is covered
+    empty = areas < 1e-9
+    result = totals / np.where(empty, 1.0, areas) if how == "mean" else totals
+    result[empty] = np.nan
+    return result
+
+
+def window_pixels(xs, ys, x_res, y_res):
+    """Pixel grid of a raster window laid over sample coordinates.
+
+    One pixel is centered on the smallest x and largest y sample coordinate,
+    so samples on a grid that steps by whole pixels sit on pixel centers
+    and the rest fall in the pixel whose center is nearest. Returns the
+    window's top-left corner (x_min, y_max) and every sample's row and
+    column in it.
+    """
+    x_min = float(xs.min()) - x_res / 2
+    y_max = float(ys.max()) + y_res / 2
+    cols = np.floor((xs - x_min) / x_res).astype(np.int64)
+    rows = np.floor((y_max - ys) / y_res).astype(np.int64)
+    return x_min, y_max, rows, cols
+
+
+def grid_size(extent, cell_size):
+    """Number of sample cells along an axis covering ``extent``.
+
+    Cells are centered on multiples of ``cell_size`` from the box minimum;
+    the last one is the first whose far edge reaches the box maximum, so the
+    cells cover the whole box.
+    """
+    return int(math.floor(extent / cell_size + 0.5)) + 1
+
+
+def grid_axes(x_min, x_max, y_min, y_max, cell_size):
+    """Sample grid coordinates (cell centers) for a bounding box.
+
+    Samples start at the box minimum and step by ``cell_size``; see
+    grid_size for where they stop.
+    """
+    nx = grid_size(x_max - x_min, cell_size)
+    ny = grid_size(y_max - y_min, cell_size)
+    xs = x_min + np.arange(nx, dtype=np.float64) * cell_size
+    ys = y_min + np.arange(ny, dtype=np.float64) * cell_size
+    return xs, ys
+
+
+def grid_cells(xs, ys):
+    """Flatten grid axes into per-cell center arrays (row-major, rows along y)"""
+    cx, cy = np.meshgrid(xs, ys)
+    return cx.ravel(), cy.ravel()
+
+
+class DensityRangeTable:
+    """Density ranges compiled into sorted breakpoints for bulk lookups.
+
+    Ranges are inclusive at both ends and the first matching range wins, as
+    in the original linear scan, but any number of (possibly overlapping)
+    ranges is resolved with a single ``searchsorted`` per block of values.
+    Ranges whose fields cannot be parsed as numbers are ignored.
+    """
+
+    def __init__(self, density_ranges):
+        self.ranges = []
+        bounds = []
+        points = []
+        for range_def in density_ranges:
+            try:
+                min_val = float(range_def["min"])
+                max_val = float(range_def["max"])
+                points_per_cell = float(range_def["points_per_cell"])
+            except (KeyError, ValueError, TypeError):
+                continue
+            self.ranges.append(range_def)
+            bounds.append((min_val, max_val))
+            points.append(points_per_cell)
+
+        # Elementary pieces of the value axis: each breakpoint b[i] is piece
+        # 2*i and the open interval (b[i], b[i+1]) is piece 2*i + 1
+        self.breakpoints = np.unique(np.array(bounds, dtype=np.float64).ravel())
+        pieces = np.empty(max(2 * len(self.breakpoints) - 1, 0))
+        pieces[0::2] = self.breakpoints
+        pieces[1::2] = (self.breakpoints[:-1] + self.breakpoints[1:]) / 2
+
+        # Paint in reverse so the first matching range ends up on top
+        self.piece_range = np.full(pieces.shape, -1, dtype=np.int64)
+        for index in range(len(bounds) - 1, -1, -1):
+            min_val, max_val = bounds[index]
+            self.piece_range[(pieces >= min_val) & (pieces <= max_val)] = index
+        self.range_points = np.array(points, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def range_index(self, values):
+        """Index into ``ranges`` for each value, -1 where no range matches"""
+        values = np.asarray(values, dtype=np.float64)
+        shape = values.shape
+        values = values.ravel()
+        position = np.searchsorted(self.breakpoints, values, side="left")
+        exact = position < len(self.breakpoints)
+        exact[exact] = self.breakpoints[position[exact]] == values[exact]
+        piece = np.where(exact, 2 * position, 2 * position - 1)
+        valid = np.isfinite(values) & (piece >= 0) & (piece < len(self.piece_range))
+        index = np.full(values.shape, -1, dtype=np.int64)
+        index[valid] = self.piece_range[piece[valid]]
+        return index.reshape(shape)
+
+    def points_per_cell(self, values):
+        """Points per cell for each value, NaN where no range matches"""
+        index = self.range_index(values)
+        result = np.full(index.shape, np.nan)
+        matched = index >= 0
+        result[matched] = self.range_points[index[matched]]
+        return result
+
+    def draw_counts(self, points_per_cell, rng):
+        """Number of points for each cell, see points_per_cell_counts"""
+        return points_per_cell_counts(points_per_cell, rng)
+
+
+class DensityCurve:
+    """Expected points per cell as a continuous function of the raster value.
+
+    The curve is piecewise linear through ``(values[i], points[i])`` anchors,
+    in value space or, with ``scale="log"``, in log10(value) space. Values
+    outside the anchors' span (and non-positive values on a log scale) get
+    no points, like values that match no density range. Counts are drawn
+    from a Poisson distribution around the expected value, so cells with the
+    same value get varying counts whose mean follows the curve.
+    """
+
+    def __init__(self, values, points, scale="linear"):
+        if scale not in ("linear", "log"):
+            raise ValueError(f"Unknown curve scale {scale!r}")
+        values = np.asarray(values, dtype=np.float64).ravel()
+        points = np.asarray(points, dtype=np.float64).ravel()
+        if values.size != points.size or values.size < 2:
+            raise ValueError("A density curve needs at least two (value, points) anchors")
+        if not (np.isfinite(values).all() and np.isfinite(points).all()):
+            raise ValueError("Density curve anchors must be finite numbers")
+        if (points < 0).any():
+            raise ValueError("Points per cell cannot be negative")
+        if scale == "log" and (values <= 0).any():
+            raise ValueError("Values on a log scale must be greater than 0")
+        order = np.argsort(values, kind="stable")
+        self.values = values[order]
+        self.points = points[order]
+        if (np.diff(self.values) <= 0).any():
+            raise ValueError("Density curve values must be distinct")
+        self.scale = scale
+        self._axis = np.log10(self.values) if scale == "log" else self.values
+
+    @classmethod
+    def from_ranges(cls, density_ranges, scale="linear"):
+        """Smooth curve through the midpoints of density ranges.
+
+        Each range contributes an anchor at its midpoint (geometric midpoint
+        on a log scale) with its points per cell; the curve is held flat from
+        there to the outer bounds of the first and last range, so it covers
+        the same values as the ranges.
+        """
+        table = density_ranges if isinstance(density_ranges, DensityRangeTable) else DensityRangeTable(density_ranges)
+        bounds = []
+        for range_def in table.ranges:
+            min_val = float(range_def["min"])
+            max_val = float(range_def["max"])
+            if scale == "log":
+                if min_val <= 0:
+                    raise ValueError("Range minimums must be greater than 0 on a log scale")
+                middle = math.sqrt(min_val * max_val)
+            else:
+                middle = (min_val + max_val) / 2
+            bounds.append((middle, min_val, max_val, float(range_def["points_per_cell"])))
+        if not bounds:
+            raise ValueError("No valid density ranges defined")
+        bounds.sort()
+        anchors = {}
+        # Outer bounds first so a midpoint landing on one takes precedence
+        anchors[min(b[1] for b in bounds)] = bounds[0][3]
+        anchors[max(b[2] for b in bounds)] = bounds[-1][3]
+        for middle, _, _, points in bounds:
+            anchors.setdefault(middle, points)
+        values = sorted(anchors)
+        return cls(values, [anchors[v] for v in values], scale)
+
+    def points_per_cell(self, values):
+        """Expected points per cell for each value, NaN outside the curve"""
+        values = np.asarray(values, dtype=np.float64)
+        result = np.full(values.shape, np.nan)
+        valid = np.isfinite(values) & (values >= self.values[0]) & (values <= self.values[-1])
+        axis = values[valid]
+        if self.scale == "log":
+            axis = np.log10(axis)
+        result[valid] = np.interp(axis, self._axis, self.points)
+        return result
+
+    def draw_counts(self, points_per_cell, rng):
+        """Number of points for each cell, see poisson_counts"""
+        return poisson_counts(points_per_cell, rng)
+
+
+def compile_density_model(density_ranges, model="ranges", curve=None):
+    """Compile the density settings into a DensityRangeTable or DensityCurve.
+
+    ``model`` is one of DENSITY_MODELS. "linear" and "log" smooth the
+    density ranges (DensityCurve.from_ranges); "lookup" uses ``curve``, a
+    sequence of (value, points_per_cell) pairs, interpolated linearly. An
+    already compiled DensityCurve is returned as is.
+    """
+    if isinstance(density_ranges, DensityCurve):
+        return density_ranges
+    if model == "ranges":
+        return density_ranges if isinstance(density_ranges, DensityRangeTable) else DensityRangeTable(density_ranges)
+    if model in ("linear", "log"):
+        return DensityCurve.from_ranges(density_ranges, model)
+    if model == "lookup":
+        pairs = np.asarray(curve if curve is not None else [], dtype=np.float64).reshape(-1, 2)
+        return DensityCurve(pairs[:, 0], pairs[:, 1])
+    raise ValueError(f"Unknown density model {model!r}")
+
+
+def classify_values(values, density_ranges):
+    """Points per cell for each raster value, NaN where no range matches.
+
+    ``density_ranges`` is a DensityRangeTable, a DensityCurve (expected
+    points per cell) or a list of range dicts. Zero and NaN values are
+    treated as missing.
+    """
+    if not isinstance(density_ranges, (DensityRangeTable, DensityCurve)):
+        density_ranges = DensityRangeTable(density_ranges)
+    values = np.asarray(values, dtype=np.float64)
+    points_per_cell = density_ranges.points_per_cell(values)
+    points_per_cell[values == 0] = np.nan
+    return points_per_cell
+
+
+def points_per_cell_counts(points_per_cell, rng):
+    """Draw the number of points for every cell in one pass.
+
+    Values >= 1 are truncated to an integer count (cells above
+    MAX_POINTS_PER_CELL get none); values below 1 are a Bernoulli draw.
+    """
+    points_per_cell = np.nan_to_num(
+        np.asarray(points_per_cell, dtype=np.float64), nan=0.0)
+    counts = np.zeros(points_per_cell.shape, dtype=np.int64)
+
+    whole = points_per_cell >= 1
+    whole_counts = np.floor(points_per_cell[whole])
+    whole_counts[whole_counts > MAX_POINTS_PER_CELL] = 0
+    counts[whole] = whole_counts.astype(np.int64)
+
+    fractional = (points_per_cell > 0) & ~whole
+    draws = rng.random(int(fractional.sum()))
+    counts[fractional] = draws < points_per_cell[fractional]
+    return counts
+
+
+def poisson_counts(expected, rng):
+    """Draw Poisson point counts around expected values in one pass.
+
+    NaN and non-positive expectations give no points, as do expectations
+    above MAX_POINTS_PER_CELL (matching points_per_cell_counts).
+    """
+    expected = np.nan_to_num(np.asarray(expected, dtype=np.float64), nan=0.0)
+    counts = np.zeros(expected.shape, dtype=np.int64)
+    drawn = (expected > 0) & (expected <= MAX_POINTS_PER_CELL)
+    counts[drawn] = rng.poisson(expected[drawn])
+    return counts
+
+
+def jitter_points(cx, cy, counts, cell_size, rng):
+    """Emit jittered points around cell centers as contiguous float64 arrays.
+
+    Each cell contributes ``counts[i]`` points drawn uniformly from the
+    ``cell_size`` square centered on it, using a single batched RNG call.
+    """
+    px = np.repeat(np.asarray(cx, dtype=np.float64), counts)
+    py = np.repeat(np.asarray(cy, dtype=np.float64), counts)
+    half = cell_size / 2
+    offsets = rng.uniform(-half, half, size=(2, px.size))
+    px += offsets[0]
+    py += offsets[1]
+    return px, py
+
+
+def polygon_edges(rings):
+    """Stack polygon rings into edge arrays (x1, y1, x2, y2).
+
+    ``rings`` is a sequence of (N, 2) vertex arrays covering every exterior
+    ring and hole of the polygon (or of all parts of a multipolygon). Rings
+    do not need to be explicitly closed.
+    """
+    starts = []
+    ends = []
+    for ring in rings:
+        ring = np.asarray(ring, dtype=np.float64).reshape(-1, 2)
+        if len(ring) < 3:
+            continue
+        starts.append(ring)
+        ends.append(np.roll(ring, -1, axis=0))
+    if not starts:
+        empty = np.empty(0)
+        return empty, empty, empty, empty
+    starts = np.concatenate(starts)
+    ends = np.concatenate(ends)
+    return starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]
+
+
+def _dilate(mask):
+    """3x3 binary dilation of a 2D boolean mask"""
+    grown = mask.copy()
+    grown[1:, :] |= mask[:-1, :]
+    grown[:-1, :] |= mask[1:, :]
+    result = grown.copy()
+    result[:, 1:] |= grown[:, :-1]
+    result[:, :-1] |= grown[:, 1:]
+    return result
+
+
+def rasterize_polygon(edges, grid_x, grid_y, cell_size):
+    """Burn a polygon into masks aligned with a sample grid.
+
+    Returns two (len(grid_y), len(grid_x)) boolean arrays:
+
+    - ``inside``: the cell center lies inside the polygon (even-odd rule, so
+      holes and multipart polygons work without special handling).
+    - ``boundary``: the polygon outline passes through or next to the cell.
+      Cells that are ``inside`` and not ``boundary`` are entirely covered by
+      the polygon; BoundaryCells resolves the others exactly.
+    """
+    x1, y1, x2, y2 = edges
+    nx = len(grid_x)
+    ny = len(grid_y)
+    inside = np.zeros((ny, nx), dtype=bool)
+    if nx == 0 or ny == 0 or len(x1) == 0:
+        return inside, np.zeros((ny, nx), dtype=bool)
+    x0 = grid_x[0]
+    y0 = grid_y[0]
+
+    # Scanline parity: every edge crossing the horizontal line through a row
+    # of centers toggles inside/outside for all centers to its right
+    sloped = y1 != y2
+    ex1, ey1, ex2, ey2 = x1[sloped], y1[sloped], x2[sloped], y2[sloped]
+    y_low = np.minimum(ey1, ey2)
+    y_high = np.maximum(ey1, ey2)
+    # Rows and columns are found by comparing with the grid coordinates
+    # themselves, and a row through an edge's end point crosses it exactly
+    # there, so BoundaryCells can continue from these parities consistently
+    row_start = np.searchsorted(grid_y, y_low, side="left")
+    row_end = np.searchsorted(grid_y, y_high, side="left")
+    spans = np.maximum(row_end - row_start, 0)
+    total = int(spans.sum())
+    if total:
+        edge = np.repeat(np.arange(len(spans)), spans)
+        offsets = np.cumsum(spans) - spans
+        rows = row_start[edge] + (np.arange(total) - offsets[edge])
+        y = grid_y[rows]
+        x = ex1[edge] + (y - ey1[edge]) * (ex2[edge] - ex1[edge]) / (ey2[edge] - ey1[edge])
+        x = np.where(y == ey2[edge], ex2[edge], x)
+        cols = np.searchsorted(grid_x, x, side="right")
+        crossings = np.bincount(rows * (nx + 1) + cols, minlength=ny * (nx + 1))
+        parity = np.cumsum(crossings.reshape(ny, nx + 1), axis=1)[:, :nx]
+        inside = (parity & 1).astype(bool)
+
+    # Outline cells: walk every edge in steps of at most half a cell and mark
+    # the cells hit, then grow by one cell so corner clips are never missed.
+    # Marked on a grid padded by one cell so a tile of a larger grid also
+    # sees outline cells just beyond its own edge.
+    padded = np.zeros((ny + 2, nx + 2), dtype=bool)
+    step = cell_size / 2
+    lengths = np.hypot(x2 - x1, y2 - y1)
+    samples = np.ceil(lengths / step).astype(np.int64) + 1
+    edge = np.repeat(np.arange(len(samples)), samples)
+    offsets = np.cumsum(samples) - samples
+    t = (np.arange(int(samples.sum())) - offsets[edge]) / np.maximum(samples[edge] - 1, 1)
+    sx = x1[edge] + t * (x2[edge] - x1[edge])
+    sy = y1[edge] + t * (y2[edge] - y1[edge])
+    cols = np.floor((sx - x0) / cell_size + 0.5).astype(np.int64) + 1
+    rows = np.floor((sy - y0) / cell_size + 0.5).astype(np.int64) + 1
+    valid = (cols >= 0) & (cols < nx + 2) & (rows >= 0) & (rows < ny + 2)
+    padded[rows[valid], cols[valid]] = True
+    boundary = _dilate(padded)[1:-1, 1:-1]
+    return inside, boundary
+
+
+def grid_tiles(nx, ny, tile_size):
+    """Split an (ny, nx) sample grid into (col0, col1, row0, row1) tiles"""
+    tile_size = max(1, int(tile_size))
+    for row0 in range(0, ny, tile_size):
+        for col0 in range(0, nx, tile_size):
+            yield col0, min(col0 + tile_size, nx), row0, min(row0 + tile_size, ny)
+
+
+def clip_edges(edges, grid_x, grid_y, cell_size):
+    """Edges that can affect the masks and boundary cells of a tile.
+
+    Keeps edges overlapping the tile's rows (plus a margin for the outline
+    mask) whose left end is not beyond the tile; edges further left must stay
+    because they decide inside/outside parity within the tile.
+    """
+    x1, y1, x2, y2 = edges
+    margin = 2 * cell_size
+    keep = (
+        (np.maximum(y1, y2) >= grid_y[0] - margin) &
+        (np.minimum(y1, y2) <= grid_y[-1] + margin) &
+        (np.minimum(x1, x2) <= grid_x[-1] + margin)
+    )
+    return x1[keep], y1[keep], x2[keep], y2[keep]
+
+
+def polygon_tile_count(x_min, x_max, y_min, y_max, cell_size, tile_cells=TILE_CELLS):
+    """Number of tiles polygon_tiles yields for a bounding box"""
+    nx = grid_size(x_max - x_min, cell_size)
+    ny = grid_size(y_max - y_min, cell_size)
+    return math.ceil(nx / tile_cells) * math.ceil(ny / tile_cells)
+
+
+def polygon_tiles(edges, x_min, x_max, y_min, y_max, cell_size, tile_cells=TILE_CELLS):
+    """Split a polygon's sample grid into tiles of at most tile_cells x tile_cells.
+
+    Yields (tile_row, tile_col, grid_x, grid_y, edges) per tile, with the
+    edges clipped to what the tile needs; a polygon that fits in one tile is
+    yielded whole as tile (0, 0).
+    """
+    grid_x, grid_y = grid_axes(x_min, x_max, y_min, y_max, cell_size)
+    if len(grid_x) <= tile_cells and len(grid_y) <= tile_cells:
+        yield 0, 0, grid_x, grid_y, edges
+        return
+    for col0, col1, row0, row1 in grid_tiles(len(grid_x), len(grid_y), tile_cells):
+        tile_x = grid_x[col0:col1]
+        tile_y = grid_y[row0:row1]
+        yield (row0 // tile_cells, col0 // tile_cells, tile_x, tile_y,
+               clip_edges(edges, tile_x, tile_y, cell_size))
+
+
+def _cell_pieces(edges, grid_x, grid_y, cell_size):
+    """Split polygon edges where they cross the borders of a grid's cells.
+
+    Edges are first clipped to the grid's extent. Returns (cell, edge, x1,
+    y1, x2, y2) arrays: the flat (row-major) index of the cell each
+    non-empty piece lies in, the index of the edge it belongs to, and the
+    piece's end points.
+    """
+    x1, y1, x2, y2 = (np.asarray(a, dtype=np.float64) for a in edges)
+    nx = len(grid_x)
+    ny = len(grid_y)
+    left = grid_x[0] - cell_size / 2
+    bottom = grid_y[0] - cell_size / 2
+    right = left + nx * cell_size
+    top = bottom + ny * cell_size
+    dx = x2 - x1
+    dy = y2 - y1
+
+    # Parameter range of each edge inside the grid extent (Liang-Barsky)
+    t0 = np.zeros(x1.size)
+    t1 = np.ones(x1.size)
+    keep = np.ones(x1.size, dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p, q in ((-dx, x1 - left), (dx, right - x1), (-dy, y1 - bottom), (dy, top - y1)):
+            parallel = p == 0
+            keep &= ~(parallel & (q < 0))
+            t = q / p
+            t0 = np.where(~parallel & (p < 0), np.maximum(t0, t), t0)
+            t1 = np.where(~parallel & (p > 0), np.minimum(t1, t), t1)
+    keep &= t0 < t1
+    edge_index = np.flatnonzero(keep)
+    x1, y1, dx, dy, t0, t1 = x1[keep], y1[keep], dx[keep], dy[keep], t0[keep], t1[keep]
+
+    # Parameters where each clipped edge crosses a vertical or horizontal
+    # cell border, plus its two ends
+    splits_edge = [np.arange(x1.size), np.arange(x1.size)]
+    splits_t = [t0, t1]
+    for start, delta, origin in ((x1, dx, left), (y1, dy, bottom)):
+        index_a = np.floor((start + t0 * delta - origin) / cell_size)
+        index_b = np.floor((start + t1 * delta - origin) / cell_size)
+        crossings = np.abs(index_b - index_a).astype(np.int64)
+        edge = np.repeat(np.arange(x1.size), crossings)
+        offsets = np.cumsum(crossings) - crossings
+        line = np.minimum(index_a, index_b)[edge] + 1 + (np.arange(int(crossings.sum())) - offsets[edge])
+        splits_edge.append(edge)
+        splits_t.append((origin + line * cell_size - start[edge]) / delta[edge])
+    edge = np.concatenate(splits_edge)
+    t = np.concatenate(splits_t)
+    order = np.lexsort((t, edge))
+    edge = edge[order]
+    t = t[order]
+    same = edge[1:] == edge[:-1]
+    edge = edge[:-1][same]
+    ta = t[:-1][same]
+    tb = t[1:][same]
+    nonempty = tb > ta
+    edge, ta, tb = edge[nonempty], ta[nonempty], tb[nonempty]
+
+    px1 = x1[edge] + ta * dx[edge]
+    py1 = y1[edge] + ta * dy[edge]
+    px2 = x1[edge] + tb * dx[edge]
+    py2 = y1[edge] + tb * dy[edge]
+    cols = np.clip(np.floor(((px1 + px2) / 2 - left) / cell_size), 0, nx - 1).astype(np.int64)
+    rows = np.clip(np.floor(((py1 + py2) / 2 - bottom) / cell_size), 0, ny - 1).astype(np.int64)
+    cell = rows * nx + cols
+
+    # An edge through a cell corner can leave a sliver piece that rounds
+    # into the cell on either side; merge it so every edge has at most one
+    # piece per cell
+    first = np.ones(edge.size, dtype=bool)
+    first[1:] = (edge[1:] != edge[:-1]) | (cell[1:] != cell[:-1])
+    start = np.flatnonzero(first)
+    end = np.append(start[1:], edge.size)[:start.size] - 1
+    return cell[start], edge_index[edge[start]], px1[start], py1[start], px2[end], py2[end]
+
+
+class BoundaryCells:
+    """Exact shape of a polygon within a set of grid cells on its boundary.
+
+    The part of every cell inside the polygon is decomposed into trapezoids
+    with horizontal bases: the polygon edges are split at the cell borders,
+    each cell is cut into horizontal slabs at the pieces' end points, and
+    within a slab the pieces and the cell walls bound intervals that are
+    alternately inside and outside the polygon. Which ones are inside
+    follows from the cell center's parity (``center_inside``, from
+    rasterize_polygon) and the pieces crossed on the way from the center to
+    each slab, so neither the cells nor the sampled points are ever tested
+    with a geometry engine and no point is rejected.
+
+    ``cells`` are flat (row-major) indices into the (len(grid_y),
+    len(grid_x)) grid. ``area`` holds the inside area of each cell and
+    ``fraction`` its share of the cell's area.
+    """
+
+    def __init__(self, edges, grid_x, grid_y, cell_size, cells, center_inside):
+        nx = len(grid_x)
+        cells = np.asarray(cells, dtype=np.int64)
+        count = cells.size
+        center_x = grid_x[cells % nx]
+        center_y = grid_y[cells // nx]
+        cell_left = center_x - cell_size / 2
+        cell_bottom = center_y - cell_size / 2
+
+        # Pieces lying in one of the cells, as positions in ``cells``
+        piece_cell, piece_edge, px1, py1, px2, py2 = _cell_pieces(edges, grid_x, grid_y, cell_size)
+        order = np.argsort(cells)
+        position = np.clip(np.searchsorted(cells[order], piece_cell), 0, max(count - 1, 0))
+        match = (cells[order][position] == piece_cell) if count else np.zeros(piece_cell.size, dtype=bool)
+        piece_cell = order[position[match]]
+        order = np.argsort(piece_cell, kind="stable")
+        piece_cell = piece_cell[order]
+        piece_edge = piece_edge[match][order]
+        px1, py1, px2, py2 = px1[match][order], py1[match][order], px2[match][order], py2[match][order]
+        piece_low = np.minimum(py1, py2)
+        piece_high = np.maximum(py1, py2)
+
+        # Slabs: each cell split at the heights of its pieces' end points
+        bottoms = cell_bottom[piece_cell]
+        cut_cell = np.concatenate([np.arange(count), np.arange(count), piece_cell, piece_cell])
+        cut_y = np.concatenate([
+            cell_bottom, cell_bottom + cell_size,
+            np.clip(py1, bottoms, bottoms + cell_size), np.clip(py2, bottoms, bottoms + cell_size)])
+        order = np.lexsort((cut_y, cut_cell))
+        cut_cell = cut_cell[order]
+        cut_y = cut_y[order]
+        same = (cut_cell[1:] == cut_cell[:-1]) & (cut_y[1:] > cut_y[:-1])
+        slab_cell = cut_cell[:-1][same]
+        slab_low = cut_y[:-1][same]
+        slab_high = cut_y[1:][same]
+        slabs = slab_cell.size
+
+        # Every (slab, piece of the slab's cell) pair; the pieces spanning a
+        # slab give its x at the slab's bottom and top
+        cell_pieces = np.bincount(piece_cell, minlength=count)
+        first_piece = np.cumsum(cell_pieces) - cell_pieces
+        repeats = cell_pieces[slab_cell]
+        all_slab = np.repeat(np.arange(slabs), repeats)
+        offsets = np.cumsum(repeats) - repeats
+        all_piece = first_piece[slab_cell][all_slab] + (np.arange(int(repeats.sum())) - offsets[all_slab])
+        spans = (
+            (piece_low[all_piece] <= slab_low[all_slab]) &
+            (piece_high[all_piece] >= slab_high[all_slab]) &
+            (piece_high[all_piece] > piece_low[all_piece]))
+        pair_slab = all_slab[spans]
+        pair_piece = all_piece[spans]
+        slope = (px2[pair_piece] - px1[pair_piece]) / (py2[pair_piece] - py1[pair_piece])
+        wall_left = cell_left[slab_cell]
+        wall_right = wall_left + cell_size
+        x_low = np.clip(px1[pair_piece] + (slab_low[pair_slab] - py1[pair_piece]) * slope,
+                        wall_left[pair_slab], wall_right[pair_slab])
+        x_high = np.clip(px1[pair_piece] + (slab_high[pair_slab] - py1[pair_piece]) * slope,
+                         wall_left[pair_slab], wall_right[pair_slab])
+
+        # Within a slab, order the cell walls and pieces from left to right;
+        # consecutive ones bound the slab's intervals
+        line_slab = np.concatenate([np.arange(slabs), pair_slab, np.arange(slabs)])
+        line_key = np.concatenate([np.full(slabs, -np.inf), (x_low + x_high) / 2, np.full(slabs, np.inf)])
+        line_low = np.concatenate([wall_left, x_low, wall_right])
+        line_high = np.concatenate([wall_left, x_high, wall_right])
+        order = np.lexsort((line_key, line_slab))
+        line_slab = line_slab[order]
+        line_low = line_low[order]
+        line_high = line_high[order]
+        interval = np.flatnonzero(line_slab[1:] == line_slab[:-1])
+        interval_slab = line_slab[interval]
+        interval_index = interval - np.searchsorted(line_slab, np.arange(slabs))[interval_slab]
+        left_low = line_low[interval]
+        left_high = line_high[interval]
+        width_low = np.maximum(line_low[interval + 1] - left_low, 0.0)
+        width_high = np.maximum(line_high[interval + 1] - left_high, 0.0)
+        width_mid = (width_low + width_high) / 2
+
+        # Parity of one test point per slab, in its widest interval (the
+        # others alternate from there) and off the middle, where a vertex at
+        # the cell center often lies: the cell center's parity, flipped by
+        # every edge crossed going from the center horizontally to the test
+        # point's x and then vertically to it. Crossings follow
+        # rasterize_polygon's scanline rules (points nudged left by e and up
+        # by a much smaller d) and are evaluated on the original edges, which
+        # have at most one piece per cell, so the two always agree.
+        by_width = np.lexsort((-width_mid, interval_slab))
+        reference = by_width[np.searchsorted(interval_slab[by_width], np.arange(slabs))]
+        test_x = (left_low[reference] + left_high[reference]) / 2 + 0.41421356 * width_mid[reference]
+        test_y = (slab_low + slab_high) / 2
+        x1, y1, x2, y2 = (np.asarray(a, dtype=np.float64)[piece_edge[all_piece]] for a in edges)
+        from_x = center_x[slab_cell][all_slab]
+        from_y = center_y[slab_cell][all_slab]
+        to_x = test_x[all_slab]
+        to_y = test_y[all_slab]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            across = (np.minimum(y1, y2) <= from_y) & (from_y < np.maximum(y1, y2))
+            cross_x = np.where(from_y == y2, x2, x1 + (from_y - y1) * (x2 - x1) / (y2 - y1))
+            flips = across & ((cross_x < from_x) != (cross_x < to_x))
+            across = (np.minimum(x1, x2) < to_x) & (to_x <= np.maximum(x1, x2))
+            cross_y = np.where(to_x == x2, y2, y1 + (to_x - x1) * (y2 - y1) / (x2 - x1))
+            rising = (y2 - y1) * (x2 - x1) >= 0
+            flips ^= across & (
+                ((cross_y < from_y) | ((cross_y == from_y) & rising)) !=
+                ((cross_y < to_y) | ((cross_y == to_y) & rising)))
+        reference_inside = np.asarray(center_inside, dtype=bool)[slab_cell] ^ (
+            np.bincount(all_slab[flips], minlength=slabs) % 2 == 1)
+        inside = reference_inside[interval_slab] ^ (
+            (interval_index - interval_index[reference][interval_slab]) % 2 == 1)
+        inside &= width_mid > 0
+
+        self.trapezoid_cell = slab_cell[interval_slab[inside]]
+        self.y_low = slab_low[interval_slab[inside]]
+        self.height = slab_high[interval_slab[inside]] - self.y_low
+        self.left_low = left_low[inside]
+        self.left_high = left_high[inside]
+        self.width_low = width_low[inside]
+        self.width_high = width_high[inside]
+        trapezoid_area = self.height * width_mid[inside]
+        self.cumulative_area = np.cumsum(trapezoid_area)
+        self.first_trapezoid = np.searchsorted(self.trapezoid_cell, np.arange(count), side="left")
+        self.area = np.bincount(self.trapezoid_cell, trapezoid_area, minlength=count)
+        self.fraction = np.minimum(self.area / (cell_size * cell_size), 1.0)
+
+    @property
+    def nbytes(self):
+        """Memory held by the decomposition's arrays"""
+        return sum(array.nbytes for array in (
+            self.trapezoid_cell, self.y_low, self.height, self.left_low, self.left_high,
+            self.width_low, self.width_high, self.cumulative_area, self.first_trapezoid,
+            self.area, self.fraction))
+
+    def sample(self, cells, counts, rng):
+        """Draw ``counts[i]`` uniform points inside the polygon part of ``cells[i]``.
+
+        ``cells`` are positions in the cells the object was built for; cells
+        with no area inside the polygon must get a count of 0. Returns
+        (x, y) float64 arrays ordered by cell.
+        """
+        point_cell = np.repeat(np.asarray(cells, dtype=np.int64), counts)
+        u = rng.random((3, point_cell.size))
+        first = self.first_trapezoid[point_cell]
+        before = self.cumulative_area[first] - (
+            self.height[first] * (self.width_low[first] + self.width_high[first]) / 2)
+        trapezoid = np.searchsorted(
+            self.cumulative_area, before + u[0] * self.area[point_cell], side="right")
+        last = np.searchsorted(self.trapezoid_cell, point_cell, side="right") - 1
+        trapezoid = np.clip(trapezoid, first, last)
+
+        # Invert the trapezoid's linear height density for y, then pick x
+        # uniformly across the width at that height
+        width_low = self.width_low[trapezoid]
+        width_high = self.width_high[trapezoid]
+        root = width_low + np.sqrt(width_low ** 2 + u[1] * (width_high ** 2 - width_low ** 2))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.where(root > 0, u[1] * (width_low + width_high) / root, u[1])
+        y = self.y_low[trapezoid] + t * self.height[trapezoid]
+        left = self.left_low[trapezoid] + t * (self.left_high[trapezoid] - self.left_low[trapezoid])
+        x = left + u[2] * (width_low + t * (width_high - width_low))
+        return x, y
+
+
+# Sample cells of a grid (or tile) that overlap the polygon: cell centers,
+# whether each is a boundary cell, the share of its area inside the polygon
+# (1 for interior cells), the BoundaryCells shape of the boundary cells and
+# each selected boundary cell's position in it, and the number of boundary
+# cells examined
+SampleCells = namedtuple("SampleCells", [
+    "cx", "cy", "on_boundary", "fraction", "shape", "shape_index", "boundary_cells"])
+
+
+def grid_sample_cells(edges, grid_x, grid_y, cell_size):
+    """Sample cells of a grid (or tile) that overlap the polygon.
+
+    Interior cells come straight from rasterize_polygon. Boundary cells are
+    decomposed exactly (BoundaryCells) and kept if any of their area is
+    inside the polygon, wherever their center lies. No containment test is
+    needed. Returns SampleCells.
+    """
+    inside, boundary = rasterize_polygon(edges, grid_x, grid_y, cell_size)
+    inside = inside.ravel()
+    boundary = boundary.ravel()
+    selected = inside & ~boundary
+    boundary_index = np.flatnonzero(boundary)
+    shape = BoundaryCells(edges, grid_x, grid_y, cell_size, boundary_index, inside[boundary_index])
+    touched = shape.area > 0
+    selected[boundary_index[touched]] = True
+    cells = np.flatnonzero(selected)
+    cx, cy = grid_cells(grid_x, grid_y)
+    on_boundary = boundary[cells]
+    fraction = np.ones(cells.size)
+    fraction[on_boundary] = shape.fraction[touched]
+    return SampleCells(cx[cells], cy[cells], on_boundary, fraction, shape,
+                       np.flatnonzero(touched), int(boundary_index.size))
+
+
+def place_points(cells, counts, cell_size, rng):
+    """Points for the selected cells of a grid: ``counts[i]`` in cell i.
+
+    Interior cells are jittered over the whole cell; boundary cells are
+    sampled inside their part of the polygon. Returns float64 (x, y).
+    """
+    px, py = jitter_points(cells.cx, cells.cy, counts, cell_size, rng)
+    boundary_points = np.flatnonzero(np.repeat(cells.on_boundary, counts))
+    if boundary_points.size:
+        px[boundary_points], py[boundary_points] = cells.shape.sample(
+            cells.shape_index, counts[cells.on_boundary], rng)
+    return px, py
+
+
+def sample_grid(edges, grid_x, grid_y, cell_size, values_at, range_table, rng, profile=None):
+    """Run the vectorized sampling pipeline on one polygon grid (or tile).
+
+    ``values_at(xs, ys)`` returns raster values for cell centers in polygon
+    coordinates (NaN for none). ``range_table`` is a compiled density model
+    (DensityRangeTable or DensityCurve); it maps values to points per cell
+    and draws the counts.
+    A boundary cell keeps each of its points with the probability that a
+    point in the cell lies in the polygon (a binomial draw) and places them
+    directly inside the polygon, so edges get the same density as the
+    interior without any point being rejected. ``profile`` (see
+    profile_stage) times the stages.
+
+    Returns (x, y, cells_processed, boundary_cells).
+    """
+    cells, values = sample_grid_cells(edges, grid_x, grid_y, cell_size, values_at, profile)
+    if cells.cx.size == 0:
+        empty = np.empty(0)
+        return empty, empty, 0, cells.boundary_cells
+    px, py, cells_processed = draw_cell_points(cells, values, range_table, cell_size, rng, profile)
+    return px, py, cells_processed, cells.boundary_cells
+
+
+def sample_grid_cells(edges, grid_x, grid_y, cell_size, values_at, profile=None):
+    """The reading half of sample_grid: SampleCells and the raster values at their centers"""
+    with profile_stage(profile, "containment"):
+        cells = grid_sample_cells(edges, grid_x, grid_y, cell_size)
+    if cells.cx.size == 0:
+        return cells, np.empty(0)
+    with profile_stage(profile, "raster_read"):
+        values = values_at(cells.cx, cells.cy)
+    return cells, values
+
+
+def draw_cell_points(cells, values, range_table, cell_size, rng, profile=None):
+    """Points for SampleCells given the raster ``values`` at their centers.
+
+    The sampling half of sample_grid: counts from ``range_table``, boundary
+    cells thinned by the share of the cell inside the polygon, points placed
+    with place_points. Returns (x, y, cells_processed).
+    """
+    with profile_stage(profile, "classification"):
+        points_per_cell = classify_values(values, range_table)
+    with profile_stage(profile, "rng"):
+        counts = range_table.draw_counts(points_per_cell, rng)
+        counts[cells.on_boundary] = rng.binomial(counts[cells.on_boundary], cells.fraction[cells.on_boundary])
+        px, py = place_points(cells, counts, cell_size, rng)
+    return px, py, int(np.isfinite(points_per_cell).sum())
+
+
+def sample_grid_surfaces(edges, grid_x, grid_y, cell_size, surfaces, rngs, profile=None):
+    """Run sample_grid for several density surfaces on one grid (or tile).
+
+    ``surfaces`` is a sequence of (values_at, range_table) pairs, e.g. the
+    bands of a raster stack each with its own density model, and ``rngs``
+    holds one generator per surface. The sample cells and their boundary
+    decomposition are computed once and shared, so only raster reads and
+    draws are repeated per surface; with the same generator a surface gets
+    exactly the points sample_grid would give it.
+
+    Returns (results, boundary_cells), ``results`` holding one (x, y,
+    cells_processed) per surface.
+    """
+    with profile_stage(profile, "containment"):
+        cells = grid_sample_cells(edges, grid_x, grid_y, cell_size)
+    results = []
+    for (values_at, range_table), rng in zip(surfaces, rngs):
+        if cells.cx.size == 0:
+            results.append((np.empty(0), np.empty(0), 0))
+            continue
+        with profile_stage(profile, "raster_read"):
+            values = values_at(cells.cx, cells.cy)
+        results.append(draw_cell_points(cells, values, range_table, cell_size, rng, profile))
+    return results, cells.boundary_cells
+
+
+# One tile of a polygon's sample grid as kept in a CellGrid: the tile's
+# position (it selects the tile's random stream), its SampleCells and the
+# raster values at their centers
+SampledTile = namedtuple("SampledTile", ["tile_row", "tile_col", "cells", "values"])
+
+
+def sampled_tile_nbytes(tile):
+    """Memory held by a SampledTile's arrays"""
+    cells = tile.cells
+    return (cells.cx.nbytes + cells.cy.nbytes + cells.on_boundary.nbytes + cells.fraction.nbytes +
+            cells.shape_index.nbytes + cells.shape.nbytes + np.asarray(tile.values).nbytes)
+
+
+def draw_tile(tile, cell_size, range_table, seed, polygon_key, profile=None):
+    """Points of a SampledTile, from the tile's stream tile_rng(seed, polygon_key, row, col).
+
+    Returns (x, y, cells_processed, boundary_cells), exactly what
+    sample_polygon gives the tile.
+    """
+    cells = tile.cells
+    if cells.cx.size == 0:
+        empty = np.empty(0)
+        return empty, empty, 0, cells.boundary_cells
+    rng = tile_rng(seed, polygon_key, tile.tile_row, tile.tile_col)
+    px, py, cells_processed = draw_cell_points(cells, tile.values, range_table, cell_size, rng, profile)
+    return px, py, cells_processed, cells.boundary_cells
+
+
+def sample_polygon(edges, x_min, x_max, y_min, y_max, cell_size, values_at, range_table,
+                   seed, polygon_key, is_canceled=None, profile=None, keep_tiles=None):
+    """Sample one polygon tile by tile.
+
+    Yields (tile_index, tile_count, x, y, cells_processed, boundary_cells)
+    per tile, each tile drawing from tile_rng(seed, polygon_key, row, col).
+    Stops early once ``is_canceled()`` returns True. Each tile's
+    SampledTile is appended to the ``keep_tiles`` list if given, so the
+    polygon can be redrawn with sample_cached_polygon.
+    """
+    tile_count = polygon_tile_count(x_min, x_max, y_min, y_max, cell_size)
+    tiles = polygon_tiles(edges, x_min, x_max, y_min, y_max, cell_size)
+    for tile_index, (tile_row, tile_col, grid_x, grid_y, tile_edges) in enumerate(tiles):
+        if is_canceled is not None and is_canceled():
+            return
+        tile = SampledTile(tile_row, tile_col, *sample_grid_cells(
+            tile_edges, grid_x, grid_y, cell_size, values_at, profile))
+        if keep_tiles is not None:
+            keep_tiles.append(tile)
+        px, py, cells_processed, boundary_cells = draw_tile(
+            tile, cell_size, range_table, seed, polygon_key, profile)
+        yield tile_index, tile_count, px, py, cells_processed, boundary_cells
+
+
+def sample_cached_polygon(tiles, cell_size, range_table, seed, polygon_key, is_canceled=None, profile=None):
+    """Sample one polygon from its SampledTile list (see sample_polygon's ``keep_tiles``).
+
+    Nothing is rasterized or read: only the counts and points are drawn,
+    and with the same seed they are exactly sample_polygon's. Yields like
+    sample_polygon.
+    """
+    for tile_index, tile in enumerate(tiles):
+        if is_canceled is not None and is_canceled():
+            return
+        px, py, cells_processed, boundary_cells = draw_tile(
+            tile, cell_size, range_table, seed, polygon_key, profile)
+        yield tile_index, len(tiles), px, py, cells_processed, boundary_cells
+
+
+def sample_polygon_surfaces(edges, x_min, x_max, y_min, y_max, cell_size, surfaces,
+                            seed, polygon_key, is_canceled=None, profile=None):
+    """Sample one polygon tile by tile for several density surfaces at once.
+
+    ``surfaces`` is a sequence of (values_at, range_table) pairs (see
+    sample_grid_surfaces); surface i of a tile draws from tile_rng(seed,
+    polygon_key, row, col, surface=i), so the first surface's points match
+    sample_polygon. Yields (tile_index, tile_count, surface, x, y,
+    cells_processed, boundary_cells) per surface and tile, boundary_cells
+    being counted on the first surface only. Stops early once
+    ``is_canceled()`` returns True.
+    """
+    tile_count = polygon_tile_count(x_min, x_max, y_min, y_max, cell_size)
+    tiles = polygon_tiles(edges, x_min, x_max, y_min, y_max, cell_size)
+    for tile_index, (tile_row, tile_col, grid_x, grid_y, tile_edges) in enumerate(tiles):
+        if is_canceled is not None and is_canceled():
+            return
+        rngs = [tile_rng(seed, polygon_key, tile_row, tile_col, surface) for surface in range(len(surfaces))]
+        results, boundary_cells = sample_grid_surfaces(
+            tile_edges, grid_x, grid_y, cell_size, surfaces, rngs, profile)
+        for surface, (px, py, cells_processed) in enumerate(results):
+            yield (tile_index, tile_count, surface, px, py, cells_processed,
+                   boundary_cells if surface == 0 else 0)
+
+
+def cell_weights(values):
+    """Allocation weights of raster values: the value where positive, else 0"""
+    values = np.nan_to_num(np.asarray(values, dtype=np.float64), nan=0.0, posinf=0.0, neginf=0.0)
+    return np.where(values > 0, values, 0.0)
+
+
+def allocate_total(weights, total, rng):
+    """Split ``total`` points between weighted bins in one multinomial draw.
+
+    Returns int64 counts summing to exactly ``total``, or all zeros when no
+    weight is positive.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    counts = np.zeros(weights.shape, dtype=np.int64)
+    weight_sum = weights.sum()
+    if total <= 0 or not weight_sum > 0:
+        return counts
+    counts[...] = rng.multinomial(int(total), weights.ravel() / weight_sum).reshape(weights.shape)
+    return counts
+
+
+def grid_weight(edges, grid_x, grid_y, cell_size, values_at, profile=None):
+    """Total allocation weight of a grid's (or tile's) cells.
+
+    Cell weights (cell_weights) are scaled by the share of each cell inside
+    the polygon.
+    """
+    with profile_stage(profile, "containment"):
+        cells = grid_sample_cells(edges, grid_x, grid_y, cell_size)
+    if cells.cx.size == 0:
+        return 0.0
+    with profile_stage(profile, "raster_read"):
+        values = values_at(cells.cx, cells.cy)
+    with profile_stage(profile, "classification"):
+        return float((cell_weights(values) * cells.fraction).sum())
+
+
+def sample_grid_total(edges, grid_x, grid_y, cell_size, values_at, total, rng,
+                      max_chunk_points=MAX_CHUNK_POINTS, profile=None):
+    """Place exactly ``total`` points in one polygon grid (or tile).
+
+    Points are allocated to the sample cells in proportion to their raster
+    values (cell_weights, scaled by the share of boundary cells inside the
+    polygon) with one multinomial draw, then placed within the cells as in
+    sample_grid, so none is lost at the boundary. Nothing is placed if no
+    cell has a positive value.
+
+    Yields (x, y, cells_processed, boundary_cells) in chunks of about
+    ``max_chunk_points`` points (a single cell is never split); the cell
+    counts are reported with the first chunk.
+    """
+    with profile_stage(profile, "containment"):
+        cells = grid_sample_cells(edges, grid_x, grid_y, cell_size)
+    if cells.cx.size == 0:
+        empty = np.empty(0)
+        yield empty, empty, 0, cells.boundary_cells
+        return
+    with profile_stage(profile, "raster_read"):
+        values = values_at(cells.cx, cells.cy)
+    with profile_stage(profile, "classification"):
+        weights = cell_weights(values) * cells.fraction
+    with profile_stage(profile, "rng"):
+        counts = allocate_total(weights, total, rng)
+    cells_processed = int((weights > 0).sum())
+    boundary_cells = cells.boundary_cells
+    ends = np.cumsum(counts)
+    boundary_position = np.cumsum(cells.on_boundary) - cells.on_boundary
+    start = 0
+    while start < counts.size:
+        done = int(ends[start - 1]) if start else 0
+        end = max(start + 1, int(np.searchsorted(ends, done + max_chunk_points, side="right")))
+        on_boundary = cells.on_boundary[start:end]
+        chunk = cells._replace(
+            cx=cells.cx[start:end], cy=cells.cy[start:end], on_boundary=on_boundary,
+            shape_index=cells.shape_index[boundary_position[start:end][on_boundary]])
+        with profile_stage(profile, "rng"):
+            px, py = place_points(chunk, counts[start:end], cell_size, rng)
+        if px.size or start == 0:
+            yield px, py, cells_processed, boundary_cells
+            cells_processed = boundary_cells = 0
+        start = end
+
+
+def sample_polygon_total(edges, x_min, x_max, y_min, y_max, cell_size, values_at, total,
+                         seed, polygon_key, is_canceled=None, profile=None):
+    """Place exactly ``total`` points in one polygon, tile by tile.
+
+    A first pass sums the cell weights of every tile and splits the total
+    between the tiles with one multinomial draw (from the polygon's
+    ALLOCATION_STREAM); a second pass runs sample_grid_total on each tile
+    with its share. The result is distributed exactly like a single
+    multinomial over all of the polygon's cells, while only one tile is in
+    memory at a time. The raster is read twice.
+
+    Yields (tile_index, tile_count, x, y, cells_processed, boundary_cells)
+    like sample_polygon, possibly several times per tile.
+    """
+    tiles = list(polygon_tiles(edges, x_min, x_max, y_min, y_max, cell_size))
+    tile_count = len(tiles)
+    weights = np.zeros(tile_count)
+    for tile_index, (_, _, grid_x, grid_y, tile_edges) in enumerate(tiles):
+        if is_canceled is not None and is_canceled():
+            return
+        weights[tile_index] = grid_weight(tile_edges, grid_x, grid_y, cell_size, values_at, profile)
+    with profile_stage(profile, "rng"):
+        allocation = allocate_total(weights, total, tile_rng(seed, polygon_key, ALLOCATION_STREAM, 0))
+
+    for tile_index, (tile_row, tile_col, grid_x, grid_y, tile_edges) in enumerate(tiles):
+        if is_canceled is not None and is_canceled():
+            return
+        if not allocation[tile_index]:
+            continue
+        rng = tile_rng(seed, polygon_key, tile_row, tile_col)
+        for px, py, cells_processed, boundary_cells in sample_grid_total(
+                tile_edges, grid_x, grid_y, cell_size, values_at, int(allocation[tile_index]), rng,
+                profile=profile):
+            yield tile_index, tile_count, px, py, cells_processed, boundary_cells
+
+
+class CellGrid:
+    """Sample cells and raster values of every polygon of a run.
+
+    The sample grid depends on the polygons, the raster, the cell size and
+    how the raster is read, but not on the density model or the seed. A run
+    that fills a CellGrid - start(), add_polygon() with the tiles
+    sample_polygon kept for each polygon, finish() once every polygon is in
+    - lets later runs with other ranges, models or seeds redraw their
+    points with sample_cached_polygon, without touching a polygon or the
+    raster. A grid that outgrows ``max_bytes`` drops its tiles and never
+    completes.
+    """
+
+    def __init__(self, max_bytes=CELL_GRID_BYTES):
+        self.max_bytes = max_bytes
+        self.start()
+
+    def start(self, cell_size=None):
+        """Empty the grid before filling it with cells of ``cell_size``"""
+        self.cell_size = cell_size
+        self.polygons = []
+        self.nbytes = 0
+        self.complete = False
+        self.overflowed = False
+
+    def add_polygon(self, polygon_key, tiles):
+        """Keep a polygon's SampledTile list; False once the grid is over its budget"""
+        if self.overflowed:
+            return False
+        self.nbytes += sum(sampled_tile_nbytes(tile) for tile in tiles)
+        if self.nbytes > self.max_bytes:
+            self.polygons = []
+            self.overflowed = True
+            return False
+        self.polygons.append((polygon_key, list(tiles)))
+        return True
+
+    def finish(self):
+        """Mark the grid complete, unless it overflowed; returns whether it is"""
+        self.complete = not self.overflowed
+        return self.complete
+
+
+class PointBuffer:
+    """Growable store of points: x, y and optional attribute columns.
+
+    Points are copied into preallocated chunks of ``chunk_size`` rows, so an
+    append never reallocates what is already stored and a point costs 16
+    bytes (plus its attributes) rather than a Python object per point.
+    ``columns`` maps attribute names to NumPy dtypes; columns not given to
+    an append are filled with 0. Read the points back with chunks() (views,
+    no copy), drain() (chunks are released as they are handed out),
+    to_arrays() or column().
+    """
+
+    def __init__(self, columns=None, chunk_size=POINT_BUFFER_CHUNK):
+        self.columns = dict(columns or {})
+        self.chunk_size = max(1, int(chunk_size))
+        self._chunks = []
+        self._fill = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _writable_chunk(self):
+        """The last chunk, after adding a new one if it is full"""
+        if not self._chunks or self._fill == self.chunk_size:
+            self._chunks.append((
+                np.empty(self.chunk_size), np.empty(self.chunk_size),
+                {name: np.empty(self.chunk_size, dtype=dtype) for name, dtype in self.columns.items()}))
+            self._fill = 0
+        return self._chunks[-1]
+
+    def _used(self, index):
+        return self._fill if index == len(self._chunks) - 1 else self.chunk_size
+
+    def append(self, xs, ys, **columns):
+        """Append points given as coordinate arrays.
+
+        Each keyword gives an attribute column either an array of the same
+        length or a single value for all the points.
+        """
+        xs = np.asarray(xs, dtype=np.float64).ravel()
+        ys = np.asarray(ys, dtype=np.float64).ravel()
+        if xs.shape != ys.shape:
+            raise ValueError("x and y must have the same length")
+        unknown = set(columns) - set(self.columns)
+        if unknown:
+            raise ValueError(f"Unknown point columns: {', '.join(sorted(unknown))}")
+        done = 0
+        while done < xs.size:
+            chunk_x, chunk_y, chunk_columns = self._writable_chunk()
+            count = min(xs.size - done, self.chunk_size - self._fill)
+            rows = slice(self._fill, self._fill + count)
+            chunk_x[rows] = xs[done:done + count]
+            chunk_y[rows] = ys[done:done + count]
+            for name, array in chunk_columns.items():
+                value = columns.get(name, 0)
+                array[rows] = value[done:done + count] if np.ndim(value) else value
+            self._fill += count
+            done += count
+        self._size += xs.size
+
+    def append_point(self, x, y, **columns):
+        """Append a single point, for per-point loops"""
+        chunk_x, chunk_y, chunk_columns = self._writable_chunk()
+        chunk_x[self._fill] = x
+        chunk_y[self._fill] = y
+        for name, array in chunk_columns.items():
+            array[self._fill] = columns.get(name, 0)
+        self._fill += 1
+        self._size += 1
+
+    def chunks(self):
+        """Yield (x, y, columns) views of the stored points chunk by chunk, without copying"""
+        for index, (x, y, columns) in enumerate(self._chunks):
+            used = self._used(index)
+            if used:
+                yield x[:used], y[:used], {name: array[:used] for name, array in columns.items()}
+
+    def drain(self):
+        """Yield the chunks like chunks() while removing them, leaving the buffer empty.
+
+        A chunk is freed once the caller lets go of it, so handing a buffer
+        on this way never holds two copies of the points.
+        """
+        while self._chunks:
+            used = self._used(0)
+            x, y, columns = self._chunks.pop(0)
+            self._size -= used
+            if not self._chunks:
+                self._fill = 0
+            if used:
+                yield x[:used], y[:used], {name: array[:used] for name, array in columns.items()}
+
+    def to_arrays(self, release=False):
+        """All points as (x, y) float64 arrays.
+
+        The arrays are copies; with ``release`` the buffer is drained while
+        they are filled, so peak memory stays at about one copy.
+        """
+        xs = np.empty(self._size)
+        ys = np.empty(self._size)
+        start = 0
+        for x, y, _ in (self.drain() if release else self.chunks()):
+            xs[start:start + x.size] = x
+            ys[start:start + y.size] = y
+            start += x.size
+        return xs, ys
+
+    def column(self, name):
+        """All values of attribute column ``name`` as one array"""
+        if name not in self.columns:
+            raise KeyError(name)
+        arrays = [columns[name] for _, _, columns in self.chunks()]
+        if not arrays:
+            return np.empty(0, dtype=self.columns[name])
+        return np.concatenate(arrays)
+
+    def clear(self):
+        """Remove every point; the first chunk is kept for reuse"""
+        del self._chunks[1:]
+        self._fill = 0
+        self._size = 0
+
+
+def point_wkb(xs, ys):
+    """Packed WKB of 2D points: WKB_POINT.itemsize bytes per point in one bytes object"""
+    records = np.empty(len(xs), dtype=WKB_POINT)
+    records["order"] = 1
+    records["type"] = 1
+    records["x"] = xs
+    records["y"] = ys
+    return records.tobytes()
+
+
+def multipoint_wkb(xs, ys):
+    """WKB of one 2D MultiPoint holding all the points, as a bytes object"""
+    header = np.zeros(1, dtype=[("order", "u1"), ("type", "<u4"), ("count", "<u4")])
+    header["order"] = 1
+    header["type"] = 4
+    header["count"] = len(xs)
+    return header.tobytes() + point_wkb(xs, ys)
+
+
+class ArrayRaster:
+    """Raster values from an in-memory array, for use without QGIS or GDAL.
+
+    ``array`` is indexed [row, col] with row 0 at the top (``y_max``) edge,
+    i.e. a north-up raster. ``no_data`` pixels and NaNs read as NaN, as do
+    coordinates outside the raster.
+    """
+
+    def __init__(self, array, x_min, y_max, x_res, y_res, no_data=None):
+        self.array = np.asarray(array, dtype=np.float64)
+        if no_data is not None:
+            self.array = np.where(self.array == no_data, np.nan, self.array)
+        self.x_min = float(x_min)
+        self.y_max = float(y_max)
+        self.x_res = float(x_res)
+        self.y_res = float(y_res)
+        self.height, self.width = self.array.shape
+
+    @classmethod
+    def from_geotransform(cls, array, geotransform, no_data=None):
+        """Build from a GDAL-style (x_min, x_res, 0, y_max, 0, -y_res) geotransform"""
+        x_min, x_res, _, y_max, _, y_res = geotransform
+        return cls(array, x_min, y_max, x_res, -y_res, no_data)
+
+    def values_at(self, xs, ys):
+        """Return raster values for coordinate arrays, NaN where there is no value"""
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        values = np.full(xs.shape, np.nan)
+        cols = np.floor((xs - self.x_min) / self.x_res)
+        rows = np.floor((self.y_max - ys) / self.y_res)
+        valid = (
+            np.isfinite(cols) & np.isfinite(rows) &
+            (cols >= 0) & (cols < self.width) & (rows >= 0) & (rows < self.height)
+        )
+        values[valid] = self.array[rows[valid].astype(np.int64), cols[valid].astype(np.int64)]
+        return values
+
+
+def generate_points(polygons, values_at, density_ranges, cell_size, seed=None,
+                    on_chunk=None, is_canceled=None, density_model="ranges", density_curve=None,
+                    totals=None, profile=None, cell_grid=None):
+    """Generate points for polygons given as arrays - the QGIS-free entry point.
+
+    ``polygons`` is an iterable of (key, rings) pairs: ``key`` is a stable
+    integer id (the feature id) that selects the polygon's random streams,
+    ``rings`` the vertex arrays accepted by polygon_edges. ``values_at(xs,
+    ys)`` returns raster values for coordinates in the polygons' CRS, e.g.
+    ArrayRaster(...).values_at. ``cell_size`` is the sample cell width in
+    that CRS (raster pixel size times raster points per sample width).
+    ``density_model`` and ``density_curve`` select a continuous density
+    model instead of the ranges' step function (see compile_density_model).
+    ``totals`` switches to exact-total allocation: a number of points for
+    every polygon, or a mapping from key to number (missing keys get none),
+    distributed in proportion to the raster values (sample_polygon_total);
+    the density settings are then ignored. ``profile`` (see profile_stage)
+    times the stages. ``cell_grid`` (a CellGrid, not used with totals) is
+    filled with the polygons' sample cells; once complete, a later call
+    with the same polygons, raster and cell size draws from it instead and
+    neither ``polygons`` nor ``values_at`` is used.
+
+    With the same seed and keys the points match the Vectorized and Parallel
+    engines (for rings as QGIS returns them). Each tile's points are passed to
+    ``on_chunk(key, x, y)`` if given; otherwise all points are returned as
+    two float64 arrays.
+    """
+    if seed is None:
+        seed = new_seed()
+    range_table = compile_density_model(density_ranges, density_model, density_curve) if totals is None else None
+    points = PointBuffer()
+    if totals is not None:
+        cell_grid = None
+    if cell_grid is not None and cell_grid.complete and cell_grid.cell_size == cell_size:
+        for key, tiles in cell_grid.polygons:
+            for _, _, px, py, _, _ in sample_cached_polygon(
+                    tiles, cell_size, range_table, seed, key, is_canceled=is_canceled, profile=profile):
+                if on_chunk is not None:
+                    on_chunk(key, px, py)
+                else:
+                    points.append(px, py)
+        return points.to_arrays(release=True)
+    if cell_grid is not None:
+        cell_grid.start(cell_size)
+    for key, rings in polygons:
+        if is_canceled is not None and is_canceled():
+            break
+        edges = polygon_edges(rings)
+        if edges[0].size == 0:
+            continue
+        x_min = float(min(edges[0].min(), edges[2].min()))
+        x_max = float(max(edges[0].max(), edges[2].max()))
+        y_min = float(min(edges[1].min(), edges[3].min()))
+        y_max = float(max(edges[1].max(), edges[3].max()))
+        if x_max <= x_min or y_max <= y_min:
+            continue
+        kept = [] if cell_grid is not None else None
+        if totals is None:
+            tiles = sample_polygon(
+                edges, x_min, x_max, y_min, y_max, cell_size, values_at, range_table,
+                seed, key, is_canceled=is_canceled, profile=profile, keep_tiles=kept)
+        else:
+            total = totals.get(key, 0) if isinstance(totals, dict) else totals
+            tiles = sample_polygon_total(
+                edges, x_min, x_max, y_min, y_max, cell_size, values_at, int(total),
+                seed, key, is_canceled=is_canceled, profile=profile)
+        for _, _, px, py, _, _ in tiles:
+            if on_chunk is not None:
+                on_chunk(key, px, py)
+            else:
+                points.append(px, py)
+        if kept is not None:
+            cell_grid.add_polygon(key, kept)
+    if cell_grid is not None and not (is_canceled is not None and is_canceled()):
+        cell_grid.finish()
+    return points.to_arrays(release=True)
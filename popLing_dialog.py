@@ -2,10 +2,18 @@
 Dialog for popLing plugin
 """
 
-from qgis.PyQt.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QPushButton, QSpinBox, QDoubleSpinBox, QGroupBox, QTableWidget, QTableWidgetItem, QHeaderView
+import math
+import os
+
+from qgis.PyQt.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QPushButton, QSpinBox, QDoubleSpinBox, QGroupBox, QTableWidget, QTableWidgetItem, QHeaderView, QLineEdit, QFileDialog
 from qgis.PyQt.QtCore import Qt
 from qgis.core import QgsProject, QgsVectorLayer, QgsRasterLayer, QgsWkbTypes
 
+try:
+    from .popLing_output import OUTPUT_FILTER
+except ImportError:
+    from popLing_output import OUTPUT_FILTER
+
 
 class popLingDialog(QDialog):
     """Dialog for selecting layers and parameters"""
@@ -27,6 +35,7 @@ class popLingDialog(QDialog):
         polygon_layout.addWidget(QLabel("Polygon Layer:"))
         self.polygon_combo = QComboBox()
         self.polygon_combo.setMinimumWidth(250)
+        self.polygon_combo.currentIndexChanged.connect(self.on_polygon_changed)
         polygon_layout.addWidget(self.polygon_combo)
         layer_layout.addLayout(polygon_layout)
         
@@ -39,10 +48,18 @@ class popLingDialog(QDialog):
         raster_layout.addWidget(self.raster_combo)
         layer_layout.addLayout(raster_layout)
         
-        # Raster statistics display
+        # Raster statistics display (approximate; exact on request)
+        stats_layout = QHBoxLayout()
         self.raster_stats_label = QLabel("Raster Min/Max: Not loaded")
         self.raster_stats_label.setStyleSheet("color: gray; font-style: italic;")
-        layer_layout.addWidget(self.raster_stats_label)
+        stats_layout.addWidget(self.raster_stats_label)
+        stats_layout.addStretch()
+        self.exact_stats_button = QPushButton("Exact Min/Max")
+        self.exact_stats_button.setToolTip("Scan every pixel for exact statistics. The value shown by default is estimated from a pixel sample or overviews, which is much faster on large rasters.")
+        self.exact_stats_button.setEnabled(False)
+        self.exact_stats_button.clicked.connect(self.compute_exact_stats)
+        stats_layout.addWidget(self.exact_stats_button)
+        layer_layout.addLayout(stats_layout)
         
         layer_group.setLayout(layer_layout)
         layout.addWidget(layer_group)
@@ -86,6 +103,68 @@ class popLingDialog(QDialog):
         raster_points_layout.addStretch()
         params_layout.addLayout(raster_points_layout)
         
+        # Point generation engine
+        engine_layout = QHBoxLayout()
+        engine_layout.addWidget(QLabel("Engine:"))
+        self.engine_combo = QComboBox()
+        self.engine_combo.addItem("Vectorized (NumPy)", "vectorized")
+        self.engine_combo.addItem("Parallel (process pool)", "parallel")
+        self.engine_combo.addItem("Classic (per-cell loop)", "classic")
+        self.engine_combo.setToolTip("Vectorized builds the sample grid and draws all points as arrays; Parallel runs the vectorized engine over polygons and tiles in worker processes (GDAL rasters only); Classic is the original per-cell loop.")
+        self.engine_combo.currentIndexChanged.connect(self.on_engine_changed)
+        engine_layout.addWidget(self.engine_combo)
+        engine_layout.addStretch()
+        params_layout.addLayout(engine_layout)
+        
+        # Worker processes for the parallel engine
+        workers_layout = QHBoxLayout()
+        workers_layout.addWidget(QLabel("Worker Processes:"))
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setMinimum(1)
+        self.workers_spin.setMaximum(256)
+        self.workers_spin.setValue(os.cpu_count() or 1)
+        self.workers_spin.setEnabled(False)
+        workers_layout.addWidget(self.workers_spin)
+        workers_layout.addStretch()
+        params_layout.addLayout(workers_layout)
+        
+        # How mixed-CRS inputs are sampled
+        crs_layout = QHBoxLayout()
+        crs_layout.addWidget(QLabel("CRS Handling:"))
+        self.crs_combo = QComboBox()
+        self.crs_combo.addItem("Transform sample points", "transform")
+        self.crs_combo.addItem("Reproject raster windows", "reproject")
+        self.crs_combo.setToolTip("Only used when the polygon and raster CRSs differ. Transform converts each tile's sample points to the raster CRS in one batch (exact). Reproject warps raster windows into the polygon CRS and samples them directly (nearest neighbour; runs in-process with the Parallel engine).")
+        crs_layout.addWidget(self.crs_combo)
+        crs_layout.addStretch()
+        params_layout.addLayout(crs_layout)
+        
+        # What a sample cell reads from the raster
+        resample_layout = QHBoxLayout()
+        resample_layout.addWidget(QLabel("Raster Sampling:"))
+        self.resample_combo = QComboBox()
+        self.resample_combo.addItem("Nearest full-resolution pixel", "nearest")
+        self.resample_combo.addItem("Closest overview", "overview")
+        self.resample_combo.addItem("Mean of cell pixels", "mean")
+        self.resample_combo.addItem("Sum of cell pixels", "sum")
+        self.resample_combo.setToolTip("Nearest reads the pixel under each sample cell center. Closest overview reads the raster pyramid level nearest the sample cell size (build pyramids first), so coarse sampling reads far less data. Mean and Sum aggregate the full-resolution pixels under each sample cell, weighing pixels cut by its edge by the part inside; with Sum the density ranges apply to per-cell totals.")
+        resample_layout.addWidget(self.resample_combo)
+        resample_layout.addStretch()
+        params_layout.addLayout(resample_layout)
+        
+        # Random seed
+        seed_layout = QHBoxLayout()
+        seed_layout.addWidget(QLabel("Random Seed:"))
+        self.seed_spin = QSpinBox()
+        self.seed_spin.setMinimum(0)
+        self.seed_spin.setMaximum(2147483647)
+        self.seed_spin.setValue(0)
+        self.seed_spin.setSpecialValueText("Random")
+        self.seed_spin.setToolTip("Runs with the same seed and inputs produce the same points, whatever the engine's worker count. 0 picks a new seed; the seed used is stored on the output layer.")
+        seed_layout.addWidget(self.seed_spin)
+        seed_layout.addStretch()
+        params_layout.addLayout(seed_layout)
+        
         params_group.setLayout(params_layout)
         layout.addWidget(params_group)
         
@@ -94,10 +173,24 @@ class popLingDialog(QDialog):
         density_layout = QVBoxLayout()
         
         # Instructions
-        instructions = QLabel("Define three density ranges. For each range, specify min/max raster values and points per cell.")
+        instructions = QLabel("Define one or more density ranges. For each range, specify min/max raster values and points per cell. If ranges overlap, the first matching row wins.")
         instructions.setWordWrap(True)
         density_layout.addWidget(instructions)
         
+        # Step ranges or a continuous expected count
+        model_layout = QHBoxLayout()
+        model_layout.addWidget(QLabel("Density Model:"))
+        self.density_model_combo = QComboBox()
+        self.density_model_combo.addItem("Ranges (step)", "ranges")
+        self.density_model_combo.addItem("Continuous, linear", "linear")
+        self.density_model_combo.addItem("Continuous, log scale", "log")
+        self.density_model_combo.addItem("Continuous, lookup curve", "lookup")
+        self.density_model_combo.setToolTip("Ranges gives every cell in a range that range's points per cell. The continuous models vary the expected points per cell smoothly with the raster value - interpolated between the range midpoints (linearly or on a log scale) or along the lookup curve - and draw each cell's count from a Poisson distribution.")
+        self.density_model_combo.currentIndexChanged.connect(self.on_density_model_changed)
+        model_layout.addWidget(self.density_model_combo)
+        model_layout.addStretch()
+        density_layout.addLayout(model_layout)
+        
         # Table for density ranges
         self.density_table = QTableWidget()
         self.density_table.setColumnCount(3)
@@ -123,9 +216,70 @@ class popLingDialog(QDialog):
         self.density_table.setItem(2, 2, QTableWidgetItem("5.0"))
         
         density_layout.addWidget(self.density_table)
+        
+        # Add/remove range rows
+        range_buttons_layout = QHBoxLayout()
+        self.add_range_button = QPushButton("Add Range")
+        self.add_range_button.clicked.connect(self.add_density_range)
+        self.remove_range_button = QPushButton("Remove Range")
+        self.remove_range_button.clicked.connect(self.remove_density_range)
+        range_buttons_layout.addWidget(self.add_range_button)
+        range_buttons_layout.addWidget(self.remove_range_button)
+        range_buttons_layout.addStretch()
+        density_layout.addLayout(range_buttons_layout)
+        
+        # Lookup curve for the "lookup" density model
+        curve_layout = QHBoxLayout()
+        curve_layout.addWidget(QLabel("Lookup Curve:"))
+        self.curve_edit = QLineEdit()
+        self.curve_edit.setPlaceholderText("value:points, value:points, ...  e.g. 10:0.1, 1000:2, 25000:8")
+        self.curve_edit.setToolTip("Raster values and expected points per cell, interpolated linearly in between. Values outside the curve get no points.")
+        self.curve_edit.setEnabled(False)
+        curve_layout.addWidget(self.curve_edit)
+        density_layout.addLayout(curve_layout)
+        
         density_group.setLayout(density_layout)
         layout.addWidget(density_group)
         
+        # Exact totals instead of the density settings
+        count_group = QGroupBox("Point Count")
+        count_layout = QHBoxLayout()
+        count_layout.addWidget(QLabel("Allocation:"))
+        self.allocation_combo = QComboBox()
+        self.allocation_combo.addItem("From density settings", "density")
+        self.allocation_combo.addItem("Exact total per polygon", "total")
+        self.allocation_combo.addItem("Exact total from field", "field")
+        self.allocation_combo.setToolTip("The exact modes place exactly the given number of points in every polygon (e.g. census totals), spread over its sample cells in proportion to the raster values in one multinomial draw. The density ranges and model are not used then.")
+        self.allocation_combo.currentIndexChanged.connect(self.on_allocation_changed)
+        count_layout.addWidget(self.allocation_combo)
+        self.total_spin = QSpinBox()
+        self.total_spin.setMinimum(0)
+        self.total_spin.setMaximum(2147483647)
+        self.total_spin.setValue(1000)
+        self.total_spin.setEnabled(False)
+        count_layout.addWidget(self.total_spin)
+        self.total_field_combo = QComboBox()
+        self.total_field_combo.setMinimumWidth(120)
+        self.total_field_combo.setEnabled(False)
+        count_layout.addWidget(self.total_field_combo)
+        count_layout.addStretch()
+        count_group.setLayout(count_layout)
+        layout.addWidget(count_group)
+        
+        # Output group
+        output_group = QGroupBox("Output")
+        output_layout = QHBoxLayout()
+        output_layout.addWidget(QLabel("Output File:"))
+        self.output_edit = QLineEdit()
+        self.output_edit.setPlaceholderText("[Create temporary layer]")
+        self.output_edit.setToolTip("GeoPackage (.gpkg) or FlatGeobuf (.fgb) file to stream the points into. Leave empty for a temporary memory layer, which is only practical for a few million points.")
+        output_layout.addWidget(self.output_edit)
+        self.output_button = QPushButton("Browse...")
+        self.output_button.clicked.connect(self.browse_output)
+        output_layout.addWidget(self.output_button)
+        output_group.setLayout(output_layout)
+        layout.addWidget(output_group)
+        
         # Buttons
         button_layout = QHBoxLayout()
         button_layout.addStretch()
@@ -180,36 +334,150 @@ class popLingDialog(QDialog):
         """Get raster points per sample width"""
         return self.raster_points_spin.value()
     
+    def get_engine(self):
+        """Get selected point generation engine ("vectorized", "parallel" or "classic")"""
+        return self.engine_combo.currentData()
+    
+    def get_workers(self):
+        """Get number of worker processes for the parallel engine"""
+        return self.workers_spin.value()
+    
+    def get_crs_mode(self):
+        """Get how mixed-CRS inputs are sampled ("transform" or "reproject")"""
+        return self.crs_combo.currentData()
+    
+    def get_resample(self):
+        """Get how sample cells read the raster (see popLing_core.RESAMPLE_MODES)"""
+        return self.resample_combo.currentData()
+    
+    def get_density_model(self):
+        """Get the density model (see popLing_core.DENSITY_MODELS)"""
+        return self.density_model_combo.currentData()
+    
+    def get_density_curve(self):
+        """Get the lookup curve as (value, points_per_cell) pairs, None if it cannot be parsed or is not finite"""
+        pairs = []
+        for item in self.curve_edit.text().replace(";", ",").split(","):
+            if not item.strip():
+                continue
+            try:
+                value, points_per_cell = (float(part) for part in item.split(":"))
+            except ValueError:
+                return None
+            if not (math.isfinite(value) and math.isfinite(points_per_cell)):
+                return None
+            pairs.append((value, points_per_cell))
+        return pairs
+    
+    def get_total_points(self):
+        """Get the exact number of points per polygon, or None"""
+        if self.allocation_combo.currentData() == "total":
+            return self.total_spin.value()
+        return None
+    
+    def get_total_field(self):
+        """Get the polygon attribute holding exact totals, or None"""
+        if self.allocation_combo.currentData() == "field":
+            return self.total_field_combo.currentText() or None
+        return None
+    
+    def get_seed(self):
+        """Get random seed, or None to pick a new one"""
+        return self.seed_spin.value() or None
+    
+    def get_output_path(self):
+        """Get output file path, or None for a temporary memory layer"""
+        return self.output_edit.text().strip() or None
+    
+    def browse_output(self):
+        """Pick the output file"""
+        path, selected_filter = QFileDialog.getSaveFileName(
+            self, "Save Points As", self.output_edit.text(), OUTPUT_FILTER)
+        if not path:
+            return
+        if not os.path.splitext(path)[1]:
+            path += ".fgb" if "FlatGeobuf" in selected_filter else ".gpkg"
+        self.output_edit.setText(path)
+    
+    def on_polygon_changed(self, index):
+        """List the numeric fields of the selected polygon layer as total fields"""
+        self.total_field_combo.clear()
+        layer = self.get_polygon_layer()
+        if layer is None:
+            return
+        for field in layer.fields():
+            if field.isNumeric():
+                self.total_field_combo.addItem(field.name())
+    
+    def on_allocation_changed(self, index):
+        """Only enable the total or field input for the matching allocation mode"""
+        allocation = self.allocation_combo.itemData(index)
+        self.total_spin.setEnabled(allocation == "total")
+        self.total_field_combo.setEnabled(allocation == "field")
+    
+    def on_density_model_changed(self, index):
+        """Only enable the lookup curve for the lookup density model"""
+        self.curve_edit.setEnabled(self.density_model_combo.itemData(index) == "lookup")
+    
+    def on_engine_changed(self, index):
+        """Only enable the worker count for the parallel engine"""
+        self.workers_spin.setEnabled(self.engine_combo.itemData(index) == "parallel")
+    
     def on_raster_changed(self, index):
         """Update raster statistics display when raster layer changes"""
-        if index >= 0 and self.stats_callback:
-            raster_layer = self.raster_combo.itemData(index)
-            if raster_layer:
-                self.raster_stats_label.setText("Raster Min/Max: Calculating...")
-                # Get statistics using callback
-                stats = self.stats_callback(raster_layer)
-                if stats:
-                    self.update_raster_stats(stats["min"], stats["max"])
-                else:
-                    self.raster_stats_label.setText("Raster Min/Max: Unable to calculate")
-                    self.raster_stats_label.setStyleSheet("color: red; font-style: italic;")
-        else:
+        self.show_raster_stats(exact=False)
+    
+    def compute_exact_stats(self):
+        """Replace the approximate statistics with exact ones"""
+        self.show_raster_stats(exact=True)
+    
+    def show_raster_stats(self, exact=False):
+        """Fetch statistics for the selected raster through the callback and display them"""
+        raster_layer = self.get_raster_layer()
+        if raster_layer is None or not self.stats_callback:
             self.raster_stats_label.setText("Raster Min/Max: Not loaded")
             self.raster_stats_label.setStyleSheet("color: gray; font-style: italic;")
+            self.exact_stats_button.setEnabled(False)
+            return
+        self.raster_stats_label.setText("Raster Min/Max: Calculating...")
+        # Get statistics using callback
+        stats = self.stats_callback(raster_layer, exact=exact)
+        if stats:
+            self.update_raster_stats(stats["min"], stats["max"], stats.get("approximate", False))
+        else:
+            self.raster_stats_label.setText("Raster Min/Max: Unable to calculate")
+            self.raster_stats_label.setStyleSheet("color: red; font-style: italic;")
     
-    def update_raster_stats(self, min_val, max_val):
+    def update_raster_stats(self, min_val, max_val, approximate=False):
         """Update the raster statistics display"""
         if min_val is not None and max_val is not None:
-            self.raster_stats_label.setText(f"Raster Min/Max: {min_val:.2f} / {max_val:.2f}")
+            suffix = " (approximate)" if approximate else ""
+            self.raster_stats_label.setText(f"Raster Min/Max: {min_val:.2f} / {max_val:.2f}{suffix}")
             self.raster_stats_label.setStyleSheet("color: black; font-style: normal;")
+            self.exact_stats_button.setEnabled(approximate)
         else:
             self.raster_stats_label.setText("Raster Min/Max: Unable to calculate")
             self.raster_stats_label.setStyleSheet("color: red; font-style: italic;")
     
+    def add_density_range(self):
+        """Append an empty density range row, or insert one below the selected row"""
+        row = self.density_table.currentRow()
+        row = self.density_table.rowCount() if row < 0 else row + 1
+        self.density_table.insertRow(row)
+        self.density_table.setCurrentCell(row, 0)
+    
+    def remove_density_range(self):
+        """Remove the selected density range row (or the last row)"""
+        row = self.density_table.currentRow()
+        if row < 0:
+            row = self.density_table.rowCount() - 1
+        if row >= 0:
+            self.density_table.removeRow(row)
+    
     def get_density_ranges(self):
         """Get density ranges from the table"""
         ranges = []
-        for row in range(3):
+        for row in range(self.density_table.rowCount()):
             min_item = self.density_table.item(row, 0)
             max_item = self.density_table.item(row, 1)
             points_item = self.density_table.item(row, 2)
@@ -232,17 +500,37 @@ class popLingDialog(QDialog):
         return ranges
     
     def validate_density_ranges(self):
-        """Validate that density ranges are properly configured"""
+        """Validate that density ranges are properly configured (not needed for exact totals)"""
+        if self.allocation_combo.currentData() != "density":
+            return True, ""
         ranges = self.get_density_ranges()
         if len(ranges) == 0:
             return False, "No valid density ranges defined"
         
         # Check for overlapping or invalid ranges
         for i, range1 in enumerate(ranges):
+            if not all(math.isfinite(range1[key]) for key in ("min", "max", "points_per_cell")):
+                return False, f"Range {i+1}: Values must be finite numbers"
             if range1["min"] >= range1["max"]:
                 return False, f"Range {i+1}: Min must be less than Max"
             if range1["points_per_cell"] < 0:
                 return False, f"Range {i+1}: Points per cell cannot be negative"
         
+        model = self.get_density_model()
+        if model == "log":
+            for i, range1 in enumerate(ranges):
+                if range1["min"] <= 0:
+                    return False, f"Range {i+1}: Min must be greater than 0 for the log scale model"
+        elif model == "lookup":
+            curve = self.get_density_curve()
+            if curve is None:
+                return False, "Lookup curve: enter value:points pairs of finite numbers separated by commas"
+            if len(curve) < 2:
+                return False, "Lookup curve: enter at least two value:points pairs"
+            if len(set(value for value, _ in curve)) < len(curve):
+                return False, "Lookup curve: values must be distinct"
+            if any(points_per_cell < 0 for _, points_per_cell in curve):
+                return False, "Lookup curve: points per cell cannot be negative"
+        
         return True, ""
 
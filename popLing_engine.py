@@ -0,0 +1,920 @@
+"""
+Point generation engines for popLing
+
+The classic per-cell loop, the vectorized NumPy engine and the process-pool
+engine, as QGIS adapters around popLing_core. Kept out of popLing.py so
+that loading the plugin does not import NumPy or the engines until points
+are actually generated.
+"""
+
+import math
+import random
+import traceback
+from collections import namedtuple
+
+import numpy as np
+
+from qgis.core import (
+    QgsProject, QgsProviderRegistry
+)
+
+try:
+    from . import popLing_core as core
+    from . import popLing_parallel as parallel
+    from .popLing_log import debug_log, log_enabled, DEBUG, WARNING, ERROR
+    from .popLing_profile import RunProfile
+    from .popLing_raster import resolution_in_crs, sampling_reader
+except ImportError:
+    import popLing_core as core
+    import popLing_parallel as parallel
+    from popLing_log import debug_log, log_enabled, DEBUG, WARNING, ERROR
+    from popLing_profile import RunProfile
+    from popLing_raster import resolution_in_crs, sampling_reader
+
+
+# One density surface of a multi-surface run: a raster data provider and
+# band with its own density ranges and model (see
+# core.compile_density_model). Points are tagged with the surface's position
+# in the list of surfaces
+DensitySurface = namedtuple("DensitySurface", [
+    "name", "provider", "density_ranges", "band", "density_model", "density_curve"],
+    defaults=(1, "ranges", None))
+
+
+class PointGenerator:
+    """Generates points within polygons from raster density ranges.
+
+    Holds no state; the engines are methods so they can share helpers.
+    """
+
+    def should_place_point(self, probability, rng=None):
+        """Random decision when points_per_cell < 1 (``rng``: a random.Random, default the global one)"""
+        if probability <= 0:
+            return False
+        if probability >= 1:
+            return True
+        result = (rng or random).random() < probability
+        # #region agent log
+        if log_enabled(DEBUG):
+            debug_log("popLing.should_place_point", "Random decision", {
+                "probability": probability,
+                "result": result
+            }, hypothesis_id="F")
+        # #endregion
+        return result
+
+    def boundary_points(self, num_points, fraction, rng):
+        """How many of a boundary cell's ``num_points`` to keep.
+
+        Each point is kept with probability ``fraction``, the share of the
+        cell inside the polygon; the kept points are then placed inside
+        that share, so the edge gets the interior's density.
+        """
+        return sum(1 for _ in range(num_points) if rng.random() < fraction)
+
+    def get_polygon_total(self, polygon_feature, total_points=None, total_field=None):
+        """Exact number of points for a polygon, or None to use the density settings.
+
+        ``total_field`` (an attribute name) takes precedence over the fixed
+        ``total_points``. Attribute values are rounded; NULL, non-numeric
+        and negative values give 0.
+        """
+        if total_field:
+            try:
+                total = int(round(float(polygon_feature[total_field])))
+            except (KeyError, TypeError, ValueError, OverflowError):
+                # #region agent log
+                debug_log("popLing.get_polygon_total", "Invalid total attribute", {
+                    "feature_id": polygon_feature.id(),
+                    "field": total_field
+                }, hypothesis_id="B", level=WARNING)
+                # #endregion
+                return 0
+            return max(total, 0)
+        if total_points is not None:
+            return max(int(total_points), 0)
+        return None
+    
+    def generate_points_in_polygon(self, polygon_source, raster_provider, density_ranges, raster_points_per_sample_width=2.0,
+                                   polygon_crs=None, feature_count=None, transform_context=None,
+                                   feedback=None, on_chunk=None, seed=None, crs_mode="transform",
+                                   resample="nearest", density_model="ranges", density_curve=None,
+                                   total_points=None, total_field=None, profile=None, surfaces=None):
+        """Generate points within polygon based on raster density ranges.
+
+        ``polygon_source`` is a polygon layer or feature source and
+        ``raster_provider`` a raster data provider; in a background task pass a
+        QgsVectorLayerFeatureSource with ``polygon_crs`` and ``feature_count``,
+        a provider clone and the project's ``transform_context``.
+        Polygons of any size are processed in core.TILE_CELLS tiles.
+        ``feedback`` (a QgsFeedback) receives per-tile progress and is
+        checked for cancellation. If ``on_chunk`` is given, each tile's points
+        are passed to it as (x, y) float64 arrays; otherwise they are returned
+        as two float64 arrays (x, y) in the polygon CRS.
+        ``seed`` makes the run reproducible: every polygon draws from its own
+        random stream derived from the seed and its feature id. When the
+        polygon and raster CRSs differ, ``crs_mode`` "transform" transforms
+        each tile's sample points in one batch and "reproject" samples raster
+        windows reprojected into the polygon CRS (see popLing_raster).
+        ``resample`` (core.RESAMPLE_MODES) picks whether a sample reads the
+        full-resolution pixel, the closest raster overview, or the mean or sum
+        of the full-resolution pixels in its cell. ``density_model``
+        (core.DENSITY_MODELS) replaces the ranges' step function with a
+        continuous expected count - smoothed from the ranges or along the
+        ``density_curve`` lookup pairs - whose cell counts are Poisson draws.
+        ``total_points`` (a number for every polygon) or ``total_field`` (a
+        numeric polygon attribute) switch to exact totals: each polygon gets
+        exactly that many points, allocated to its cells in proportion to
+        the raster values, and the density settings are ignored. This
+        engine hands exact-total runs, and runs over several density
+        ``surfaces``, to generate_points_vectorized.
+        ``profile`` (a popLing_profile.RunProfile) receives the time spent
+        fetching features, reading and transforming raster values, testing
+        containment, classifying values, drawing random numbers and handing
+        points to ``on_chunk``, and a memory sample per tile.
+        """
+        if total_points is not None or total_field or surfaces:
+            return self.generate_points_vectorized(
+                polygon_source, raster_provider, density_ranges, raster_points_per_sample_width,
+                polygon_crs=polygon_crs, feature_count=feature_count, transform_context=transform_context,
+                feedback=feedback, on_chunk=on_chunk, seed=seed, crs_mode=crs_mode,
+                resample=resample, total_points=total_points, total_field=total_field,
+                profile=profile, surfaces=surfaces)
+        if profile is None:
+            profile = RunProfile()
+        # #region agent log
+        if log_enabled(DEBUG):
+            debug_log("popLing.generate_points_in_polygon", "Function entry", {
+                "num_ranges": len(density_ranges),
+                "raster_points_per_sample_width": raster_points_per_sample_width
+            }, hypothesis_id="B")
+        # #endregion
+        # Coordinates go straight into float64 buffers; features are only
+        # built by whoever consumes the points
+        points = core.PointBuffer()
+        empty = (np.empty(0), np.empty(0))
+        
+        # Get raster extent and resolution (same for all polygons)
+        raster_extent = raster_provider.extent()
+        raster_width = raster_provider.xSize()
+        raster_height = raster_provider.ySize()
+        
+        # Safety checks for raster dimensions
+        if raster_width <= 0 or raster_height <= 0:
+            # #region agent log
+            debug_log("popLing.generate_points_in_polygon", "Invalid raster dimensions", {
+                "raster_width": raster_width,
+                "raster_height": raster_height
+            }, hypothesis_id="B", level=WARNING)
+            # #endregion
+            return empty
+        
+        x_res = raster_extent.width() / raster_width
+        y_res = raster_extent.height() / raster_height
+        
+        # Check for invalid resolutions
+        if not math.isfinite(x_res) or not math.isfinite(y_res) or x_res <= 0 or y_res <= 0:
+            # #region agent log
+            debug_log("popLing.generate_points_in_polygon", "Invalid raster resolution", {
+                "x_res": x_res,
+                "y_res": y_res,
+                "raster_width": raster_width,
+                "raster_height": raster_height,
+                "extent_width": raster_extent.width(),
+                "extent_height": raster_extent.height()
+            }, hypothesis_id="B", level=WARNING)
+            # #endregion
+            return empty
+        
+        # #region agent log
+        if log_enabled(DEBUG):
+            debug_log("popLing.generate_points_in_polygon", "Raster properties calculated", {
+                "raster_width": raster_width,
+                "raster_height": raster_height,
+                "x_res": x_res,
+                "y_res": y_res
+            }, hypothesis_id="B")
+        # #endregion
+        
+        # The sample grid lives in the polygon CRS, so measure the raster
+        # resolution there when the CRSs differ
+        if polygon_crs is None:
+            polygon_crs = polygon_source.sourceCrs()
+        if transform_context is None:
+            transform_context = QgsProject.instance().transformContext()
+        if polygon_crs != raster_provider.crs():
+            x_res, y_res = resolution_in_crs(raster_provider, polygon_crs, transform_context)
+            # #region agent log
+            if log_enabled(DEBUG):
+                debug_log("popLing.generate_points_in_polygon", "Resolution in polygon CRS", {
+                    "crs_mode": crs_mode,
+                    "x_res": x_res,
+                    "y_res": y_res
+                }, hypothesis_id="B")
+            # #endregion
+        
+        # Calculate cell size
+        raster_cell_size = min(x_res, y_res)
+        cell_size = raster_cell_size * raster_points_per_sample_width
+        
+        # Safety check: ensure cell_size is valid
+        if cell_size <= 0 or not math.isfinite(cell_size):
+            # #region agent log
+            debug_log("popLing.generate_points_in_polygon", "Invalid cell_size, aborting", {
+                "raster_cell_size": raster_cell_size,
+                "raster_points_per_sample_width": raster_points_per_sample_width,
+                "cell_size": cell_size,
+                "x_res": x_res,
+                "y_res": y_res
+            }, hypothesis_id="B", level=WARNING)
+            # #endregion
+            return empty
+        
+        # #region agent log
+        if log_enabled(DEBUG):
+            debug_log("popLing.generate_points_in_polygon", "Cell size calculated", {
+                "raster_cell_size": raster_cell_size,
+                "raster_points_per_sample_width": raster_points_per_sample_width,
+                "cell_size": cell_size
+            }, hypothesis_id="B")
+        # #endregion
+        
+        # One block reader per run; it fetches raster windows per tile instead
+        # of calling identify() for every sample cell, and takes care of the
+        # CRS difference for whole tiles at once
+        reader = sampling_reader(
+            raster_provider, polygon_crs, transform_context, crs_mode,
+            resample=resample, sample_width=raster_points_per_sample_width, profile=profile)
+        range_table = core.compile_density_model(density_ranges, density_model, density_curve)
+        continuous = isinstance(range_table, core.DensityCurve)
+        if seed is None:
+            seed = core.new_seed()
+        
+        # Process all polygons
+        if feature_count is None:
+            feature_count = polygon_source.featureCount()
+        features = profile.iterate("feature_fetch", polygon_source.getFeatures())
+        polygon_count = 0
+        total_cells_processed = 0
+        total_points_generated = 0
+        
+        for polygon_feature in features:
+            if feedback is not None and feedback.isCanceled():
+                break
+            polygon_count += 1
+            if feedback is not None and feature_count:
+                feedback.setProgress(100.0 * (polygon_count - 1) / feature_count)
+            polygon_geom = polygon_feature.geometry()
+            polygon_rng = random.Random(f"{seed}:{polygon_feature.id()}")
+            
+            # Get bounding box of polygon
+            bbox = polygon_geom.boundingBox()
+            # #region agent log
+            if log_enabled(DEBUG):
+                debug_log("popLing.generate_points_in_polygon", f"Processing polygon {polygon_count}", {
+                    "x_min": bbox.xMinimum(),
+                    "x_max": bbox.xMaximum(),
+                    "y_min": bbox.yMinimum(),
+                    "y_max": bbox.yMaximum()
+                }, hypothesis_id="B")
+            # #endregion
+            
+            x_min = bbox.xMinimum()
+            x_max = bbox.xMaximum()
+            y_min = bbox.yMinimum()
+            y_max = bbox.yMaximum()
+            
+            # Create grid of sample points for this polygon
+            # Safety check: prevent infinite loops
+            if x_max <= x_min or y_max <= y_min:
+                # #region agent log
+                debug_log("popLing.generate_points_in_polygon", "Invalid bounding box, skipping polygon", {
+                    "polygon_count": polygon_count,
+                    "x_min": x_min,
+                    "x_max": x_max,
+                    "y_min": y_min,
+                    "y_max": y_max
+                }, hypothesis_id="B", level=WARNING)
+                # #endregion
+                continue
+            
+            # Large polygons are processed tile by tile (core.TILE_CELLS cells
+            # square) so memory stays bounded however big the polygon is
+            grid_x, grid_y = core.grid_axes(x_min, x_max, y_min, y_max, cell_size)
+            tiles = list(core.grid_tiles(len(grid_x), len(grid_y), core.TILE_CELLS))
+            with profile.stage("containment"):
+                edges = core.polygon_edges(self.get_polygon_rings(polygon_geom))
+            cells_in_polygon = 0
+            
+            for tile_index, (col0, col1, row0, row1) in enumerate(tiles):
+                if feedback is not None and feedback.isCanceled():
+                    break
+                
+                # Cells away from the outline are entirely inside or outside
+                # the polygon; boundary cells are cut along the polygon edges
+                # and kept if any of their area is inside, wherever their
+                # center lies (core.grid_sample_cells)
+                with profile.stage("containment"):
+                    cells = core.grid_sample_cells(edges, grid_x[col0:col1], grid_y[row0:row1], cell_size)
+                sample_xs = cells.cx.tolist()
+                sample_ys = cells.cy.tolist()
+                sample_fraction = cells.fraction.tolist()
+                # Position of each boundary cell among the tile's boundary
+                # cells (-1 for interior cells) and the points kept in it,
+                # placed inside the polygon part of the cell once the tile's
+                # cells are done
+                sample_slot = np.where(cells.on_boundary, np.cumsum(cells.on_boundary) - 1, -1).tolist()
+                boundary_counts = [0] * int(cells.on_boundary.sum())
+                tile_rng = core.tile_rng(seed, polygon_feature.id(), row0 // core.TILE_CELLS, col0 // core.TILE_CELLS)
+                
+                # Read every sample value for this tile through the block reader
+                reads_before = reader.read_count
+                with profile.stage("raster_read"):
+                    raster_values = reader.values_at(sample_xs, sample_ys)
+                # #region agent log
+                if log_enabled(DEBUG):
+                    debug_log("popLing.generate_points_in_polygon", "Raster values read", {
+                        "polygon_count": polygon_count,
+                        "tile": tile_index,
+                        "sample_count": len(sample_xs),
+                        "block_reads": reader.read_count - reads_before
+                    }, hypothesis_id="A")
+                # #endregion
+            
+                if continuous:
+                    # Continuous model: expected counts for every sampled cell
+                    # and one batched Poisson draw per tile, no per-cell RNG
+                    with profile.stage("classification"):
+                        expected = core.classify_values(raster_values, range_table)
+                    with profile.stage("rng"):
+                        cell_counts = range_table.draw_counts(expected, tile_rng)
+                        for x, y, slot, fraction, num_points in zip(
+                                sample_xs, sample_ys, sample_slot, sample_fraction, cell_counts.tolist()):
+                            if slot >= 0:
+                                boundary_counts[slot] = self.boundary_points(num_points, fraction, polygon_rng)
+                                continue
+                            for _ in range(num_points):
+                                new_x = x + polygon_rng.uniform(-cell_size/2, cell_size/2)
+                                new_y = y + polygon_rng.uniform(-cell_size/2, cell_size/2)
+                                points.append_point(new_x, new_y)
+                                total_points_generated += 1
+                    sampled_cells = int(np.isfinite(expected).sum())
+                    total_cells_processed += sampled_cells
+                    cells_in_polygon += sampled_cells
+                else:
+                    # Resolve the density range of every sampled cell in one lookup
+                    with profile.stage("classification"):
+                        range_indices = range_table.range_index(raster_values)
+            
+                    with profile.stage("rng"):
+                        # Second pass: place points for each sampled cell
+                        for x, y, slot, fraction, raster_value, range_index in zip(
+                                sample_xs, sample_ys, sample_slot, sample_fraction,
+                                raster_values.tolist(), range_indices.tolist()):
+                            try:
+                                # Skip if no valid raster value (zero is treated as no
+                                # value, as the identify() path did)
+                                if not raster_value or math.isnan(raster_value):
+                                    continue
+                    
+                                if range_index >= 0:
+                                    matched_range = range_table.ranges[range_index]
+                                    points_per_cell = matched_range["points_per_cell"]
+                        
+                                    # Handle fractional points_per_cell
+                                    try:
+                                        points_per_cell = float(points_per_cell)
+                                    except (ValueError, TypeError):
+                                        # #region agent log
+                                        debug_log("popLing.generate_points_in_polygon", "Invalid points_per_cell", {
+                                            "points_per_cell": points_per_cell,
+                                            "type": str(type(points_per_cell))
+                                        }, hypothesis_id="B", level=WARNING)
+                                        # #endregion
+                                        continue
+                        
+                                    if points_per_cell >= 1:
+                                        # Generate integer number of points
+                                        try:
+                                            num_points = int(points_per_cell)
+                                            if num_points < 0 or num_points > 10000:  # Safety limit
+                                                # #region agent log
+                                                debug_log("popLing.generate_points_in_polygon", "Points per cell out of safe range", {
+                                                    "num_points": num_points
+                                                }, hypothesis_id="B", level=WARNING)
+                                                # #endregion
+                                                continue
+                                        except (ValueError, OverflowError) as e:
+                                            # #region agent log
+                                            debug_log("popLing.generate_points_in_polygon", "Error converting points_per_cell to int", {
+                                                "points_per_cell": points_per_cell,
+                                                "error": str(e)
+                                            }, hypothesis_id="B", level=ERROR)
+                                            # #endregion
+                                            continue
+                            
+                                    else:
+                                        # Fractional: randomly decide whether to place 1 point
+                                        num_points = int(self.should_place_point(points_per_cell, polygon_rng))
+                                    
+                                    if slot >= 0:
+                                        boundary_counts[slot] = self.boundary_points(num_points, fraction, polygon_rng)
+                                    else:
+                                        for _ in range(num_points):
+                                            new_x = x + polygon_rng.uniform(-cell_size/2, cell_size/2)
+                                            new_y = y + polygon_rng.uniform(-cell_size/2, cell_size/2)
+                                            points.append_point(new_x, new_y)
+                                            total_points_generated += 1
+                        
+                                    total_cells_processed += 1
+                                    cells_in_polygon += 1
+                            except Exception as e:
+                                # #region agent log
+                                debug_log("popLing.generate_points_in_polygon", "Exception in cell processing", {
+                                    "error": str(e),
+                                    "traceback": traceback.format_exc(),
+                                    "x": x,
+                                    "y": y,
+                                    "polygon_count": polygon_count
+                                }, hypothesis_id="B", level=ERROR)
+                                # #endregion
+                                continue
+                
+                if any(boundary_counts):
+                    with profile.stage("rng"):
+                        px, py = cells.shape.sample(cells.shape_index, boundary_counts, tile_rng)
+                    points.append(px, py)
+                    total_points_generated += px.size
+                
+                if on_chunk is not None and len(points):
+                    with profile.stage("feature_write"):
+                        on_chunk(*points.to_arrays())
+                    points.clear()
+                profile.checkpoint()
+                if feedback is not None and feature_count:
+                    feedback.setProgress(
+                        100.0 * (polygon_count - 1 + (tile_index + 1) / len(tiles)) / feature_count)
+            
+            # #region agent log
+            if log_enabled(DEBUG):
+                debug_log("popLing.generate_points_in_polygon", f"Completed polygon {polygon_count}", {
+                    "cells_in_polygon": cells_in_polygon,
+                    "tiles": len(tiles)
+                }, hypothesis_id="B")
+            # #endregion
+        
+        # #region agent log
+        if log_enabled(DEBUG):
+            debug_log("popLing.generate_points_in_polygon", "Point generation complete", {
+                "polygons_processed": polygon_count,
+                "cells_processed": total_cells_processed,
+                "points_generated": total_points_generated,
+                "total_points": len(points)
+            }, hypothesis_id="B")
+        # #endregion
+        return points.to_arrays(release=True)
+
+    def get_polygon_rings(self, polygon_geom):
+        """Get every ring (exterior and holes, all parts) as (N, 2) float64 arrays"""
+        if polygon_geom.isMultipart():
+            polygons = polygon_geom.asMultiPolygon()
+        else:
+            polygons = [polygon_geom.asPolygon()]
+        return [
+            np.array([(vertex.x(), vertex.y()) for vertex in ring], dtype=np.float64)
+            for polygon in polygons
+            for ring in polygon
+        ]
+
+    def generate_points_vectorized(self, polygon_source, raster_provider, density_ranges, raster_points_per_sample_width=2.0,
+                                   polygon_crs=None, feature_count=None, transform_context=None,
+                                   feedback=None, on_chunk=None, seed=None, crs_mode="transform",
+                                   resample="nearest", density_model="ranges", density_curve=None,
+                                   total_points=None, total_field=None, profile=None, surfaces=None,
+                                   cell_grid=None):
+        """Generate points within polygon with the NumPy engine.
+
+        Statistically equivalent to generate_points_in_polygon, but the sample
+        grid, points per cell and jitter offsets are built as arrays and drawn
+        in batched RNG calls. Polygon grids are processed in core.TILE_CELLS
+        tiles, each with its own random stream derived from ``seed``, the
+        feature id and the tile position, so a seeded run gives exactly the
+        same points as the parallel engine. Takes the same arguments as
+        generate_points_in_polygon. Returns the coordinates as two float64
+        arrays (x, y) in the polygon CRS, or empty arrays when ``on_chunk``
+        receives them tile by tile.
+
+        ``surfaces``, a list of DensitySurface, samples several density
+        surfaces (e.g. the cohort rasters or bands of a co-registered stack)
+        in one pass: polygons are read, and their sample cells and boundary
+        cells computed, once for all of them (core.sample_polygon_surfaces).
+        ``raster_provider`` still sets the sample grid and ``density_ranges``
+        and the density model arguments are ignored. Every point is then
+        tagged with its surface's index: ``on_chunk`` is called as
+        ``on_chunk(x, y, surface)`` and the result is (x, y, surface) arrays.
+        Surfaces cannot be combined with exact totals.
+
+        ``cell_grid`` (a core.CellGrid, see popLing_cache) caches the sample
+        grid. A complete grid with this run's cell size supplies every
+        polygon's sample cells and raster values, so no feature is fetched
+        and the raster is not read; any other grid is refilled by the run and
+        completed if the run gets through every polygon. The points are the
+        same either way. Not used with exact totals or several surfaces.
+        """
+        # #region agent log
+        if log_enabled(DEBUG):
+            debug_log("popLing.generate_points_vectorized", "Function entry", {
+                "num_ranges": len(density_ranges),
+                "raster_points_per_sample_width": raster_points_per_sample_width
+            }, hypothesis_id="B")
+        # #endregion
+        exact_totals = total_points is not None or bool(total_field)
+        if surfaces and exact_totals:
+            raise ValueError("Exact totals cannot be combined with several density surfaces")
+        empty = (np.empty(0), np.empty(0))
+        if surfaces:
+            empty += (np.empty(0, dtype=np.int32),)
+        if profile is None:
+            profile = RunProfile()
+        
+        raster_width = raster_provider.xSize()
+        raster_height = raster_provider.ySize()
+        if raster_width <= 0 or raster_height <= 0:
+            # #region agent log
+            debug_log("popLing.generate_points_vectorized", "Invalid raster dimensions", {
+                "raster_width": raster_width,
+                "raster_height": raster_height
+            }, hypothesis_id="B", level=WARNING)
+            # #endregion
+            return empty
+        
+        if polygon_crs is None:
+            polygon_crs = polygon_source.sourceCrs()
+        if transform_context is None:
+            transform_context = QgsProject.instance().transformContext()
+        x_res, y_res = resolution_in_crs(raster_provider, polygon_crs, transform_context)
+        cell_size = min(x_res, y_res) * raster_points_per_sample_width
+        if cell_size <= 0 or not math.isfinite(cell_size):
+            # #region agent log
+            debug_log("popLing.generate_points_vectorized", "Invalid cell_size, aborting", {
+                "x_res": x_res,
+                "y_res": y_res,
+                "cell_size": cell_size
+            }, hypothesis_id="B", level=WARNING)
+            # #endregion
+            return empty
+        
+        if exact_totals or surfaces:
+            cell_grid = None
+        if cell_grid is not None and cell_grid.complete and cell_grid.cell_size == cell_size:
+            return self.generate_points_from_cell_grid(
+                cell_grid, core.compile_density_model(density_ranges, density_model, density_curve),
+                core.new_seed() if seed is None else seed, feedback=feedback, on_chunk=on_chunk,
+                profile=profile)
+        if cell_grid is not None:
+            cell_grid.start(cell_size)
+        
+        if surfaces:
+            readers = [
+                sampling_reader(
+                    surface.provider, polygon_crs, transform_context, crs_mode, band=surface.band,
+                    resample=resample, sample_width=raster_points_per_sample_width, profile=profile)
+                for surface in surfaces]
+            samplers = [
+                (surface_reader.values_at, core.compile_density_model(
+                    surface.density_ranges, surface.density_model, surface.density_curve))
+                for surface, surface_reader in zip(surfaces, readers)]
+        else:
+            readers = [sampling_reader(
+                raster_provider, polygon_crs, transform_context, crs_mode,
+                resample=resample, sample_width=raster_points_per_sample_width, profile=profile)]
+        reader = readers[0]
+        range_table = None if exact_totals or surfaces else core.compile_density_model(
+            density_ranges, density_model, density_curve)
+        if seed is None:
+            seed = core.new_seed()
+        points = core.PointBuffer(columns={"surface": np.int32} if surfaces else None)
+        polygon_count = 0
+        total_cells_processed = 0
+        points_generated = 0
+        if feature_count is None:
+            feature_count = polygon_source.featureCount()
+        
+        for polygon_feature in profile.iterate("feature_fetch", polygon_source.getFeatures()):
+            if feedback is not None and feedback.isCanceled():
+                break
+            polygon_count += 1
+            if feedback is not None and feature_count:
+                feedback.setProgress(100.0 * (polygon_count - 1) / feature_count)
+            polygon_geom = polygon_feature.geometry()
+            bbox = polygon_geom.boundingBox()
+            x_min = bbox.xMinimum()
+            x_max = bbox.xMaximum()
+            y_min = bbox.yMinimum()
+            y_max = bbox.yMaximum()
+            if x_max <= x_min or y_max <= y_min:
+                continue
+            
+            # The polygon is burned into interior/boundary masks aligned with
+            # the sample grid and boundary cells are cut along its edges, so
+            # no point or cell needs a containment test
+            with profile.stage("containment"):
+                edges = core.polygon_edges(self.get_polygon_rings(polygon_geom))
+            polygon_points = 0
+            polygon_cells = 0
+            polygon_boundary_cells = 0
+            is_canceled = feedback.isCanceled if feedback is not None else None
+            if surfaces:
+                tiles = core.sample_polygon_surfaces(
+                    edges, x_min, x_max, y_min, y_max, cell_size, samplers,
+                    seed, polygon_feature.id(), is_canceled=is_canceled, profile=profile)
+            else:
+                if exact_totals:
+                    tiles = core.sample_polygon_total(
+                        edges, x_min, x_max, y_min, y_max, cell_size, reader.values_at,
+                        self.get_polygon_total(polygon_feature, total_points, total_field),
+                        seed, polygon_feature.id(), is_canceled=is_canceled, profile=profile)
+                else:
+                    kept_tiles = [] if cell_grid is not None else None
+                    tiles = core.sample_polygon(
+                        edges, x_min, x_max, y_min, y_max, cell_size, reader.values_at, range_table,
+                        seed, polygon_feature.id(), is_canceled=is_canceled, profile=profile,
+                        keep_tiles=kept_tiles)
+                # Everything belongs to the one surface
+                tiles = ((tile[0], tile[1], 0) + tile[2:] for tile in tiles)
+            for tile_index, tile_count, surface, px, py, cells_processed, boundary_cells in tiles:
+                polygon_points += int(px.size)
+                polygon_cells += cells_processed
+                polygon_boundary_cells += boundary_cells
+                if on_chunk is not None:
+                    with profile.stage("feature_write"):
+                        if surfaces:
+                            on_chunk(px, py, surface)
+                        else:
+                            on_chunk(px, py)
+                elif surfaces:
+                    points.append(px, py, surface=surface)
+                else:
+                    points.append(px, py)
+                profile.checkpoint()
+                if feedback is not None and feature_count:
+                    feedback.setProgress(
+                        100.0 * (polygon_count - 1 + (tile_index + 1) / tile_count) / feature_count)
+            points_generated += polygon_points
+            total_cells_processed += polygon_cells
+            if cell_grid is not None:
+                cell_grid.add_polygon(polygon_feature.id(), kept_tiles)
+            
+            # #region agent log
+            if log_enabled(DEBUG):
+                debug_log("popLing.generate_points_vectorized", f"Completed polygon {polygon_count}", {
+                    "cells_processed": polygon_cells,
+                    "boundary_cells": polygon_boundary_cells,
+                    "points": polygon_points
+                }, hypothesis_id="B")
+            # #endregion
+        
+        # #region agent log
+        if log_enabled(DEBUG):
+            debug_log("popLing.generate_points_vectorized", "Point generation complete", {
+                "polygons_processed": polygon_count,
+                "cells_processed": total_cells_processed,
+                "block_reads": sum(surface_reader.read_count for surface_reader in readers),
+                "total_points": points_generated
+            }, hypothesis_id="B")
+        # #endregion
+        if cell_grid is not None and not (feedback is not None and feedback.isCanceled()):
+            cell_grid.finish()
+            # #region agent log
+            if log_enabled(DEBUG):
+                debug_log("popLing.generate_points_vectorized", "Cell grid filled", {
+                    "complete": cell_grid.complete,
+                    "polygons": len(cell_grid.polygons),
+                    "bytes": cell_grid.nbytes
+                }, hypothesis_id="B")
+            # #endregion
+        if surfaces:
+            surface = points.column("surface")
+            return points.to_arrays(release=True) + (surface,)
+        return points.to_arrays(release=True)
+
+    def generate_points_from_cell_grid(self, cell_grid, range_table, seed, feedback=None, on_chunk=None,
+                                       profile=None):
+        """Redraw a run's points from a complete core.CellGrid.
+
+        Only counts and point positions are drawn (core.sample_cached_polygon);
+        ``range_table`` is the compiled density model. Reports progress,
+        cancellation and points like generate_points_vectorized, whose result
+        for the same seed this is.
+        """
+        if profile is None:
+            profile = RunProfile()
+        points = core.PointBuffer()
+        polygon_count = len(cell_grid.polygons)
+        points_generated = 0
+        is_canceled = feedback.isCanceled if feedback is not None else None
+        for polygon_index, (polygon_key, tiles) in enumerate(cell_grid.polygons):
+            if feedback is not None and feedback.isCanceled():
+                break
+            for tile_index, tile_count, px, py, _, _ in core.sample_cached_polygon(
+                    tiles, cell_grid.cell_size, range_table, seed, polygon_key,
+                    is_canceled=is_canceled, profile=profile):
+                points_generated += int(px.size)
+                if on_chunk is not None:
+                    with profile.stage("feature_write"):
+                        on_chunk(px, py)
+                else:
+                    points.append(px, py)
+                profile.checkpoint()
+                if feedback is not None:
+                    feedback.setProgress(100.0 * (polygon_index + (tile_index + 1) / tile_count) / polygon_count)
+        
+        # #region agent log
+        if log_enabled(DEBUG):
+            debug_log("popLing.generate_points_from_cell_grid", "Point generation complete", {
+                "polygons": polygon_count,
+                "cell_grid_bytes": cell_grid.nbytes,
+                "total_points": points_generated
+            }, hypothesis_id="B")
+        # #endregion
+        return points.to_arrays(release=True)
+
+    def generate_points_parallel(self, polygon_source, raster_provider, density_ranges, raster_points_per_sample_width=2.0,
+                                 polygon_crs=None, feature_count=None, transform_context=None,
+                                 feedback=None, on_chunk=None, seed=None, crs_mode="transform",
+                                 resample="nearest", density_model="ranges", density_curve=None,
+                                 total_points=None, total_field=None, workers=None, profile=None,
+                                 surfaces=None, cell_grid=None):
+        """Generate points with the vectorized engine in a pool of worker processes.
+
+        Polygons, and tiles of polygons too large for one tile, are sampled in
+        parallel by worker processes that read the raster through GDAL and
+        never load QGIS. Results are merged in polygon/tile order. Takes the
+        same arguments as generate_points_vectorized plus ``workers`` (default:
+        one per CPU core). Workers transform sample points in batches with
+        GDAL's default pipeline rather than ``transform_context``. The
+        workers' stage timings and memory are merged into ``profile``. Falls back
+        to generate_points_vectorized for rasters GDAL cannot open directly,
+        for the "reproject" ``crs_mode``, which needs QGIS, for runs over
+        several density ``surfaces`` and when a complete ``cell_grid`` lets
+        it redraw the points without reading the raster. Workers do not fill
+        ``cell_grid``.
+        """
+        # #region agent log
+        if log_enabled(DEBUG):
+            debug_log("popLing.generate_points_parallel", "Function entry", {
+                "num_ranges": len(density_ranges),
+                "raster_points_per_sample_width": raster_points_per_sample_width,
+                "workers": workers
+            }, hypothesis_id="B")
+        # #endregion
+        if polygon_crs is None:
+            polygon_crs = polygon_source.sourceCrs()
+        reproject = crs_mode == "reproject" and polygon_crs != raster_provider.crs()
+        exact_totals = total_points is not None or bool(total_field)
+        if cell_grid is not None and cell_grid.complete and not exact_totals:
+            return self.generate_points_vectorized(
+                polygon_source, raster_provider, density_ranges, raster_points_per_sample_width,
+                polygon_crs=polygon_crs, feature_count=feature_count, transform_context=transform_context,
+                feedback=feedback, on_chunk=on_chunk, seed=seed, crs_mode=crs_mode,
+                resample=resample, density_model=density_model, density_curve=density_curve,
+                total_points=total_points, total_field=total_field, profile=profile,
+                cell_grid=cell_grid)
+        if raster_provider.name() != "gdal" or reproject or surfaces:
+            # #region agent log
+            debug_log("popLing.generate_points_parallel", "Raster needs QGIS access, running in-process", {
+                "provider": raster_provider.name(),
+                "crs_mode": crs_mode,
+                "surfaces": len(surfaces or ())
+            }, hypothesis_id="B", level=WARNING)
+            # #endregion
+            return self.generate_points_vectorized(
+                polygon_source, raster_provider, density_ranges, raster_points_per_sample_width,
+                polygon_crs=polygon_crs, feature_count=feature_count, transform_context=transform_context,
+                feedback=feedback, on_chunk=on_chunk, seed=seed, crs_mode=crs_mode,
+                resample=resample, density_model=density_model, density_curve=density_curve,
+                total_points=total_points, total_field=total_field, profile=profile,
+                surfaces=surfaces, cell_grid=cell_grid)
+        empty = (np.empty(0), np.empty(0))
+        if profile is None:
+            profile = RunProfile()
+        
+        if raster_provider.xSize() <= 0 or raster_provider.ySize() <= 0:
+            return empty
+        if transform_context is None:
+            transform_context = QgsProject.instance().transformContext()
+        x_res, y_res = resolution_in_crs(raster_provider, polygon_crs, transform_context)
+        cell_size = min(x_res, y_res) * raster_points_per_sample_width
+        if cell_size <= 0 or not math.isfinite(cell_size):
+            return empty
+        
+        raster_source = QgsProviderRegistry.instance().decodeUri("gdal", raster_provider.dataSourceUri())
+        raster_spec = parallel.RasterSpec(
+            raster_source.get("path") or raster_provider.dataSourceUri(),
+            1,
+            raster_provider.crs().toWkt(),
+            polygon_crs.toWkt() if polygon_crs != raster_provider.crs() else "",
+            resample,
+            raster_points_per_sample_width)
+        range_table = None if exact_totals else core.compile_density_model(density_ranges, density_model, density_curve)
+        if seed is None:
+            seed = core.new_seed()
+        if feature_count is None:
+            feature_count = polygon_source.featureCount()
+        
+        # Progress (in polygons) reached once each partition is merged, and
+        # the exact total of every polygon in exact-total runs
+        progress_at = {}
+        polygon_totals = {}
+        
+        def partitions():
+            sequence = 0
+            polygon_count = 0
+            for polygon_feature in profile.iterate("feature_fetch", polygon_source.getFeatures()):
+                polygon_count += 1
+                polygon_geom = polygon_feature.geometry()
+                bbox = polygon_geom.boundingBox()
+                x_min = bbox.xMinimum()
+                x_max = bbox.xMaximum()
+                y_min = bbox.yMinimum()
+                y_max = bbox.yMaximum()
+                if x_max <= x_min or y_max <= y_min:
+                    continue
+                with profile.stage("containment"):
+                    edges = core.polygon_edges(self.get_polygon_rings(polygon_geom))
+                if exact_totals:
+                    polygon_totals[polygon_feature.id()] = self.get_polygon_total(
+                        polygon_feature, total_points, total_field)
+                tile_count = core.polygon_tile_count(x_min, x_max, y_min, y_max, cell_size)
+                for tile_index, (tile_row, tile_col, grid_x, grid_y, tile_edges) in enumerate(core.polygon_tiles(
+                        edges, x_min, x_max, y_min, y_max, cell_size)):
+                    progress_at[sequence] = polygon_count - 1 + (tile_index + 1) / tile_count
+                    yield parallel.Partition(
+                        sequence, polygon_count, polygon_feature.id(), (tile_row, tile_col),
+                        tile_edges, grid_x, grid_y, cell_size, range_table, raster_spec, seed)
+                    sequence += 1
+        
+        points = core.PointBuffer()
+        totals = {"points": 0, "cells": 0, "partitions": 0}
+        
+        def on_result(sequence, polygon, px, py, cells_processed, partition_profile):
+            totals["points"] += int(px.size)
+            totals["cells"] += cells_processed
+            totals["partitions"] += 1
+            profile.merge(partition_profile)
+            progress = progress_at.pop(sequence)
+            if feedback is not None and feature_count:
+                feedback.setProgress(100.0 * progress / feature_count)
+            if on_chunk is not None:
+                with profile.stage("feature_write"):
+                    on_chunk(px, py)
+            else:
+                points.append(px, py)
+            profile.checkpoint()
+        
+        is_canceled = feedback.isCanceled if feedback is not None else None
+        if not exact_totals:
+            parallel.run_partitions(partitions(), on_result, workers=workers, is_canceled=is_canceled)
+        else:
+            # First round: the cell weight of every tile. Then split each
+            # polygon's total between its tiles exactly as
+            # core.sample_polygon_total does and sample the tiles that got
+            # points, renumbered so sequences stay contiguous
+            all_partitions = list(partitions())
+            weights = {}
+            
+            def on_weight(sequence, polygon, weight, partition_profile):
+                weights[sequence] = weight
+                profile.merge(partition_profile)
+            
+            finished = parallel.run_partitions(
+                all_partitions, on_weight, workers=workers, is_canceled=is_canceled,
+                worker=parallel.partition_weight)
+            allocated = []
+            allocated_progress = {}
+            if finished:
+                by_polygon = {}
+                for partition in all_partitions:
+                    by_polygon.setdefault(partition.polygon, []).append(partition)
+                for polygon_partitions in by_polygon.values():
+                    polygon_key = polygon_partitions[0].polygon_key
+                    allocation = core.allocate_total(
+                        [weights[partition.sequence] for partition in polygon_partitions],
+                        polygon_totals[polygon_key],
+                        core.tile_rng(seed, polygon_key, core.ALLOCATION_STREAM, 0))
+                    for partition, tile_total in zip(polygon_partitions, allocation.tolist()):
+                        if tile_total:
+                            allocated_progress[len(allocated)] = progress_at[partition.sequence]
+                            allocated.append(partition._replace(sequence=len(allocated), total=tile_total))
+                progress_at.clear()
+                progress_at.update(allocated_progress)
+                parallel.run_partitions(allocated, on_result, workers=workers, is_canceled=is_canceled)
+        # #region agent log
+        if log_enabled(DEBUG):
+            debug_log("popLing.generate_points_parallel", "Point generation complete", {
+                "partitions": totals["partitions"],
+                "cells_processed": totals["cells"],
+                "total_points": totals["points"]
+            }, hypothesis_id="B")
+        # #endregion
+        return points.to_arrays(release=True)
@@ -0,0 +1,240 @@
+"""
+Logging for popLing
+
+NDJSON debug log with level gating, a buffered background writer and
+size-based rotation. Calls below the configured level return before any
+payload is built or serialized, so instrumentation left in hot paths costs
+a single comparison when it is switched off.
+
+The level defaults to WARNING and can be changed with the POPLING_LOG_LEVEL
+environment variable, the "popLing/logLevel" QGIS setting or configure().
+"""
+
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+
+LEVEL_NAMES = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "ERROR": ERROR, "OFF": OFF}
+
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+DEBUG_LOG_PATH = os.path.join(PLUGIN_DIR, '.cursor', 'debug.log')
+PLUGIN_NAME = 'popLing'
+
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 3
+
+
+def parse_level(value, default=WARNING):
+    """Turn a level name or number into a numeric level"""
+    if value is None or value == "":
+        return default
+    if isinstance(value, int):
+        return value
+    value = str(value).strip().upper()
+    if value in LEVEL_NAMES:
+        return LEVEL_NAMES[value]
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+class BufferedLogWriter:
+    """Background thread that appends log lines in batches and rotates by size"""
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, backup_count=DEFAULT_BACKUP_COUNT,
+                 batch_size=1000, max_queued=100000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._file = None
+        self._thread = threading.Thread(target=self._run, name="popLing-log", daemon=True)
+        self._thread.start()
+
+    def write(self, line):
+        """Queue one line; blocks only if the writer has fallen far behind"""
+        self._queue.put(line)
+
+    def flush(self, timeout=5.0):
+        """Wait until every line queued so far is on disk"""
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self, timeout=5.0):
+        """Flush and stop the writer thread"""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        running = True
+        while running:
+            items = [self._queue.get()]
+            # Drain whatever else is waiting into the same batch
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            events = []
+            for item in items:
+                if item is None:
+                    running = False
+                elif isinstance(item, threading.Event):
+                    events.append(item)
+                else:
+                    lines.append(item)
+            if lines:
+                self._write_batch(''.join(lines))
+            for event in events:
+                event.set()
+        self._close_file()
+
+    def _write_batch(self, text):
+        try:
+            if self._file is None:
+                log_dir = os.path.dirname(self.path)
+                if log_dir:
+                    os.makedirs(log_dir, exist_ok=True)
+                self._file = open(self.path, 'a', encoding='utf-8')
+            if self.max_bytes > 0 and self._file.tell() + len(text) > self.max_bytes and self._file.tell() > 0:
+                self._rotate()
+            self._file.write(text)
+            self._file.flush()
+        except Exception:
+            self._close_file()  # Never let logging take the plugin down
+
+    def _rotate(self):
+        self._close_file()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except Exception:
+                pass
+            self._file = None
+
+
+_level = parse_level(os.environ.get("POPLING_LOG_LEVEL"))
+_message_log_level = WARNING
+_log_path = DEBUG_LOG_PATH
+_max_bytes = int(os.environ.get("POPLING_LOG_MAX_BYTES", DEFAULT_MAX_BYTES))
+_backup_count = DEFAULT_BACKUP_COUNT
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def configure(level=None, path=None, max_bytes=None, backup_count=None, message_log_level=None):
+    """Change logging settings; only the arguments given are updated"""
+    global _level, _log_path, _max_bytes, _backup_count, _message_log_level
+    if level is not None:
+        _level = parse_level(level, _level)
+    if message_log_level is not None:
+        _message_log_level = parse_level(message_log_level, _message_log_level)
+    if path is not None or max_bytes is not None or backup_count is not None:
+        _log_path = path if path is not None else _log_path
+        _max_bytes = max_bytes if max_bytes is not None else _max_bytes
+        _backup_count = backup_count if backup_count is not None else _backup_count
+        shutdown()
+
+
+def get_level():
+    """Current numeric log level"""
+    return _level
+
+
+def log_enabled(level=DEBUG):
+    """True if entries at ``level`` would be written; use to guard hot paths"""
+    return level >= _level
+
+
+def _get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = BufferedLogWriter(_log_path, _max_bytes, _backup_count)
+    return _writer
+
+
+def flush():
+    """Block until queued entries have been written"""
+    if _writer is not None:
+        _writer.flush()
+
+
+def shutdown():
+    """Flush and stop the background writer (it restarts on the next entry)"""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
+
+
+atexit.register(shutdown)
+
+
+def debug_log(location, message, data=None, hypothesis_id=None, run_id='run1', level=DEBUG):
+    """Write an NDJSON log entry if ``level`` is enabled - never raises.
+
+    ``data`` may be a callable returning the payload; it is only called when
+    the entry is actually written. Entries at or above the message log level
+    (WARNING by default) are also shown in the QGIS Log Messages panel.
+    """
+    if level < _level:
+        return
+    try:
+        if callable(data):
+            data = data()
+        log_entry = {
+            "timestamp": int(time.time() * 1000),
+            "level": level,
+            "location": location,
+            "message": message,
+            "sessionId": "debug-session",
+            "runId": run_id,
+            "plugin": PLUGIN_NAME
+        }
+        if data is not None:
+            log_entry["data"] = data
+        if hypothesis_id:
+            log_entry["hypothesisId"] = hypothesis_id
+        line = json.dumps(log_entry, default=str)
+        _get_writer().write(line + '\n')
+    except Exception:
+        return
+
+    if level >= _message_log_level:
+        try:
+            from qgis.core import Qgis, QgsMessageLog
+            qgis_level = Qgis.Critical if level >= ERROR else Qgis.Warning if level >= WARNING else Qgis.Info
+            msg = f"{location}: {message}"
+            if data is not None:
+                msg += f" | Data: {json.dumps(data, default=str)}"
+            QgsMessageLog.logMessage(msg, PLUGIN_NAME, qgis_level)
+        except Exception:
+            pass  # QGIS not available or not initialized yet
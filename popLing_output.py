@@ -0,0 +1,137 @@
+"""
+Streaming point output for popLing
+
+Generated points are written to a GeoPackage or FlatGeobuf file in
+fixed-size batches as they are produced, so memory use does not grow with
+the total number of points and the result outlives the project.
+"""
+
+import os
+
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import (
+    QgsCoordinateTransformContext,
+    QgsFeature,
+    QgsField,
+    QgsFields,
+    QgsGeometry,
+    QgsVectorFileWriter,
+    QgsWkbTypes,
+)
+
+
+# File extension -> OGR driver for the supported output formats
+OUTPUT_DRIVERS = {".gpkg": "GPKG", ".fgb": "FlatGeobuf"}
+OUTPUT_FILTER = "GeoPackage (*.gpkg);;FlatGeobuf (*.fgb)"
+LAYER_NAME = "points"
+DEFAULT_BATCH_SIZE = 50000
+
+
+def point_fields(surfaces=False):
+    """Attribute fields of a popLing point layer, with a "surface" field for multi-surface runs"""
+    fields = QgsFields()
+    fields.append(QgsField("id", QVariant.Int))
+    if surfaces:
+        fields.append(QgsField("surface", QVariant.String))
+    return fields
+
+
+def _batch_features(xs, ys, fields, first_id, surface):
+    """Point features of one batch, split from a single MultiPoint geometry"""
+    # Imported here so loading the plugin does not import NumPy
+    try:
+        from . import popLing_core as core
+    except ImportError:
+        import popLing_core as core
+    multipoint = QgsGeometry()
+    multipoint.fromWkb(core.multipoint_wkb(xs, ys))
+    suffix = [] if surface is None else [surface]
+    features = []
+    for feature_id, geometry in enumerate(multipoint.asGeometryCollection(), first_id):
+        feat = QgsFeature(fields)
+        feat.setGeometry(geometry)
+        feat.setAttributes([feature_id] + suffix)
+        features.append(feat)
+    return features
+
+
+def point_feature_batches(xs, ys, fields, first_id=1, batch_size=DEFAULT_BATCH_SIZE, surface=None):
+    """Turn coordinate arrays into lists of at most ``batch_size`` point features.
+
+    The coordinates of a batch are packed into one MultiPoint WKB with NumPy
+    and parsed by QGIS in one call, which also splits it into point
+    geometries; the QgsFeature objects are still created one per point in
+    Python. Only one batch of features exists at a time: add each list to
+    its layer before taking the next. Features get consecutive "id"
+    attributes starting at ``first_id`` and, if ``surface`` is given, that
+    density surface's name as their "surface" attribute (see point_fields).
+    """
+    batch_size = max(1, int(batch_size))
+    for start in range(0, len(xs), batch_size):
+        yield _batch_features(
+            xs[start:start + batch_size], ys[start:start + batch_size], fields, first_id + start, surface)
+
+
+def driver_for_path(path):
+    """OGR driver name for an output path, or None if the format is not supported"""
+    return OUTPUT_DRIVERS.get(os.path.splitext(path)[1].lower())
+
+
+def layer_uri(path):
+    """OGR data source URI of the point layer in a written file"""
+    if driver_for_path(path) == "GPKG":
+        return f"{path}|layername={LAYER_NAME}"
+    return path
+
+
+class PointFileWriter:
+    """Writes point coordinate chunks to a GeoPackage or FlatGeobuf file.
+
+    Chunks of any size are split into batches of at most ``batch_size``
+    features, so only one batch of QgsFeature objects exists at a time. An
+    existing file at ``path`` is overwritten. Feature ids continue across
+    chunks starting at 1. Call close() to flush the file.
+    """
+
+    def __init__(self, path, crs, transform_context=None, batch_size=DEFAULT_BATCH_SIZE):
+        driver = driver_for_path(path)
+        if driver is None:
+            raise ValueError(
+                f"Unsupported output format {os.path.splitext(path)[1]!r}; "
+                f"use one of {', '.join(sorted(OUTPUT_DRIVERS))}")
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = driver
+        options.layerName = LAYER_NAME
+        options.fileEncoding = "UTF-8"
+        options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteFile
+        self.path = path
+        self.fields = point_fields()
+        self.batch_size = max(1, int(batch_size))
+        self.next_id = 1
+        self.writer = QgsVectorFileWriter.create(
+            path, self.fields, QgsWkbTypes.Point, crs,
+            transform_context or QgsCoordinateTransformContext(), options)
+        if self.writer.hasError() != QgsVectorFileWriter.NoError:
+            message = self.writer.errorMessage()
+            self.writer = None
+            raise IOError(f"Unable to create {path}: {message}")
+
+    @property
+    def uri(self):
+        """Data source URI for loading the written layer with the "ogr" provider"""
+        return layer_uri(self.path)
+
+    def write_points(self, xs, ys):
+        """Append points given as coordinate arrays"""
+        for features in point_feature_batches(xs, ys, self.fields, self.next_id, self.batch_size):
+            if not self.writer.addFeatures(features):
+                raise IOError(f"Writing to {self.path} failed: {self.writer.errorMessage()}")
+        self.next_id += len(xs)
+
+    def close(self):
+        """Flush buffered features and close the file"""
+        if self.writer is not None:
+            self.writer.flushBuffer()
+            # The file is finalized when the writer is destroyed
+            del self.writer
+            self.writer = None
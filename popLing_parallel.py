@@ -0,0 +1,312 @@
+"""
+Process-pool parallel point generation for popLing
+
+Work is split into partitions - a whole polygon, or one tile of a large
+polygon's sample grid - that are sampled in worker processes. Workers only
+import NumPy, GDAL and popLing_core (never QGIS) and open their own raster
+windows, so they start quickly and share nothing with the QGIS process.
+Results are handed back in partition order, so the merged output does not
+depend on scheduling.
+"""
+
+import math
+import multiprocessing
+import multiprocessing.spawn
+import os
+import sys
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+try:
+    from . import popLing_core as core
+    from .popLing_profile import RunProfile
+except ImportError:
+    import popLing_core as core
+    from popLing_profile import RunProfile
+
+
+# Where a worker reads raster values: a GDAL-readable source, the band, the
+# WKT of the raster and polygon CRSs (equal WKT means no transform), and how
+# samples read pixels (core.RESAMPLE_MODES, sample cell width in pixels)
+RasterSpec = namedtuple(
+    "RasterSpec", ["path", "band", "raster_wkt", "polygon_wkt", "resample", "sample_width"],
+    defaults=("nearest", 1.0))
+
+# One unit of work: one tile (core.polygon_tiles) of one polygon. ``polygon``
+# is the polygon's position in the run (for progress), ``polygon_key`` its
+# feature id and ``tile`` its (row, col); with ``seed`` they select the
+# tile's random stream. ``total`` is the tile's share of an exact polygon
+# total (core.sample_grid_total), None to sample ``range_table``.
+Partition = namedtuple("Partition", [
+    "sequence", "polygon", "polygon_key", "tile", "edges", "grid_x", "grid_y",
+    "cell_size", "range_table", "raster", "seed", "total"],
+    defaults=(None,))
+
+
+class GdalBlockReader:
+    """GDAL counterpart of popLing_raster.RasterBlockReader for worker processes.
+
+    Assumes a north-up raster. Reads one window covering all requested
+    pixels per call, which partitions keep small. ``resample`` and
+    ``sample_width`` work as in RasterBlockReader: "overview" reads the
+    closest overview band directly, "mean" and "sum" aggregate the
+    full-resolution pixels under each sample cell.
+    """
+
+    def __init__(self, path, band=1, resample="nearest", sample_width=1.0):
+        from osgeo import gdal
+        self.dataset = gdal.Open(path, gdal.GA_ReadOnly)
+        if self.dataset is None:
+            raise IOError(f"Unable to open raster {path!r} with GDAL")
+        self.band = self.dataset.GetRasterBand(band)
+        self.no_data = self.band.GetNoDataValue()
+        self.resample = resample
+        native_width = self.dataset.RasterXSize
+        native_height = self.dataset.RasterYSize
+        x_origin, x_res, _, y_origin, _, y_res = self.dataset.GetGeoTransform()
+        self.x_origin = x_origin
+        self.y_origin = y_origin
+        self.factor = 1
+        self.read_band = self.band
+        if resample == "overview":
+            overviews = {}
+            for index in range(self.band.GetOverviewCount()):
+                overview = self.band.GetOverview(index)
+                if overview is not None and overview.XSize > 0:
+                    overviews[int(round(native_width / overview.XSize))] = overview
+            self.factor = core.overview_factor(list(overviews), sample_width)
+            if self.factor > 1:
+                self.read_band = overviews[self.factor]
+        if self.read_band is not self.band:
+            self.width = self.read_band.XSize
+            self.height = self.read_band.YSize
+            self.x_res = x_res * native_width / self.width
+            self.y_res = -y_res * native_height / self.height
+        else:
+            self.width = math.ceil(native_width / self.factor)
+            self.height = math.ceil(native_height / self.factor)
+            self.x_res = x_res * self.factor
+            self.y_res = -y_res * self.factor
+        self.half_height, self.half_width = core.cell_half_size(sample_width, self.x_res, self.y_res)
+        self.read_count = 0
+
+    def _read(self, band, col0, row0, cols, rows):
+        window = band.ReadAsArray(col0, row0, cols, rows)
+        self.read_count += 1
+        window = window.astype(np.float64)
+        if self.no_data is not None:
+            window[window == self.no_data] = np.nan
+        return window
+
+    def read_window(self, row0, col0, rows, cols):
+        """Read a window of the read grid as a float64 array (NaN for no-data)"""
+        return self._read(self.read_band, col0, row0, cols, rows)
+
+    def cell_values(self, xs, ys):
+        """Mean or sum of the pixels under the sample cells centered on ``xs``, ``ys``"""
+        cols = (xs - self.x_origin) / self.x_res
+        rows = (self.y_origin - ys) / self.y_res
+        col0 = max(0, int(math.floor(cols.min() - self.half_width)))
+        row0 = max(0, int(math.floor(rows.min() - self.half_height)))
+        col1 = min(self.width, int(math.ceil(cols.max() + self.half_width)))
+        row1 = min(self.height, int(math.ceil(rows.max() + self.half_height)))
+        window = self.read_window(row0, col0, row1 - row0, col1 - col0)
+        return core.cell_aggregates(
+            window, rows - row0, cols - col0, self.half_height, self.half_width, self.resample)
+
+    def values_at(self, xs, ys):
+        """Return raster values for coordinate arrays, NaN where there is no value"""
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        values = np.full(xs.shape, np.nan)
+        cols = np.floor((xs - self.x_origin) / self.x_res)
+        rows = np.floor((self.y_origin - ys) / self.y_res)
+        valid = (
+            np.isfinite(cols) & np.isfinite(rows) &
+            (cols >= 0) & (cols < self.width) & (rows >= 0) & (rows < self.height)
+        )
+        if not valid.any():
+            return values
+        if self.resample in ("mean", "sum"):
+            values[valid] = self.cell_values(xs[valid], ys[valid])
+            return values
+        cols = cols[valid].astype(np.int64)
+        rows = rows[valid].astype(np.int64)
+        col0 = int(cols.min())
+        row0 = int(rows.min())
+        window = self.read_window(
+            row0, col0, int(rows.max()) - row0 + 1, int(cols.max()) - col0 + 1)
+        values[valid] = window[rows - row0, cols - col0]
+        return values
+
+
+class OsrTransform:
+    """Array coordinate transform between two WKT CRSs using GDAL/OSR"""
+
+    def __init__(self, source_wkt, target_wkt):
+        from osgeo import osr
+        source = osr.SpatialReference()
+        source.ImportFromWkt(source_wkt)
+        target = osr.SpatialReference()
+        target.ImportFromWkt(target_wkt)
+        if hasattr(osr, "OAMS_TRADITIONAL_GIS_ORDER"):
+            source.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            target.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        self.transformation = osr.CoordinateTransformation(source, target)
+
+    def transform(self, xs, ys):
+        """Transform coordinate arrays; failed points become NaN"""
+        if len(xs) == 0:
+            return np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+        points = np.array(
+            self.transformation.TransformPoints(np.column_stack([xs, ys]).tolist()),
+            dtype=np.float64)
+        points[~np.isfinite(points)] = np.nan
+        return points[:, 0], points[:, 1]
+
+
+# Per-process caches so a worker opens each raster and transform only once
+_readers = {}
+_transforms = {}
+
+
+def _reader_for(raster):
+    key = (raster.path, raster.band, raster.resample, raster.sample_width)
+    if key not in _readers:
+        _readers[key] = GdalBlockReader(raster.path, raster.band, raster.resample, raster.sample_width)
+    return _readers[key]
+
+
+def _transform_for(raster):
+    if not raster.polygon_wkt or raster.polygon_wkt == raster.raster_wkt:
+        return None
+    key = (raster.polygon_wkt, raster.raster_wkt)
+    if key not in _transforms:
+        _transforms[key] = OsrTransform(raster.polygon_wkt, raster.raster_wkt)
+    return _transforms[key]
+
+
+def _values_at_for(raster, profile=None):
+    """values_at(xs, ys) in polygon coordinates for a RasterSpec"""
+    reader = _reader_for(raster)
+    transform = _transform_for(raster)
+
+    def values_at(xs, ys):
+        if transform is not None:
+            with core.profile_stage(profile, "crs_transform"):
+                xs, ys = transform.transform(xs, ys)
+        return reader.values_at(xs, ys)
+    return values_at
+
+
+def sample_partition(partition):
+    """Worker entry point: sample one partition.
+
+    Returns (sequence, polygon, x, y, cells_processed, profile), ``profile``
+    being the partition's RunProfile.snapshot().
+    """
+    profile = RunProfile()
+    values_at = _values_at_for(partition.raster, profile)
+    rng = core.tile_rng(partition.seed, partition.polygon_key, *partition.tile)
+    if partition.total is not None:
+        chunks = list(core.sample_grid_total(
+            partition.edges, partition.grid_x, partition.grid_y, partition.cell_size,
+            values_at, partition.total, rng, profile=profile))
+        px = np.concatenate([chunk[0] for chunk in chunks])
+        py = np.concatenate([chunk[1] for chunk in chunks])
+        cells_processed = sum(chunk[2] for chunk in chunks)
+    else:
+        px, py, cells_processed, _ = core.sample_grid(
+            partition.edges, partition.grid_x, partition.grid_y, partition.cell_size,
+            values_at, partition.range_table, rng, profile)
+    return partition.sequence, partition.polygon, px, py, cells_processed, profile.snapshot()
+
+
+def partition_weight(partition):
+    """Worker entry point: total allocation weight of a partition's cells.
+
+    First pass of exact-total runs (see core.sample_polygon_total). Returns
+    (sequence, polygon, weight, profile) like sample_partition.
+    """
+    profile = RunProfile()
+    weight = core.grid_weight(
+        partition.edges, partition.grid_x, partition.grid_y, partition.cell_size,
+        _values_at_for(partition.raster, profile), profile)
+    return partition.sequence, partition.polygon, weight, profile.snapshot()
+
+
+def _python_executable():
+    """Interpreter for worker processes (inside QGIS sys.executable is QGIS itself)"""
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        return sys.executable
+    if sys.platform == "win32":
+        candidates = ("pythonw.exe", "python.exe")
+        folder = sys.exec_prefix
+    else:
+        candidates = (f"python{sys.version_info.major}.{sys.version_info.minor}",
+                      f"python{sys.version_info.major}", "python")
+        folder = os.path.join(sys.exec_prefix, "bin")
+    for name in candidates:
+        candidate = os.path.join(folder, name)
+        if os.path.exists(candidate):
+            return candidate
+    return sys.executable
+
+
+def default_workers():
+    """Number of worker processes to use when none is configured"""
+    return max(1, os.cpu_count() or 1)
+
+
+def run_partitions(partitions, on_result, workers=None, is_canceled=None, worker=sample_partition):
+    """Sample partitions in a process pool and deliver results in order.
+
+    ``partitions`` may be a lazy iterable, numbered by ``sequence`` from 0
+    without gaps; at most two partitions per worker are in flight or waiting
+    for an earlier one to finish, so memory stays bounded. ``on_result`` is called with the ``worker``
+    function's result tuple - for sample_partition (sequence, polygon, x, y,
+    cells_processed, profile) - in sequence order. Returns False if ``is_canceled()``
+    stopped the run early. The spawn executable is process-wide; it is set
+    for this pool and restored once the pool has shut down.
+    """
+    workers = workers or default_workers()
+    context = multiprocessing.get_context("spawn")
+    previous_executable = multiprocessing.spawn.get_executable()
+    context.set_executable(_python_executable())
+    max_pending = 2 * workers
+    pending = set()
+    finished = {}
+    next_sequence = 0
+    partitions = iter(partitions)
+    exhausted = False
+
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    try:
+        while True:
+            if is_canceled is not None and is_canceled():
+                for future in pending:
+                    future.cancel()
+                return False
+            # Results waiting for an earlier partition count too, so one slow
+            # partition cannot let finished results pile up
+            while not exhausted and len(pending) + len(finished) < max_pending:
+                partition = next(partitions, None)
+                if partition is None:
+                    exhausted = True
+                else:
+                    pending.add(executor.submit(worker, partition))
+            if not pending:
+                break
+            done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                finished[result[0]] = result
+            while next_sequence in finished:
+                on_result(*finished.pop(next_sequence))
+                next_sequence += 1
+        return True
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        context.set_executable(previous_executable)
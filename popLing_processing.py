@@ -0,0 +1,363 @@
+"""
+Processing provider for popLing
+
+Exposes point generation as a Processing algorithm so it can run from the
+Processing toolbox, batch mode, graphical models and qgis_process without
+the dialog.
+"""
+
+from qgis.core import (
+    QgsFeatureSink,
+    QgsProcessing,
+    QgsProcessingAlgorithm,
+    QgsProcessingException,
+    QgsProcessingOutputNumber,
+    QgsProcessingParameterBand,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterField,
+    QgsProcessingParameterFeatureSink,
+    QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterMatrix,
+    QgsProcessingParameterMultipleLayers,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterRasterLayer,
+    QgsProcessingProvider,
+    QgsWkbTypes,
+)
+
+try:
+    from .popLing_output import point_feature_batches, point_fields
+except ImportError:
+    from popLing_output import point_feature_batches, point_fields
+
+
+# Enum parameter values. The engine modules are only imported when the
+# algorithm runs, so these are spelled out here rather than imported
+ENGINES = ("vectorized", "parallel", "classic")
+CRS_MODES = ("transform", "reproject")
+RESAMPLE_MODES = ("nearest", "overview", "mean", "sum")
+DENSITY_MODELS = ("ranges", "linear", "log", "lookup")
+
+# Same defaults as the dialog's density table
+DEFAULT_DENSITY_RANGES = [10, 200, 0.3, 200, 4000, 1.0, 4000, 25000, 5.0]
+
+
+def parse_density_matrix(values):
+    """Turn a flat [min, max, points_per_cell, ...] matrix into density range dicts.
+
+    Raises ValueError for incomplete rows, non-numeric cells and the same
+    invalid ranges the dialog rejects.
+    """
+    values = list(values or [])
+    if len(values) % 3:
+        raise ValueError("Density ranges need three columns: min, max and points per cell")
+    ranges = []
+    for row in range(len(values) // 3):
+        try:
+            min_val, max_val, points_per_cell = (float(v) for v in values[3 * row:3 * row + 3])
+        except (TypeError, ValueError):
+            raise ValueError(f"Range {row + 1}: values must be numbers")
+        if min_val >= max_val:
+            raise ValueError(f"Range {row + 1}: Min must be less than Max")
+        if points_per_cell < 0:
+            raise ValueError(f"Range {row + 1}: Points per cell cannot be negative")
+        ranges.append({"min": min_val, "max": max_val, "points_per_cell": points_per_cell})
+    if not ranges:
+        raise ValueError("No valid density ranges defined")
+    return ranges
+
+
+def parse_surface_ranges(values, surface_count):
+    """Turn a flat [surface, min, max, points_per_cell, ...] matrix into per-surface density ranges.
+
+    Surfaces are numbered from 1; returns {surface index: ranges} with
+    0-based indices, for the surfaces that have rows. Raises ValueError
+    like parse_density_matrix, and for unknown surface numbers.
+    """
+    values = list(values or [])
+    if len(values) % 4:
+        raise ValueError("Surface ranges need four columns: surface, min, max and points per cell")
+    rows = {}
+    for row in range(len(values) // 4):
+        try:
+            surface = int(float(values[4 * row]))
+        except (TypeError, ValueError):
+            raise ValueError(f"Row {row + 1}: the surface must be a number")
+        if not 1 <= surface <= surface_count:
+            raise ValueError(f"Row {row + 1}: there is no surface {surface} (1 to {surface_count})")
+        rows.setdefault(surface - 1, []).extend(values[4 * row + 1:4 * row + 4])
+    return {surface: parse_density_matrix(flat) for surface, flat in rows.items()}
+
+
+def parse_density_curve(values):
+    """Turn a flat [value, points_per_cell, ...] matrix into (value, points) pairs.
+
+    Raises ValueError for incomplete rows and non-numeric cells; the curve
+    itself is checked when popLing_core compiles it.
+    """
+    values = list(values or [])
+    if len(values) % 2:
+        raise ValueError("The density curve needs two columns: value and points per cell")
+    try:
+        return [(float(values[i]), float(values[i + 1])) for i in range(0, len(values), 2)]
+    except (TypeError, ValueError):
+        raise ValueError("Density curve values must be numbers")
+
+
+class GeneratePointsAlgorithm(QgsProcessingAlgorithm):
+    """Generate points within polygons from raster density ranges"""
+
+    INPUT = "INPUT"
+    RASTER = "RASTER"
+    BANDS = "BANDS"
+    EXTRA_RASTERS = "EXTRA_RASTERS"
+    SURFACE_RANGES = "SURFACE_RANGES"
+    SAMPLE_WIDTH = "SAMPLE_WIDTH"
+    DENSITY_RANGES = "DENSITY_RANGES"
+    SEED = "SEED"
+    ENGINE = "ENGINE"
+    WORKERS = "WORKERS"
+    CRS_MODE = "CRS_MODE"
+    RESAMPLE = "RESAMPLE"
+    DENSITY_MODEL = "DENSITY_MODEL"
+    DENSITY_CURVE = "DENSITY_CURVE"
+    TOTAL_POINTS = "TOTAL_POINTS"
+    TOTAL_FIELD = "TOTAL_FIELD"
+    OUTPUT = "OUTPUT"
+    POINT_COUNT = "POINT_COUNT"
+    SEED_USED = "SEED_USED"
+
+    def createInstance(self):
+        return GeneratePointsAlgorithm()
+
+    def name(self):
+        return "generatepoints"
+
+    def displayName(self):
+        return "Plot points from raster density"
+
+    def shortHelpString(self):
+        return (
+            "Generates points inside the input polygons. The raster is sampled "
+            "on a grid of cells 'Raster points per sample width' raster pixels "
+            "wide; each cell whose value falls in a density range (first match "
+            "wins, bounds inclusive) receives that range's points per cell, "
+            "fractional values being placed with that probability. The "
+            "continuous density models instead interpolate an expected number "
+            "of points per cell between the range midpoints (linearly or on a "
+            "log scale) or along the density curve, and draw each cell's count "
+            "from a Poisson distribution. With a total number of points or a "
+            "total field, each polygon instead gets exactly that many points, "
+            "allocated to its cells in proportion to the raster values. Runs "
+            "with the same non-zero seed and inputs produce the same points. "
+            "Several bands of the density raster and/or additional rasters "
+            "are sampled as separate density surfaces in a single pass over "
+            "the polygons and the density raster's sample grid; each point's "
+            "'surface' attribute names its surface. Surface ranges rows "
+            "(surface number from 1, min, max, points per cell) give a surface "
+            "its own ranges, otherwise it uses the density ranges.")
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.INPUT, "Polygon layer", [QgsProcessing.TypeVectorPolygon]))
+        self.addParameter(QgsProcessingParameterRasterLayer(
+            self.RASTER, "Density raster"))
+        self.addParameter(QgsProcessingParameterBand(
+            self.BANDS, "Density bands (several = one surface each)", parentLayerParameterName=self.RASTER,
+            optional=True, allowMultiple=True))
+        self.addParameter(QgsProcessingParameterMultipleLayers(
+            self.EXTRA_RASTERS, "Additional density rasters (one surface each)",
+            QgsProcessing.TypeRaster, optional=True))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.SAMPLE_WIDTH, "Raster points per sample width",
+            QgsProcessingParameterNumber.Double, defaultValue=2.0, minValue=0.0001))
+        self.addParameter(QgsProcessingParameterMatrix(
+            self.DENSITY_RANGES, "Density ranges",
+            headers=["Min", "Max", "Points per cell"],
+            defaultValue=DEFAULT_DENSITY_RANGES))
+        self.addParameter(QgsProcessingParameterEnum(
+            self.DENSITY_MODEL, "Density model",
+            options=["Ranges (step)", "Continuous, linear", "Continuous, log scale", "Continuous, lookup curve"],
+            defaultValue=0))
+        self.addParameter(QgsProcessingParameterMatrix(
+            self.DENSITY_CURVE, "Density curve (lookup model)",
+            headers=["Value", "Points per cell"], optional=True))
+        self.addParameter(QgsProcessingParameterMatrix(
+            self.SURFACE_RANGES, "Density ranges per surface",
+            headers=["Surface", "Min", "Max", "Points per cell"], optional=True))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.TOTAL_POINTS, "Exact total points per polygon (0 = use the density settings)",
+            QgsProcessingParameterNumber.Integer, defaultValue=0, minValue=0))
+        self.addParameter(QgsProcessingParameterField(
+            self.TOTAL_FIELD, "Exact totals from field", parentLayerParameterName=self.INPUT,
+            type=QgsProcessingParameterField.Numeric, optional=True))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.SEED, "Random seed (0 = random)",
+            QgsProcessingParameterNumber.Integer, defaultValue=0, minValue=0, maxValue=2147483647))
+        self.addParameter(QgsProcessingParameterEnum(
+            self.ENGINE, "Engine", options=["Vectorized (NumPy)", "Parallel (process pool)", "Classic (per-cell loop)"],
+            defaultValue=0))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.WORKERS, "Worker processes for the parallel engine (0 = one per CPU core)",
+            QgsProcessingParameterNumber.Integer, defaultValue=0, minValue=0, maxValue=256))
+        self.addParameter(QgsProcessingParameterEnum(
+            self.CRS_MODE, "CRS handling", options=["Transform sample points", "Reproject raster windows"],
+            defaultValue=0))
+        self.addParameter(QgsProcessingParameterEnum(
+            self.RESAMPLE, "Raster sampling",
+            options=["Nearest full-resolution pixel", "Closest overview", "Mean of cell pixels", "Sum of cell pixels"],
+            defaultValue=0))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.OUTPUT, "Points", QgsProcessing.TypeVectorPoint))
+        self.addOutput(QgsProcessingOutputNumber(self.SEED_USED, "Random seed used"))
+        self.addOutput(QgsProcessingOutputNumber(self.POINT_COUNT, "Number of points"))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        source = self.parameterAsSource(parameters, self.INPUT, context)
+        if source is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
+        raster_layer = self.parameterAsRasterLayer(parameters, self.RASTER, context)
+        if raster_layer is None:
+            raise QgsProcessingException(self.invalidRasterError(parameters, self.RASTER))
+        try:
+            density_ranges = parse_density_matrix(
+                self.parameterAsMatrix(parameters, self.DENSITY_RANGES, context))
+        except ValueError as e:
+            raise QgsProcessingException(f"Invalid density ranges: {e}")
+        try:
+            from . import popLing_core as core
+            from .popLing_engine import PointGenerator
+            from .popLing_log import debug_log, log_enabled, INFO
+            from .popLing_profile import RunProfile
+        except ImportError:
+            import popLing_core as core
+            from popLing_engine import PointGenerator
+            from popLing_log import debug_log, log_enabled, INFO
+            from popLing_profile import RunProfile
+        density_model = DENSITY_MODELS[self.parameterAsEnum(parameters, self.DENSITY_MODEL, context)]
+        density_curve = None
+        try:
+            if density_model == "lookup":
+                density_curve = parse_density_curve(
+                    self.parameterAsMatrix(parameters, self.DENSITY_CURVE, context))
+            # Compile once up front so invalid settings fail before any output is created
+            core.compile_density_model(density_ranges, density_model, density_curve)
+        except ValueError as e:
+            raise QgsProcessingException(f"Invalid density model: {e}")
+        total_points = self.parameterAsInt(parameters, self.TOTAL_POINTS, context) or None
+        total_field = (self.parameterAsFields(parameters, self.TOTAL_FIELD, context) or [None])[0]
+        surfaces = self.density_surfaces(
+            parameters, context, raster_layer, density_ranges, density_model, density_curve)
+        if surfaces and (total_points is not None or total_field):
+            raise QgsProcessingException("Exact totals cannot be combined with several density surfaces")
+        seed = self.parameterAsInt(parameters, self.SEED, context) or core.new_seed()
+        engine = ENGINES[self.parameterAsEnum(parameters, self.ENGINE, context)]
+        workers = self.parameterAsInt(parameters, self.WORKERS, context) or None
+        crs_mode = CRS_MODES[self.parameterAsEnum(parameters, self.CRS_MODE, context)]
+        resample = RESAMPLE_MODES[self.parameterAsEnum(parameters, self.RESAMPLE, context)]
+
+        fields = point_fields(surfaces=bool(surfaces))
+        sink, dest_id = self.parameterAsSink(
+            parameters, self.OUTPUT, context, fields, QgsWkbTypes.Point, source.sourceCrs())
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+        feedback.pushInfo(f"Random seed: {seed}")
+        if surfaces:
+            feedback.pushInfo(f"Density surfaces: {', '.join(surface.name for surface in surfaces)}")
+        written = [0]
+        profile = RunProfile()
+
+        def write_chunk(xs, ys, surface=None):
+            name = None if surface is None else surfaces[surface].name
+            for features in point_feature_batches(xs, ys, fields, written[0] + 1, surface=name):
+                if not sink.addFeatures(features, QgsFeatureSink.FastInsert):
+                    raise QgsProcessingException(self.writeFeatureError(sink, parameters, self.OUTPUT))
+            written[0] += len(xs)
+
+        options = {"workers": workers} if engine == "parallel" else {}
+        generator = PointGenerator()
+        generate = {
+            "vectorized": generator.generate_points_vectorized,
+            "parallel": generator.generate_points_parallel,
+            "classic": generator.generate_points_in_polygon,
+        }[engine]
+        generate(
+            source,
+            raster_layer.dataProvider().clone(),
+            density_ranges,
+            raster_points_per_sample_width=self.parameterAsDouble(parameters, self.SAMPLE_WIDTH, context),
+            polygon_crs=source.sourceCrs(),
+            feature_count=source.featureCount(),
+            transform_context=context.transformContext(),
+            feedback=feedback,
+            on_chunk=write_chunk,
+            seed=seed,
+            crs_mode=crs_mode,
+            resample=resample,
+            density_model=density_model,
+            density_curve=density_curve,
+            total_points=total_points,
+            total_field=total_field,
+            profile=profile,
+            surfaces=surfaces,
+            **options)
+
+        profile.finish()
+        # #region agent log
+        if log_enabled(INFO):
+            debug_log("popLing.processAlgorithm", "Run profile", profile.record, hypothesis_id="C", level=INFO)
+        # #endregion
+        feedback.pushInfo(f"Generated {written[0]} points")
+        feedback.pushInfo(f"Time {profile.summary()}")
+        return {self.OUTPUT: dest_id, self.SEED_USED: seed, self.POINT_COUNT: written[0]}
+
+    def density_surfaces(self, parameters, context, raster_layer, density_ranges, density_model, density_curve):
+        """The run's engine.DensitySurface list, or None without bands or additional rasters.
+
+        The selected bands of the density raster come first (band 1 if only
+        additional rasters are given), then the additional rasters' first
+        bands. The density model is shared; the ranges default to the
+        density ranges.
+        """
+        try:
+            from . import popLing_core as core
+            from .popLing_engine import DensitySurface
+        except ImportError:
+            import popLing_core as core
+            from popLing_engine import DensitySurface
+        bands = self.parameterAsInts(parameters, self.BANDS, context) or []
+        extra_layers = self.parameterAsLayerList(parameters, self.EXTRA_RASTERS, context) or []
+        if not bands and not extra_layers:
+            return None
+        sources = [(f"{raster_layer.name()} band {band}" if len(bands) > 1 else raster_layer.name(),
+                    raster_layer, band) for band in bands or [1]]
+        sources += [(layer.name(), layer, 1) for layer in extra_layers]
+        try:
+            surface_ranges = parse_surface_ranges(
+                self.parameterAsMatrix(parameters, self.SURFACE_RANGES, context), len(sources))
+        except ValueError as e:
+            raise QgsProcessingException(f"Invalid surface ranges: {e}")
+        surfaces = []
+        for index, (name, layer, band) in enumerate(sources):
+            ranges = surface_ranges.get(index, density_ranges)
+            try:
+                core.compile_density_model(ranges, density_model, density_curve)
+            except ValueError as e:
+                raise QgsProcessingException(f"Invalid density ranges for surface {index + 1}: {e}")
+            surfaces.append(DensitySurface(
+                name, layer.dataProvider().clone(), ranges, band, density_model, density_curve))
+        return surfaces
+
+
+class popLingProvider(QgsProcessingProvider):
+    """Processing provider holding the popLing algorithms"""
+
+    def id(self):
+        return "popling"
+
+    def name(self):
+        return "popLing"
+
+    def loadAlgorithms(self):
+        self.addAlgorithm(GeneratePointsAlgorithm())
@@ -0,0 +1,253 @@
+"""
+Run profiling for popLing
+
+Per-stage wall time and memory of one point generation run, cheap enough to
+leave on in production: a stage costs two perf_counter() calls, and memory
+is only sampled at checkpoints (once per tile). Imports nothing but the
+standard library, so worker processes can profile their partitions and
+hand the result back to the main process.
+"""
+
+import os
+import sys
+import threading
+import time
+
+
+# Stages of a run, in pipeline order. Time spent anywhere else (progress
+# reporting, logging, bookkeeping) is reported as "other"
+STAGES = (
+    "feature_fetch", "raster_read", "crs_transform", "containment",
+    "classification", "rng", "feature_write",
+)
+
+_MB = 1024.0 * 1024.0
+
+
+def _windows_memory():
+    """(working set, peak working set) in bytes on Windows, (None, None) on failure"""
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None, None
+        return counters.WorkingSetSize, counters.PeakWorkingSetSize
+    except Exception:
+        return None, None
+
+
+def current_memory():
+    """Resident memory of this process in bytes, or None where it cannot be read"""
+    if sys.platform.startswith("linux"):
+        try:
+            with open("/proc/self/statm", "rb") as statm:
+                return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            return None
+    if sys.platform == "win32":
+        return _windows_memory()[0]
+    return None
+
+
+def process_peak_memory():
+    """Peak resident memory of this process since it started, in bytes, or None"""
+    if sys.platform == "win32":
+        return _windows_memory()[1]
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _mb(value):
+    return None if value is None else round(value / _MB, 1)
+
+
+class _Stage:
+    """Context manager timing one stage; time spent in nested stages is not counted twice"""
+
+    __slots__ = ("profile", "name", "started", "children")
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.children = 0.0
+        self.profile._stack().append(self)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.started
+        stack = self.profile._stack()
+        stack.pop()
+        if stack:
+            stack[-1].children += elapsed
+        self.profile.add(self.name, elapsed - self.children)
+        return False
+
+
+class RunProfile:
+    """Stage timings and memory of one run.
+
+    Wrap each piece of work in ``with profile.stage(name)``; stages nest
+    (a CRS transform inside a raster read is only counted as the transform)
+    and may be timed from several threads, e.g. the worker thread and the
+    GUI thread adding features to a memory layer. checkpoint() samples the
+    resident memory; the peak of those samples is the run's peak. Profiles
+    of worker processes are folded in with merge(snapshot()) and reported
+    separately, as their stages overlap in time.
+    """
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.calls = dict.fromkeys(STAGES, 0)
+        self.worker_seconds = dict.fromkeys(STAGES, 0.0)
+        self.worker_calls = dict.fromkeys(STAGES, 0)
+        self.worker_profiles = 0
+        self.worker_memory_peak = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.wall_seconds = None
+        self.memory_start = current_memory()
+        self.memory_peak = self.memory_start
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def stage(self, name):
+        """Context manager adding the time spent in its block to stage ``name``"""
+        return _Stage(self, name)
+
+    def add(self, name, seconds, calls=1):
+        """Add ``seconds`` to stage ``name``"""
+        with self._lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + calls
+
+    def timed(self, name, function):
+        """Wrap ``function`` so every call is timed as stage ``name``"""
+        def timed_function(*args, **kwargs):
+            with _Stage(self, name):
+                return function(*args, **kwargs)
+        return timed_function
+
+    def iterate(self, name, iterable):
+        """Yield from ``iterable``, timing each step as stage ``name`` (e.g. fetching features)"""
+        iterator = iter(iterable)
+        done = object()
+        while True:
+            with _Stage(self, name):
+                item = next(iterator, done)
+            if item is done:
+                return
+            yield item
+
+    def checkpoint(self):
+        """Sample the resident memory and keep the peak"""
+        memory = current_memory()
+        if memory is not None and (self.memory_peak is None or memory > self.memory_peak):
+            self.memory_peak = memory
+
+    def snapshot(self):
+        """Stage timings and memory peak as a plain, picklable dict (see merge)"""
+        self.checkpoint()
+        return {"seconds": dict(self.seconds), "calls": dict(self.calls), "memory_peak": self.memory_peak}
+
+    def merge(self, snapshot):
+        """Fold in a worker process's snapshot()"""
+        with self._lock:
+            for name, seconds in snapshot["seconds"].items():
+                self.worker_seconds[name] = self.worker_seconds.get(name, 0.0) + seconds
+            for name, calls in snapshot["calls"].items():
+                self.worker_calls[name] = self.worker_calls.get(name, 0) + calls
+            self.worker_profiles += 1
+            peak = snapshot.get("memory_peak")
+            if peak is not None and (self.worker_memory_peak is None or peak > self.worker_memory_peak):
+                self.worker_memory_peak = peak
+
+    def finish(self):
+        """Stop the wall clock; later calls keep the first end time"""
+        if self.wall_seconds is None:
+            self.checkpoint()
+            self.wall_seconds = time.perf_counter() - self.started
+        return self
+
+    def elapsed(self):
+        """Wall time of the run so far (or in total, once finished)"""
+        if self.wall_seconds is not None:
+            return self.wall_seconds
+        return time.perf_counter() - self.started
+
+    def record(self):
+        """The profile as one JSON-serializable dict, for a single log entry"""
+        wall = self.elapsed()
+        record = {
+            "wall_seconds": round(wall, 4),
+            "stages": {name: round(seconds, 4) for name, seconds in self.seconds.items()},
+            "calls": dict(self.calls),
+            "other_seconds": round(max(0.0, wall - sum(self.seconds.values())), 4),
+            "memory_start_mb": _mb(self.memory_start),
+            "memory_peak_mb": _mb(self.memory_peak),
+            "process_peak_mb": _mb(process_peak_memory()),
+        }
+        if self.worker_profiles:
+            record["worker_stages"] = {name: round(seconds, 4) for name, seconds in self.worker_seconds.items()}
+            record["worker_calls"] = dict(self.worker_calls)
+            record["worker_partitions"] = self.worker_profiles
+            record["worker_memory_peak_mb"] = _mb(self.worker_memory_peak)
+        return record
+
+    def summary(self):
+        """One-line, human-readable breakdown for the completion message"""
+        wall = self.elapsed()
+
+        def breakdown(seconds, shares=True):
+            parts = []
+            for name, value in sorted(seconds.items(), key=lambda item: -item[1]):
+                if value >= 0.0005:
+                    share = f" ({100.0 * value / wall:.0f}%)" if shares and wall > 0 else ""
+                    parts.append(f"{name.replace('_', ' ')} {value:.2f} s{share}")
+            return ", ".join(parts)
+
+        text = f"{wall:.2f} s"
+        stages = breakdown(dict(self.seconds, other=max(0.0, wall - sum(self.seconds.values()))))
+        if stages:
+            text += f": {stages}"
+        if self.worker_profiles:
+            workers = breakdown(self.worker_seconds, shares=False)
+            if workers:
+                text += f"; worker processes (summed): {workers}"
+        if self.memory_peak is not None:
+            text += f"; peak memory {self.memory_peak / _MB:.0f} MB"
+            if self.memory_start is not None:
+                text += f" (+{max(0, self.memory_peak - self.memory_start) / _MB:.0f} MB)"
+        if self.worker_memory_peak is not None:
+            text += f", workers {self.worker_memory_peak / _MB:.0f} MB"
+        return text
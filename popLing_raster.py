@@ -0,0 +1,410 @@
+"""
+Raster access helpers for popLing
+"""
+
+import math
+
+import numpy as np
+
+from qgis.core import (
+    Qgis,
+    QgsCoordinateTransform,
+    QgsCsException,
+    QgsLineString,
+    QgsPointXY,
+    QgsRasterProjector,
+    QgsRectangle,
+)
+
+try:
+    from . import popLing_core as core
+except ImportError:
+    import popLing_core as core
+
+
+# How sample coordinates in the polygon CRS reach a raster in another CRS:
+# transform the sample points in batches, or reproject raster windows into
+# the polygon CRS and index them directly
+CRS_MODES = ("transform", "reproject")
+
+
+# Qgis.DataType -> NumPy dtype for the block types we can sample from.
+# Looked up by name so QGIS releases without Int8 or the 64-bit integer
+# types still load.
+_NUMPY_DTYPES = {}
+for _name, _dtype in (
+        ("Byte", np.uint8), ("Int8", np.int8),
+        ("UInt16", np.uint16), ("Int16", np.int16),
+        ("UInt32", np.uint32), ("Int32", np.int32),
+        ("UInt64", np.uint64), ("Int64", np.int64),
+        ("Float32", np.float32), ("Float64", np.float64)):
+    _qgis_type = getattr(Qgis, _name, None)
+    if _qgis_type is not None:
+        _NUMPY_DTYPES[_qgis_type] = _dtype
+
+
+def block_to_array(block, rows, cols):
+    """Convert a QgsRasterBlock to a float64 array with NaN for no-data pixels.
+
+    Raises ValueError for data types that cannot be sampled (complex and
+    color pixels), rather than reading them as no-data.
+    """
+    if block.isEmpty():
+        return np.full((rows, cols), np.nan)
+    dtype = _NUMPY_DTYPES.get(block.dataType())
+    if dtype is None:
+        raise ValueError(f"Unsupported raster data type {block.dataType()!r}; use a real-valued band")
+    array = np.frombuffer(bytes(block.data()), dtype=dtype, count=rows * cols)
+    array = array.reshape((rows, cols)).astype(np.float64)
+    if block.hasNoDataValue():
+        array[array == block.noDataValue()] = np.nan
+    return array
+
+
+def overview_factors(provider):
+    """Decimation factors of the overviews (pyramids) a raster already has"""
+    factors = []
+    try:
+        pyramids = provider.buildPyramidList()
+    except Exception:
+        return factors
+    for pyramid in pyramids:
+        exists = pyramid.getExists() if hasattr(pyramid, "getExists") else pyramid.exists
+        x_dim = pyramid.getXDim() if hasattr(pyramid, "getXDim") else pyramid.xDim
+        if exists and x_dim > 0:
+            factors.append(int(round(provider.xSize() / x_dim)))
+    return factors
+
+
+class RasterBlockReader:
+    """Windowed reader that resolves many sample coordinates per provider call.
+
+    The raster is split into square tiles of ``tile_size`` pixels. A lookup
+    reads, for every tile it touches, only the window covering the requested
+    pixels in that tile, so a small polygon costs a single ``block()`` call
+    and a large one a handful, instead of one ``identify()`` per sample.
+    Coordinates must be in the raster CRS.
+
+    ``resample`` (see core.RESAMPLE_MODES) and ``sample_width``, the sample
+    cell width in raster pixels, choose what a sample reads. "nearest" reads
+    the full-resolution pixel. "overview" reads from the closest existing
+    overview no coarser than a sample cell, so I/O scales with the sample
+    grid rather than the raster. "mean" and "sum" aggregate the
+    full-resolution pixels under each sample cell, centered on the sample
+    coordinate (see core.cell_aggregates).
+
+    Takes a raster data provider rather than a layer so it can be used from a
+    background task with a provider clone.
+    """
+
+    def __init__(self, provider, band=1, tile_size=2048, resample="nearest", sample_width=1.0):
+        self.provider = provider
+        self.band = band
+        self.extent = provider.extent()
+        self.native_width = provider.xSize()
+        self.native_height = provider.ySize()
+        self.resample = resample
+        if resample == "overview":
+            self.factor = core.overview_factor(overview_factors(provider), sample_width)
+        else:
+            self.factor = 1
+        # Samples address pixels of the (possibly decimated) read grid
+        self.tile_size = max(1, int(tile_size))
+        self.width = math.ceil(self.native_width / self.factor)
+        self.height = math.ceil(self.native_height / self.factor)
+        self.x_res = self.extent.width() / self.native_width * self.factor
+        self.y_res = self.extent.height() / self.native_height * self.factor
+        self.half_height, self.half_width = core.cell_half_size(sample_width, self.x_res, self.y_res)
+        self.user_no_data = [
+            (r.min(), r.max()) for r in self.provider.userNoDataValues(band)
+        ]
+        self.read_count = 0
+
+    def pixel_indices(self, xs, ys):
+        """Map raster-CRS coordinates to (row, col) pixel indices and a validity mask"""
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        cols = np.floor((xs - self.extent.xMinimum()) / self.x_res)
+        rows = np.floor((self.extent.yMaximum() - ys) / self.y_res)
+        valid = (
+            np.isfinite(cols) & np.isfinite(rows) &
+            (cols >= 0) & (cols < self.width) &
+            (rows >= 0) & (rows < self.height)
+        )
+        cols = np.where(valid, cols, 0).astype(np.int64)
+        rows = np.where(valid, rows, 0).astype(np.int64)
+        return rows, cols, valid
+
+    def _read_block(self, row0, col0, rows, cols, x_res, y_res):
+        """Read a window of a grid with the given pixel size as float64 (NaN for no-data)"""
+        x_min = self.extent.xMinimum() + col0 * x_res
+        y_max = self.extent.yMaximum() - row0 * y_res
+        window = QgsRectangle(
+            x_min, y_max - rows * y_res,
+            x_min + cols * x_res, y_max)
+        block = self.provider.block(self.band, window, cols, rows)
+        self.read_count += 1
+        array = block_to_array(block, rows, cols)
+        for low, high in self.user_no_data:
+            array[(array >= low) & (array <= high)] = np.nan
+        return array
+
+    def read_window(self, row0, col0, rows, cols):
+        """Read a window of the read grid as a float64 array (NaN for no-data)"""
+        # With a decimated grid the provider serves the request from the
+        # matching overview
+        return self._read_block(row0, col0, rows, cols, self.x_res, self.y_res)
+
+    def cell_values(self, xs, ys):
+        """Mean or sum of the pixels under the sample cells centered on ``xs``, ``ys``"""
+        cols = (xs - self.extent.xMinimum()) / self.x_res
+        rows = (self.extent.yMaximum() - ys) / self.y_res
+        col0 = max(0, int(math.floor(cols.min() - self.half_width)))
+        row0 = max(0, int(math.floor(rows.min() - self.half_height)))
+        col1 = min(self.width, int(math.ceil(cols.max() + self.half_width)))
+        row1 = min(self.height, int(math.ceil(rows.max() + self.half_height)))
+        window = self.read_window(row0, col0, row1 - row0, col1 - col0)
+        return core.cell_aggregates(
+            window, rows - row0, cols - col0, self.half_height, self.half_width, self.resample)
+
+    def values_at(self, xs, ys):
+        """Return raster values for coordinate arrays, NaN where there is no value"""
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        rows, cols, valid = self.pixel_indices(xs, ys)
+        values = np.full(rows.shape, np.nan)
+        if not valid.any():
+            return values
+
+        index = np.flatnonzero(valid)
+        rows = rows[index]
+        cols = cols[index]
+        tiles_across = math.ceil(self.width / self.tile_size)
+        tile_ids = (rows // self.tile_size) * tiles_across + cols // self.tile_size
+
+        # Group samples by tile and read one window per tile
+        order = np.argsort(tile_ids, kind="stable")
+        boundaries = np.flatnonzero(np.diff(tile_ids[order])) + 1
+        for group in np.split(order, boundaries):
+            if self.resample in ("mean", "sum"):
+                values[index[group]] = self.cell_values(xs[index[group]], ys[index[group]])
+                continue
+            group_rows = rows[group]
+            group_cols = cols[group]
+            row0 = int(group_rows.min())
+            col0 = int(group_cols.min())
+            window = self.read_window(
+                row0, col0,
+                int(group_rows.max()) - row0 + 1,
+                int(group_cols.max()) - col0 + 1)
+            values[index[group]] = window[group_rows - row0, group_cols - col0]
+        return values
+
+
+class ArrayTransform:
+    """Coordinate transform for whole arrays of points.
+
+    A batch goes through QgsLineString.transform(), one C++ call for all
+    points instead of one transform() call per point. If the batch fails
+    (typically a point outside the target projection's area of use) it is
+    redone point by point so only the failing points become NaN.
+    """
+
+    def __init__(self, source_crs, target_crs, transform_context):
+        self.coordinate_transform = QgsCoordinateTransform(source_crs, target_crs, transform_context)
+
+    def transform(self, xs, ys):
+        """Transform coordinate arrays; failed points become NaN"""
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        if xs.size == 0:
+            return xs, ys
+        try:
+            line = QgsLineString(xs.tolist(), ys.tolist())
+            line.transform(self.coordinate_transform)
+            out_x = np.array(line.xVector(), dtype=np.float64)
+            out_y = np.array(line.yVector(), dtype=np.float64)
+        except QgsCsException:
+            out_x = np.full(xs.shape, np.nan)
+            out_y = np.full(xs.shape, np.nan)
+            for i, (x, y) in enumerate(zip(xs.tolist(), ys.tolist())):
+                try:
+                    point = self.coordinate_transform.transform(QgsPointXY(x, y))
+                except QgsCsException:
+                    continue
+                out_x[i] = point.x()
+                out_y[i] = point.y()
+        bad = ~(np.isfinite(out_x) & np.isfinite(out_y))
+        out_x[bad] = np.nan
+        out_y[bad] = np.nan
+        return out_x, out_y
+
+
+def resolution_in_crs(provider, crs, transform_context):
+    """Raster pixel size (x, y) expressed in ``crs``.
+
+    Measured on the pixel at the raster's center, so sample grids built in a
+    polygon CRS keep the intended number of raster pixels per sample cell.
+    """
+    extent = provider.extent()
+    x_res = extent.width() / provider.xSize()
+    y_res = extent.height() / provider.ySize()
+    if crs is None or not crs.isValid() or crs == provider.crs():
+        return x_res, y_res
+    center = extent.center()
+    transform = ArrayTransform(provider.crs(), crs, transform_context)
+    xs, ys = transform.transform(
+        [center.x(), center.x() + x_res, center.x()],
+        [center.y(), center.y(), center.y() + y_res])
+    x_res = math.hypot(xs[1] - xs[0], ys[1] - ys[0])
+    y_res = math.hypot(xs[2] - xs[0], ys[2] - ys[0])
+    return x_res, y_res
+
+
+class TransformingBlockReader(RasterBlockReader):
+    """RasterBlockReader taking coordinates in another CRS, transformed in batches.
+
+    The transforms are timed as the "crs_transform" stage of ``profile``
+    (see popLing_profile), if given.
+    """
+
+    def __init__(self, provider, crs, transform_context, band=1, tile_size=2048,
+                 resample="nearest", sample_width=1.0, profile=None):
+        super().__init__(provider, band, tile_size, resample, sample_width)
+        self.transform = ArrayTransform(crs, provider.crs(), transform_context)
+        self.profile = profile
+
+    def values_at(self, xs, ys):
+        """Return raster values for coordinate arrays in the reader's CRS"""
+        with core.profile_stage(self.profile, "crs_transform"):
+            xs, ys = self.transform.transform(xs, ys)
+        return super().values_at(xs, ys)
+
+
+class ReprojectedBlockReader:
+    """Samples a raster through windows reprojected into another CRS.
+
+    Each values_at() call lays a grid at the raster's resolution in the
+    target CRS over the requested points, reprojects the windows of it that
+    hold points with QgsRasterProjector and indexes them directly, so no
+    sample point is transformed. The grid has a pixel centered on the
+    first sample (core.window_pixels), so samples stepping by whole pixels
+    read the pixels centered on them. Windows are at most ``tile_size`` pixels
+    on a side, as in RasterBlockReader. Pixels are resampled
+    nearest-neighbour. With ``resample`` "overview" the windows are
+    requested at the closest overview's resolution (the provider then reads
+    that overview); "mean" and "sum" start the grid at the first sample
+    cell's corner instead and aggregate the pixels under each sample cell
+    (core.cell_aggregates).
+    """
+
+    def __init__(self, provider, crs, transform_context, band=1, tile_size=2048,
+                 resample="nearest", sample_width=1.0):
+        self.provider = provider
+        self.band = band
+        self.projector = QgsRasterProjector()
+        self.projector.setInput(provider)
+        self.projector.setCrs(provider.crs(), crs, transform_context)
+        self.resample = resample
+        if resample == "overview":
+            self.factor = core.overview_factor(overview_factors(provider), sample_width)
+        else:
+            self.factor = 1
+        self.x_res, self.y_res = resolution_in_crs(provider, crs, transform_context)
+        self.half_height, self.half_width = core.cell_half_size(sample_width, self.x_res, self.y_res)
+        if resample == "overview":
+            self.x_res *= self.factor
+            self.y_res *= self.factor
+        self.tile_size = max(1, int(tile_size))
+        self.user_no_data = [
+            (r.min(), r.max()) for r in provider.userNoDataValues(band)
+        ]
+        self.read_count = 0
+
+    def read_window(self, x_min, y_max, width, height):
+        """Reproject a window of ``width`` x ``height`` output pixels as float64 (NaN for no-data)"""
+        window = QgsRectangle(
+            x_min, y_max - height * self.y_res,
+            x_min + width * self.x_res, y_max)
+        block = self.projector.block(self.band, window, width, height)
+        self.read_count += 1
+        array = block_to_array(block, height, width)
+        for low, high in self.user_no_data:
+            array[(array >= low) & (array <= high)] = np.nan
+        return array
+
+    def values_at(self, xs, ys):
+        """Return raster values for coordinate arrays in the reader's CRS"""
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        values = np.full(xs.shape, np.nan)
+        valid = np.isfinite(xs) & np.isfinite(ys)
+        if not valid.any():
+            return values
+        xs = xs[valid]
+        ys = ys[valid]
+        x_res = self.x_res
+        y_res = self.y_res
+        aggregate = self.resample in ("mean", "sum")
+        if aggregate:
+            # Pixel edges start at the first sample cell's edges
+            x_min = float(xs.min()) - self.half_width * x_res
+            y_max = float(ys.max()) + self.half_height * y_res
+            col_positions = (xs - x_min) / x_res
+            row_positions = (y_max - ys) / y_res
+            cols = np.floor(col_positions).astype(np.int64)
+            rows = np.floor(row_positions).astype(np.int64)
+        else:
+            # Pixels are centered on the sample grid rather than cornered on it
+            x_min, y_max, rows, cols = core.window_pixels(xs, ys, x_res, y_res)
+        tiles_across = int(cols.max()) // self.tile_size + 1
+        tile_ids = (rows // self.tile_size) * tiles_across + cols // self.tile_size
+
+        # Group samples by tile and reproject one window per tile
+        index = np.flatnonzero(valid)
+        order = np.argsort(tile_ids, kind="stable")
+        boundaries = np.flatnonzero(np.diff(tile_ids[order])) + 1
+        for group in np.split(order, boundaries):
+            if aggregate:
+                group_cols = col_positions[group]
+                group_rows = row_positions[group]
+                col0 = max(0, int(math.floor(group_cols.min() - self.half_width)))
+                row0 = max(0, int(math.floor(group_rows.min() - self.half_height)))
+                col1 = int(math.ceil(group_cols.max() + self.half_width))
+                row1 = int(math.ceil(group_rows.max() + self.half_height))
+                array = self.read_window(
+                    x_min + col0 * x_res, y_max - row0 * y_res, col1 - col0, row1 - row0)
+                values[index[group]] = core.cell_aggregates(
+                    array, group_rows - row0, group_cols - col0,
+                    self.half_height, self.half_width, self.resample)
+                continue
+            group_rows = rows[group]
+            group_cols = cols[group]
+            row0 = int(group_rows.min())
+            col0 = int(group_cols.min())
+            array = self.read_window(
+                x_min + col0 * x_res, y_max - row0 * y_res,
+                int(group_cols.max()) - col0 + 1, int(group_rows.max()) - row0 + 1)
+            values[index[group]] = array[group_rows - row0, group_cols - col0]
+        return values
+
+
+def sampling_reader(provider, crs, transform_context, crs_mode="transform", band=1,
+                    resample="nearest", sample_width=1.0, profile=None):
+    """Reader whose values_at() takes coordinates in ``crs`` (the polygon CRS).
+
+    Same-CRS inputs get a plain RasterBlockReader; otherwise ``crs_mode``
+    picks batched point transforms ("transform") or reprojected raster
+    windows ("reproject"). ``resample`` and ``sample_width`` are passed on
+    (see RasterBlockReader), and ``profile`` to the transforming reader.
+    Reprojected windows are read and warped in one call, so that time all
+    counts as raster reading.
+    """
+    if crs is None or not crs.isValid() or crs == provider.crs():
+        return RasterBlockReader(provider, band, resample=resample, sample_width=sample_width)
+    if crs_mode == "reproject":
+        return ReprojectedBlockReader(
+            provider, crs, transform_context, band, resample=resample, sample_width=sample_width)
+    return TransformingBlockReader(
+        provider, crs, transform_context, band, resample=resample, sample_width=sample_width,
+        profile=profile)
@@ -0,0 +1,65 @@
+"""
+Raster statistics for popLing
+
+Min/max statistics are cached per raster source, band and file
+modification time, so switching layers in the dialog and starting a run do
+not rescan the raster. By default they are approximate: the provider
+computes them from a pixel sample (GDAL reads overviews when the raster has
+them). Exact statistics scan every pixel and are only computed on request.
+"""
+
+import os
+import threading
+
+from qgis.core import QgsProviderRegistry, QgsRasterBandStats
+
+
+# Pixels sampled for approximate statistics (QGIS uses the same for renderers)
+APPROXIMATE_SAMPLE_SIZE = 250000
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def source_stamp(raster_layer):
+    """(mtime, size) of the file behind a raster layer, or None if it is not a local file"""
+    parts = QgsProviderRegistry.instance().decodeUri(raster_layer.providerType(), raster_layer.source())
+    path = parts.get("path")
+    if not path or not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def raster_statistics(raster_layer, band=1, exact=False):
+    """Min/max of a raster band as {"min", "max", "approximate"}.
+
+    Results are cached; a cached exact result also answers approximate
+    requests. Rewriting the raster file invalidates its entries.
+    """
+    key = (raster_layer.providerType(), raster_layer.source(), band, source_stamp(raster_layer))
+    with _cache_lock:
+        cached = _cache.get(key + (True,))
+        if cached is None and not exact:
+            cached = _cache.get(key + (False,))
+    if cached is not None:
+        return dict(cached)
+
+    provider = raster_layer.dataProvider()
+    stats = provider.bandStatistics(
+        band, QgsRasterBandStats.Min | QgsRasterBandStats.Max, provider.extent(),
+        0 if exact else APPROXIMATE_SAMPLE_SIZE)
+    result = {
+        "min": stats.minimumValue,
+        "max": stats.maximumValue,
+        "approximate": not exact
+    }
+    with _cache_lock:
+        _cache[key + (exact,)] = result
+    return dict(result)
+
+
+def clear_cache():
+    """Forget all cached statistics"""
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,161 @@
+"""
+Background task for popLing point generation
+"""
+
+import traceback
+
+from qgis.PyQt.QtCore import pyqtSignal
+from qgis.core import QgsTask, QgsFeedback, QgsProject, QgsVectorLayerFeatureSource
+
+try:
+    from . import popLing_core as core
+    from .popLing_engine import PointGenerator
+    from .popLing_output import DEFAULT_BATCH_SIZE, PointFileWriter
+    from .popLing_profile import RunProfile
+except ImportError:
+    import popLing_core as core
+    from popLing_engine import PointGenerator
+    from popLing_output import DEFAULT_BATCH_SIZE, PointFileWriter
+    from popLing_profile import RunProfile
+
+
+class PointGenerationTask(QgsTask):
+    """Runs point generation off the GUI thread.
+
+    Inputs are snapshotted on the main thread (feature source, raster
+    provider clone) so the worker never touches the layers. Finished points
+    are gathered into batches of ``batch_size`` (small chunks, e.g. from many
+    small polygons, are merged; large ones pass straight through) and each
+    batch is handed back through ``chunkReady`` as (x, y) float64 arrays or,
+    when ``output_path`` is set, streamed straight to that GeoPackage or
+    FlatGeobuf file from the worker thread. ``generationFinished`` fires on
+    the main thread once the run ends. ``profile`` (a
+    popLing_profile.RunProfile, created when the run starts) collects the
+    stage timings and memory; whoever reports the run finishes it once the
+    last chunk has been added. ``cell_grid`` (a core.CellGrid from
+    popLing_cache) is handed to the Vectorized and Parallel engines: a
+    complete one is redrawn from, any other is filled by a Vectorized run.
+    """
+
+    chunkReady = pyqtSignal(object, object)
+    generationFinished = pyqtSignal(bool, int, str)  # success, total points, error
+
+    def __init__(self, polygon_layer, raster_layer, density_ranges,
+                 raster_points_per_sample_width, engine="vectorized", workers=None, seed=None,
+                 crs_mode="transform", resample="nearest", density_model="ranges",
+                 density_curve=None, total_points=None, total_field=None, output_path=None,
+                 batch_size=DEFAULT_BATCH_SIZE, cell_grid=None):
+        super().__init__("popLing: generating points", QgsTask.CanCancel)
+        self.generator = PointGenerator()
+        self.polygon_source = QgsVectorLayerFeatureSource(polygon_layer)
+        self.polygon_crs = polygon_layer.crs()
+        self.feature_count = polygon_layer.featureCount()
+        self.raster_provider = raster_layer.dataProvider().clone()
+        self.transform_context = QgsProject.instance().transformContext()
+        self.density_ranges = density_ranges
+        self.raster_points_per_sample_width = raster_points_per_sample_width
+        self.engine = engine
+        self.workers = workers
+        self.seed = seed
+        self.crs_mode = crs_mode
+        self.resample = resample
+        self.density_model = density_model
+        self.density_curve = density_curve
+        self.polygon_total = total_points
+        self.total_field = total_field
+        self.output_path = output_path
+        self.output_uri = None
+        self.writer = None
+        self.batch_size = batch_size
+        self.pending = core.PointBuffer(chunk_size=batch_size)
+        self.total_points = 0
+        self.error = ""
+        self.profile = None
+        self.cell_grid = cell_grid
+        self.cell_grid_reused = cell_grid is not None and cell_grid.complete
+
+        self.feedback = QgsFeedback()
+        self.feedback.progressChanged.connect(self.setProgress)
+
+    def run(self):
+        """Generate points in the worker thread"""
+        self.profile = RunProfile()
+        options = {}
+        if self.engine == "parallel":
+            generate = self.generator.generate_points_parallel
+            options["workers"] = self.workers
+            options["cell_grid"] = self.cell_grid
+        elif self.engine == "vectorized":
+            generate = self.generator.generate_points_vectorized
+            options["cell_grid"] = self.cell_grid
+        else:
+            generate = self.generator.generate_points_in_polygon
+        try:
+            if self.output_path:
+                self.writer = PointFileWriter(
+                    self.output_path, self.polygon_crs, self.transform_context)
+                self.output_uri = self.writer.uri
+            generate(
+                self.polygon_source,
+                self.raster_provider,
+                self.density_ranges,
+                raster_points_per_sample_width=self.raster_points_per_sample_width,
+                polygon_crs=self.polygon_crs,
+                feature_count=self.feature_count,
+                transform_context=self.transform_context,
+                feedback=self.feedback,
+                on_chunk=self.emit_chunk,
+                seed=self.seed,
+                crs_mode=self.crs_mode,
+                resample=self.resample,
+                density_model=self.density_model,
+                density_curve=self.density_curve,
+                total_points=self.polygon_total,
+                total_field=self.total_field,
+                profile=self.profile,
+                **options)
+            with self.profile.stage("feature_write"):
+                self.flush_points()
+        except Exception:
+            self.error = traceback.format_exc()
+            return False
+        finally:
+            if self.writer is not None:
+                with self.profile.stage("feature_write"):
+                    self.writer.close()
+        return not self.isCanceled()
+
+    def emit_chunk(self, xs, ys):
+        """Queue a finished chunk of points; full batches go out right away"""
+        if not xs.size:
+            return
+        if not len(self.pending) and xs.size >= self.batch_size:
+            self.write_points(xs, ys)
+            return
+        self.pending.append(xs, ys)
+        if len(self.pending) >= self.batch_size:
+            self.flush_points()
+
+    def flush_points(self):
+        """Write the queued points as one batch"""
+        if len(self.pending):
+            xs, ys = self.pending.to_arrays()
+            self.pending.clear()
+            self.write_points(xs, ys)
+
+    def write_points(self, xs, ys):
+        """Write points to the output file or hand them to the main thread"""
+        if self.writer is not None:
+            self.writer.write_points(xs, ys)
+        else:
+            self.chunkReady.emit(xs, ys)
+        self.total_points += int(xs.size)
+
+    def cancel(self):
+        """Stop generation at the next polygon"""
+        self.feedback.cancel()
+        super().cancel()
+
+    def finished(self, result):
+        """Called on the main thread when run() returns"""
+        self.generationFinished.emit(result, self.total_points, self.error)
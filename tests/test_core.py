@@ -0,0 +1,459 @@
+"""
+Tests for popLing_core
+
+The core is pure NumPy, so these run under plain Python without QGIS:
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import struct
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import popLing_core as core  # noqa: E402
+
+
+RANGES = [
+    {"min": 10, "max": 200, "points_per_cell": 0.3},
+    {"min": 200, "max": 4000, "points_per_cell": 1},
+    {"min": 4000, "max": 25000, "points_per_cell": 5},
+]
+
+
+def star(cx, cy, radius, spikes=12):
+    """Non-convex star polygon rings"""
+    angles = np.linspace(0, 2 * np.pi, 2 * spikes, endpoint=False)
+    radii = radius * np.where(np.arange(2 * spikes) % 2, 0.5, 1.0)
+    return [np.c_[cx + radii * np.cos(angles), cy + radii * np.sin(angles)]]
+
+
+def ring_area(ring):
+    """Shoelace area of a ring"""
+    x, y = ring[:, 0], ring[:, 1]
+    return abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+
+
+def contains(rings, xs, ys):
+    """Even-odd point-in-polygon test, independent of the core's rasterizer"""
+    inside = np.zeros(len(xs), dtype=bool)
+    for ring in rings:
+        x1, y1 = ring[:, 0], ring[:, 1]
+        x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+        for a, b, c, d in zip(x1, y1, x2, y2):
+            crosses = (b > ys) != (d > ys)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x_cross = a + (ys - b) * (c - a) / (d - b)
+            inside ^= crosses & (xs < x_cross)
+    return inside
+
+
+def polygon_bounds(rings):
+    vertices = np.concatenate(rings)
+    return vertices[:, 0].min(), vertices[:, 0].max(), vertices[:, 1].min(), vertices[:, 1].max()
+
+
+class GridTest(unittest.TestCase):
+
+    def test_axes_step_from_the_box_minimum(self):
+        grid_x, grid_y = core.grid_axes(0, 10, 5, 8, 2.5)
+        np.testing.assert_array_equal(grid_x, [0, 2.5, 5, 7.5, 10])
+        np.testing.assert_array_equal(grid_y, [5, 7.5])
+
+    def test_cells_cover_the_box(self):
+        _, grid_y = core.grid_axes(0, 10, 0, 9.9, 2.5)
+        np.testing.assert_array_equal(grid_y, [0, 2.5, 5, 7.5, 10])
+        self.assertEqual(core.grid_size(9.0, 2.5), 5)
+
+    def test_cells_are_row_major(self):
+        cx, cy = core.grid_cells(np.array([0.0, 1.0, 2.0]), np.array([5.0, 6.0]))
+        np.testing.assert_array_equal(cx, [0, 1, 2, 0, 1, 2])
+        np.testing.assert_array_equal(cy, [5, 5, 5, 6, 6, 6])
+
+
+class RasterizeTest(unittest.TestCase):
+
+    def test_square_masks(self):
+        # A 10 x 10 square on a unit grid: centers 1..9 inside, the outline
+        # runs through the cells centered on 0 and 10
+        edges = core.polygon_edges([np.array([[0, 0], [10, 0], [10, 10], [0, 10]], dtype=float)])
+        grid_x, grid_y = core.grid_axes(0, 10, 0, 10, 1.0)
+        inside, boundary = core.rasterize_polygon(edges, grid_x, grid_y, 1.0)
+        self.assertEqual(inside.shape, (11, 11))
+        self.assertTrue(inside[1:10, 1:10].all())
+        self.assertFalse((inside & ~boundary)[[0, -1], :].any())
+        self.assertTrue(boundary[0].all() and boundary[-1].all())
+        self.assertFalse(boundary[3:8, 3:8].any())
+
+    def test_hole_is_outside(self):
+        outer = np.array([[0, 0], [20, 0], [20, 20], [0, 20]], dtype=float)
+        hole = np.array([[5, 5], [15, 5], [15, 15], [5, 15]], dtype=float)
+        edges = core.polygon_edges([outer, hole])
+        grid_x, grid_y = core.grid_axes(0, 20, 0, 20, 1.0)
+        inside, boundary = core.rasterize_polygon(edges, grid_x, grid_y, 1.0)
+        self.assertFalse(inside[8:13, 8:13].any())
+        self.assertTrue(inside[2, 2])
+
+    def test_interior_cells_are_fully_covered(self):
+        rings = star(50.3, 49.7, 40.0)
+        x_min, x_max, y_min, y_max = polygon_bounds(rings)
+        grid_x, grid_y = core.grid_axes(x_min, x_max, y_min, y_max, 1.7)
+        inside, boundary = core.rasterize_polygon(core.polygon_edges(rings), grid_x, grid_y, 1.7)
+        cx, cy = core.grid_cells(grid_x, grid_y)
+        outline = boundary.ravel()
+        interior = inside.ravel() & ~outline
+        self.assertTrue(interior.any())
+        np.testing.assert_array_equal(inside.ravel()[~outline], contains(rings, cx, cy)[~outline])
+        for dx in (-0.85, 0.85):
+            for dy in (-0.85, 0.85):
+                self.assertTrue(contains(rings, cx[interior] + dx, cy[interior] + dy).all())
+
+
+class BoundaryCellsTest(unittest.TestCase):
+
+    def test_cell_areas_add_up_to_polygon_area(self):
+        rings = star(50.3, 49.7, 40.0)
+        edges = core.polygon_edges(rings)
+        x_min, x_max, y_min, y_max = polygon_bounds(rings)
+        for cell_size in (0.7, 2.5, 9.0):
+            grid_x, grid_y = core.grid_axes(x_min, x_max, y_min, y_max, cell_size)
+            cells = core.grid_sample_cells(edges, grid_x, grid_y, cell_size)
+            self.assertAlmostEqual(
+                cells.fraction.sum() * cell_size ** 2, ring_area(rings[0]), delta=1e-6 * ring_area(rings[0]))
+            self.assertTrue(((cells.fraction > 0) & (cells.fraction <= 1)).all())
+
+    def test_boundary_points_land_inside(self):
+        rings = star(0.0, 0.0, 10.0, spikes=7)
+        edges = core.polygon_edges(rings)
+        x_min, x_max, y_min, y_max = polygon_bounds(rings)
+        grid_x, grid_y = core.grid_axes(x_min, x_max, y_min, y_max, 1.3)
+        cells = core.grid_sample_cells(edges, grid_x, grid_y, 1.3)
+        counts = np.full(cells.shape_index.size, 50)
+        xs, ys = cells.shape.sample(cells.shape_index, counts, np.random.default_rng(0))
+        self.assertEqual(xs.size, counts.sum())
+        self.assertTrue(contains(rings, xs, ys).all())
+
+    def test_points_are_uniform_up_to_the_edges(self):
+        # Right triangle with legs of 10: a share of 0.36 of its area has x < 2
+        rings = [np.array([[0, 0], [10, 0], [0, 10]], dtype=float)]
+        raster = core.ArrayRaster(np.ones((20, 20)), -5, 15, 1, 1)
+        tiles = list(core.sample_polygon_total(
+            core.polygon_edges(rings), 0, 10, 0, 10, 0.7, raster.values_at, 200000, 1, 1))
+        xs = np.concatenate([tile[2] for tile in tiles])
+        self.assertAlmostEqual((xs < 2).mean(), 0.36, delta=0.005)
+
+
+class TilingTest(unittest.TestCase):
+
+    def test_tiles_cover_the_grid(self):
+        rings = star(0.0, 0.0, 30.0)
+        edges = core.polygon_edges(rings)
+        bounds = polygon_bounds(rings)
+        grid_x, grid_y = core.grid_axes(*bounds, 1.1)
+        tiles = list(core.polygon_tiles(edges, *bounds, 1.1, tile_cells=7))
+        self.assertEqual(len(tiles), core.polygon_tile_count(*bounds, 1.1, tile_cells=7))
+        cells = set()
+        for tile_row, tile_col, tile_x, tile_y, _ in tiles:
+            self.assertLessEqual(max(len(tile_x), len(tile_y)), 7)
+            cells.update((x, y) for x in tile_x for y in tile_y)
+        self.assertEqual(cells, {(x, y) for x in grid_x for y in grid_y})
+
+
+class ClassifyValuesTest(unittest.TestCase):
+
+    def test_ranges_are_inclusive_and_first_match_wins(self):
+        values = [5, 10, 100, 200, 3999.5, 4000, 25000, 25001, np.nan]
+        np.testing.assert_array_equal(
+            core.classify_values(values, RANGES), [np.nan, 0.3, 0.3, 0.3, 1, 1, 5, np.nan, np.nan])
+
+    def test_zero_values_are_missing(self):
+        points = core.classify_values([0.0, 50.0], [{"min": 0, "max": 100, "points_per_cell": 3}])
+        self.assertTrue(np.isnan(points[0]))
+        self.assertEqual(points[1], 3)
+
+
+class DensityRangeTableTest(unittest.TestCase):
+
+    def test_classification(self):
+        table = core.DensityRangeTable(RANGES)
+        values = np.array([5, 10, 100, 200, 3999.5, 4000, 25000, 25001, np.nan])
+        np.testing.assert_array_equal(table.range_index(values), [-1, 0, 0, 0, 1, 1, 2, -1, -1])
+
+    def test_first_matching_range_wins(self):
+        table = core.DensityRangeTable([
+            {"min": 0, "max": 10, "points_per_cell": 1},
+            {"min": 5, "max": 20, "points_per_cell": 2},
+        ])
+        np.testing.assert_array_equal(table.points_per_cell([3, 7, 15]), [1, 1, 2])
+
+    def test_matches_a_linear_scan_over_many_ranges(self):
+        rng = np.random.default_rng(3)
+        bounds = np.sort(rng.integers(0, 1000, (50, 2)), axis=1)
+        ranges = [{"min": low, "max": high, "points_per_cell": i} for i, (low, high) in enumerate(bounds)]
+        ranges.append({"min": "a", "max": 5, "points_per_cell": 1})
+        values = np.concatenate([rng.uniform(-10, 1010, 2000), bounds.ravel()])
+        expected = np.full(values.size, -1)
+        for i, value in enumerate(values):
+            for index, (low, high) in enumerate(bounds):
+                if low <= value <= high:
+                    expected[i] = index
+                    break
+        table = core.DensityRangeTable(ranges)
+        self.assertEqual(len(table), 50)
+        np.testing.assert_array_equal(table.range_index(values), expected)
+
+
+class DensityCurveTest(unittest.TestCase):
+
+    def test_interpolation(self):
+        curve = core.DensityCurve([0, 100], [0, 10])
+        np.testing.assert_array_equal(curve.points_per_cell([50, -1, 150]), [5, np.nan, np.nan])
+        log_curve = core.DensityCurve([1, 100], [0, 2], scale="log")
+        np.testing.assert_allclose(log_curve.points_per_cell([10, 0]), [1, np.nan])
+
+    def test_curve_from_ranges_spans_the_ranges(self):
+        curve = core.compile_density_model(RANGES, "linear")
+        np.testing.assert_allclose(curve.points_per_cell([9, 10, 105, 25000, 25001]), [np.nan, 0.3, 0.3, 5, np.nan])
+
+    def test_invalid_anchors(self):
+        for values, points in (([0, np.nan], [1, 2]), ([1, 1], [1, 2]), ([0, 1], [1, -2]), ([0], [1])):
+            with self.assertRaises(ValueError):
+                core.DensityCurve(values, points)
+        with self.assertRaises(ValueError):
+            core.compile_density_model(RANGES, "cubic")
+
+    def test_poisson_counts(self):
+        counts = core.poisson_counts(np.r_[np.full(100000, 2.5), np.nan, -1], np.random.default_rng(0))
+        self.assertAlmostEqual(counts[:-2].mean(), 2.5, delta=0.02)
+        np.testing.assert_array_equal(counts[-2:], [0, 0])
+
+
+class CellCountsTest(unittest.TestCase):
+
+    def test_whole_counts_are_truncated(self):
+        counts = core.points_per_cell_counts(
+            [1, 2.7, 5, np.nan, 0, core.MAX_POINTS_PER_CELL + 1], np.random.default_rng(0))
+        np.testing.assert_array_equal(counts, [1, 2, 5, 0, 0, 0])
+
+    def test_fractional_counts_are_bernoulli_draws(self):
+        counts = core.points_per_cell_counts(np.full(100000, 0.3), np.random.default_rng(0))
+        self.assertTrue(np.isin(counts, (0, 1)).all())
+        self.assertAlmostEqual(counts.mean(), 0.3, delta=0.01)
+
+    def test_jittered_points_stay_in_their_cell(self):
+        cx, cy = core.grid_cells(*core.grid_axes(0, 20, 0, 10, 2.0))
+        counts = np.arange(cx.size) % 4
+        px, py = core.jitter_points(cx, cy, counts, 2.0, np.random.default_rng(0))
+        self.assertEqual(px.size, counts.sum())
+        self.assertTrue((np.abs(px - np.repeat(cx, counts)) <= 1.0).all())
+        self.assertTrue((np.abs(py - np.repeat(cy, counts)) <= 1.0).all())
+
+
+class ResampleTest(unittest.TestCase):
+
+    def test_overview_factor_is_not_coarser_than_a_cell(self):
+        self.assertEqual(core.overview_factor([2, 4, 8, 16], 9.5), 8)
+        self.assertEqual(core.overview_factor([2, 4, 8, 16], 8), 8)
+        self.assertEqual(core.overview_factor([2, 4], 1.5), 1)
+
+    def test_cell_sums_conserve_the_raster_total(self):
+        array = np.random.default_rng(0).random((30, 40)) * 100
+        array[3:5, 7:9] = np.nan
+        # Cells 3.7 pixels wide, tiling the raster and overhanging its edges
+        half_height, half_width = core.cell_half_size(3.7, 2.0, 2.0)
+        cols, rows = core.grid_cells(*core.grid_axes(half_width, 45, half_height, 35, 3.7))
+        sums = core.cell_aggregates(array, rows, cols, half_height, half_width, "sum")
+        self.assertAlmostEqual(np.nansum(sums), np.nansum(array), places=6)
+
+    def test_cells_weigh_cut_pixels_by_area(self):
+        array = np.arange(20.0).reshape(4, 5)
+        array[2:, 4] = np.nan
+        means = core.cell_aggregates(array, [1.0, 1.0, 3.5], [1.0, 1.5, 4.5], 1, 0.5, "mean")
+        sums = core.cell_aggregates(array, [1.0, 1.0, 3.5], [1.0, 1.5, 4.5], 1, 0.5, "sum")
+        self.assertAlmostEqual(means[0], array[:2, 0:2].mean())
+        self.assertAlmostEqual(sums[1], array[:2, 1].sum())
+        self.assertAlmostEqual(sums[0], (array[:2, 0].sum() + array[:2, 1].sum()) / 2)
+        self.assertTrue(np.isnan(means[2]))
+
+    def test_cell_half_size_uses_the_finer_pixel_side(self):
+        self.assertEqual(core.cell_half_size(3, 2.0, 4.0), (0.75, 1.5))
+
+    def test_window_pixels_are_centered_on_the_samples(self):
+        cx, cy = core.grid_cells(*core.grid_axes(1000.3, 1030.0, 52.1, 70.0, 1.4))
+        x_min, y_max, rows, cols = core.window_pixels(cx, cy, 0.7, 0.35)
+        np.testing.assert_allclose(x_min + (cols + 0.5) * 0.7, cx)
+        np.testing.assert_allclose(y_max - (rows + 0.5) * 0.35, cy)
+        self.assertEqual((cols.min(), rows.min()), (0, 0))
+
+
+class ArrayRasterTest(unittest.TestCase):
+
+    def test_values_at_pixel_centers_and_outside(self):
+        raster = core.ArrayRaster(np.arange(12.0).reshape(3, 4), 100, 50, 10, 5, no_data=5)
+        values = raster.values_at([105, 135, 115, 99, 105], [47.5, 37.5, 42.5, 47.5, 51])
+        np.testing.assert_array_equal(values, [0, 11, np.nan, np.nan, np.nan])
+
+    def test_from_geotransform(self):
+        raster = core.ArrayRaster.from_geotransform(np.ones((2, 2)), (10, 2, 0, 20, 0, -3))
+        self.assertEqual((raster.x_min, raster.y_max, raster.x_res, raster.y_res), (10, 20, 2, 3))
+
+
+class PointBufferTest(unittest.TestCase):
+
+    def test_appends_across_chunks(self):
+        buffer = core.PointBuffer({"key": np.int64}, chunk_size=4)
+        buffer.append(np.arange(6.0), -np.arange(6.0), key=7)
+        buffer.append_point(6.0, -6.0, key=8)
+        buffer.append([7.0, 8.0], [-7.0, -8.0])
+        self.assertEqual(len(buffer), 9)
+        xs, ys = buffer.to_arrays()
+        np.testing.assert_array_equal(xs, np.arange(9.0))
+        np.testing.assert_array_equal(ys, -np.arange(9.0))
+        np.testing.assert_array_equal(buffer.column("key"), [7] * 6 + [8, 0, 0])
+        with self.assertRaises(ValueError):
+            buffer.append([1.0], [1.0], other=1)
+
+    def test_drain_empties_the_buffer(self):
+        buffer = core.PointBuffer(chunk_size=3)
+        buffer.append(np.arange(7.0), np.arange(7.0))
+        sizes = [x.size for x, _, _ in buffer.drain()]
+        self.assertEqual(sizes, [3, 3, 1])
+        self.assertEqual(len(buffer), 0)
+        buffer.append([1.0], [2.0])
+        np.testing.assert_array_equal(buffer.to_arrays(release=True)[1], [2.0])
+        self.assertEqual(len(buffer), 0)
+
+    def test_point_wkb(self):
+        wkb = core.point_wkb(np.array([1.5, -2.0]), np.array([3.25, 4.0]))
+        self.assertEqual(len(wkb), 2 * core.WKB_POINT.itemsize)
+        self.assertEqual(struct.unpack("<BIdd", wkb[:21]), (1, 1, 1.5, 3.25))
+        self.assertEqual(struct.unpack("<BIdd", wkb[21:]), (1, 1, -2.0, 4.0))
+
+    def test_multipoint_wkb(self):
+        wkb = core.multipoint_wkb(np.array([1.5, -2.0]), np.array([3.25, 4.0]))
+        self.assertEqual(len(wkb), 9 + 2 * core.WKB_POINT.itemsize)
+        self.assertEqual(struct.unpack("<BII", wkb[:9]), (1, 4, 2))
+        self.assertEqual(wkb[9:], core.point_wkb(np.array([1.5, -2.0]), np.array([3.25, 4.0])))
+
+
+class AllocationTest(unittest.TestCase):
+
+    def test_allocate_total_is_exact(self):
+        rng = np.random.default_rng(1)
+        weights = rng.random(1000) * (rng.random(1000) > 0.3)
+        counts = core.allocate_total(weights, 123457, rng)
+        self.assertEqual(counts.sum(), 123457)
+        self.assertFalse(counts[weights == 0].any())
+
+    def test_allocate_without_weight_places_nothing(self):
+        counts = core.allocate_total(np.zeros(5), 10, np.random.default_rng(0))
+        self.assertEqual(counts.sum(), 0)
+
+    def test_sample_polygon_total_places_exactly_total_inside(self):
+        rings = star(300.0, 300.0, 280.0)
+        edges = core.polygon_edges(rings)
+        raster = core.ArrayRaster(np.random.default_rng(2).gamma(0.5, 2000, (600, 600)), 0, 600, 1, 1)
+        x_min, x_max, y_min, y_max = polygon_bounds(rings)
+        for total in (1, 5000, 250000):
+            tiles = list(core.sample_polygon_total(
+                edges, x_min, x_max, y_min, y_max, 0.5, raster.values_at, total, 3, 17))
+            xs = np.concatenate([tile[2] for tile in tiles])
+            ys = np.concatenate([tile[3] for tile in tiles])
+            self.assertEqual(xs.size, total)
+            self.assertTrue(contains(rings, xs, ys).all())
+
+    def test_generate_points_totals_per_key(self):
+        polygons = [(1, star(100.0, 100.0, 80.0)), (2, star(300.0, 100.0, 80.0))]
+        raster = core.ArrayRaster(np.ones((200, 400)), 0, 200, 1, 1)
+        xs, _ = core.generate_points(polygons, raster.values_at, RANGES, 2.0, seed=4, totals={1: 700, 2: 300})
+        self.assertEqual(xs.size, 1000)
+        self.assertEqual((xs < 200).sum(), 700)
+
+
+class ReproducibilityTest(unittest.TestCase):
+
+    def setUp(self):
+        self.raster = core.ArrayRaster(np.random.default_rng(5).gamma(0.5, 2000, (400, 400)), 0, 400, 1, 1)
+        self.polygons = [(key, star(100.0 + 200 * (key % 2), 100.0 + 200 * (key // 2), 90.0)) for key in range(4)]
+
+    def test_tile_rng_streams(self):
+        a = core.tile_rng(42, 7, 1, 2).random(5)
+        np.testing.assert_array_equal(a, core.tile_rng(42, 7, 1, 2).random(5))
+        self.assertFalse(np.array_equal(a, core.tile_rng(42, 7, 2, 1).random(5)))
+        self.assertFalse(np.array_equal(a, core.tile_rng(43, 7, 1, 2).random(5)))
+        self.assertFalse(np.array_equal(a, core.tile_rng(42, 8, 1, 2).random(5)))
+        np.testing.assert_array_equal(a, core.tile_rng(42, 7, 1, 2, surface=0).random(5))
+        self.assertFalse(np.array_equal(a, core.tile_rng(42, 7, 1, 2, surface=1).random(5)))
+
+    def test_sample_grid_is_reproducible(self):
+        rings = star(50.0, 50.0, 45.0)
+        edges = core.polygon_edges(rings)
+        grid_x, grid_y = core.grid_axes(*polygon_bounds(rings), 1.5)
+        table = core.DensityRangeTable(RANGES)
+
+        def values_at(xs, ys):
+            return 100 + 50 * xs
+
+        first = core.sample_grid(edges, grid_x, grid_y, 1.5, values_at, table, core.tile_rng(9, 1))
+        second = core.sample_grid(edges, grid_x, grid_y, 1.5, values_at, table, core.tile_rng(9, 1))
+        self.assertGreater(first[0].size, 0)
+        np.testing.assert_array_equal(first[0], second[0])
+        np.testing.assert_array_equal(first[1], second[1])
+        self.assertTrue(contains(rings, first[0], first[1]).all())
+
+    def test_same_seed_same_points(self):
+        first = core.generate_points(self.polygons, self.raster.values_at, RANGES, 1.5, seed=11)
+        second = core.generate_points(self.polygons, self.raster.values_at, RANGES, 1.5, seed=11)
+        other = core.generate_points(self.polygons, self.raster.values_at, RANGES, 1.5, seed=12)
+        self.assertGreater(first[0].size, 0)
+        np.testing.assert_array_equal(first[0], second[0])
+        np.testing.assert_array_equal(first[1], second[1])
+        self.assertFalse(np.array_equal(first[0][:100], other[0][:100]))
+
+    def test_points_do_not_depend_on_polygon_order(self):
+        forward = {}
+        backward = {}
+        core.generate_points(self.polygons, self.raster.values_at, RANGES, 1.5, seed=11,
+                             on_chunk=lambda key, x, y: forward.setdefault(key, []).append(x))
+        core.generate_points(self.polygons[::-1], self.raster.values_at, RANGES, 1.5, seed=11,
+                             on_chunk=lambda key, x, y: backward.setdefault(key, []).append(x))
+        for key in forward:
+            np.testing.assert_array_equal(np.concatenate(forward[key]), np.concatenate(backward[key]))
+
+    def test_points_are_inside(self):
+        xs, ys = core.generate_points(self.polygons, self.raster.values_at, RANGES, 1.5, seed=3)
+        rings = [ring for _, polygon in self.polygons for ring in polygon]
+        self.assertTrue(contains(rings, xs, ys).all())
+
+    def test_surfaces_share_cells_and_keep_their_streams(self):
+        rings = self.polygons[1][1]
+        edges = core.polygon_edges(rings)
+        bounds = polygon_bounds(rings)
+        table = core.DensityRangeTable(RANGES)
+        other = core.ArrayRaster(np.full((400, 400), 5000.0), 0, 400, 1, 1)
+        single = list(core.sample_polygon(edges, *bounds, 1.5, self.raster.values_at, table, 11, 1))
+        multi = list(core.sample_polygon_surfaces(
+            edges, *bounds, 1.5, [(self.raster.values_at, table), (other.values_at, table)], 11, 1))
+        first = [tile for tile in multi if tile[2] == 0]
+        second = [tile for tile in multi if tile[2] == 1]
+        np.testing.assert_array_equal(
+            np.concatenate([tile[3] for tile in first]), np.concatenate([tile[2] for tile in single]))
+        second_x = np.concatenate([tile[3] for tile in second])
+        self.assertGreater(second_x.size, 0)
+        self.assertTrue(contains(rings, second_x, np.concatenate([tile[4] for tile in second])).all())
+
+    def test_cell_grid_redraws_the_same_points(self):
+        grid = core.CellGrid()
+        full = core.generate_points(self.polygons, self.raster.values_at, RANGES, 1.5, seed=8, cell_grid=grid)
+        self.assertTrue(grid.complete)
+        redrawn = core.generate_points(self.polygons, None, RANGES, 1.5, seed=8, cell_grid=grid)
+        np.testing.assert_array_equal(full[0], redrawn[0])
+        np.testing.assert_array_equal(full[1], redrawn[1])
+
+
+if __name__ == "__main__":
+    unittest.main()